@@ -2,10 +2,10 @@
 import math
 import pandas as pd
 import numpy as np
-import matplotlib.pyplot as plt
-import matplotlib as mpl
 import datetime
-import re
+import functools
+
+from analizer.summary import Summary, summarize_days
 
 # Settings And Const
 TYPE_FOR_BALANCE = "balance"
@@ -22,6 +22,21 @@ COMMENT_PATTERN_FOR_CANCELS = 'canceled'
 OPEN_NEW_ORDER_PRICE_DELTA_PIPS = 180 # Eve average position when price goes more then 180 pips
 XAU_PIP_USD = 0.01 # 1 pip = 0.01 for XAU
 
+GRID_AGG_FUNCTIONS = {
+    'OPEN_DT': 'min',
+    'CLOSE_DT': 'max',
+    'ORDER_ID': 'count',
+    'PROFIT': 'sum',
+    'DK_GRID_OPEN_QTY': 'min',
+    'QTY': 'sum',
+    'OPEN_PRICE': 'first',
+    'DK_GRID_LAST_PRICE': 'last',
+    'DK_OPEN_VALUE': 'sum',
+    'DK_WORST_PRICE': 'last',
+    'DK_BALANCE_IN': 'first',
+    'DK_DURATION_TD': 'sum',
+}
+
 QTY_FACTOR_FOR_AVERAGE = 1.65 #todo Must use table
 EVE_MAX_ORDER_COUNT = 20
 
@@ -66,32 +81,36 @@ QTY_INCREASE_FACTORS = {
 }
 
 
-def set_grid_id_by_one_side_start(df: pd.DataFrame, grid_id_col_name: str) -> pd.DataFrame:
+def set_grid_id_by_one_side_start(df: pd.DataFrame, grid_id_col_name: str, net_id_sell=None, net_id_buy=None) -> pd.DataFrame:
     '''
         Set GRID_ID for all orders in df.
         New GRID_ID generates when order has "Start" mark inside COMMENT. 
         And it applies for all next orders of the same side until new "Start" mark comes.
+        net_id_sell and net_id_buy are GRID_IDs of grids started before df, e.g. by previously processed orders.
 
         It's BEST method for one side grids.
     '''
 
     df_res = df.copy()
 
-    net_id_sell, net_id_buy = None, None
-    net_id_list = []
-    for i, row in df_res.iterrows():
-        if COMMENT_PATTERN_FOR_START_ORDERS in row['COMMENT']:
-            if COMMENT_PATTERN_FOR_SELL_ORDERS in row['COMMENT']:
-                net_id_sell = row['ORDER_ID']
-            if COMMENT_PATTERN_FOR_BUY_ORDERS in row['COMMENT']:
-                net_id_buy = row['ORDER_ID']
-
-        if COMMENT_PATTERN_FOR_SELL_ORDERS in row['COMMENT']:
-            net_id_list.append(net_id_sell if net_id_sell is not None else row['ORDER_ID']) 
-        if COMMENT_PATTERN_FOR_BUY_ORDERS in row['COMMENT']:
-            net_id_list.append(net_id_buy if net_id_buy is not None else row['ORDER_ID']) 
-        
-    df_res[grid_id_col_name] = net_id_list
+    comments = df_res['COMMENT'].astype(str)
+    is_start = comments.str.contains(COMMENT_PATTERN_FOR_START_ORDERS, regex=False)
+    is_sell = comments.str.contains(COMMENT_PATTERN_FOR_SELL_ORDERS, regex=False)
+    is_buy = comments.str.contains(COMMENT_PATTERN_FOR_BUY_ORDERS, regex=False)
+
+    # Last "Start" ORDER_ID of every side is carried forward until the next "Start" of the same side.
+    # Orders placed before the first "Start" of their side become a grid of their own.
+    start_id_sell = df_res['ORDER_ID'].where(is_start & is_sell).ffill()
+    start_id_buy = df_res['ORDER_ID'].where(is_start & is_buy).ffill()
+    if net_id_sell is not None:
+        start_id_sell = start_id_sell.fillna(net_id_sell)
+    if net_id_buy is not None:
+        start_id_buy = start_id_buy.fillna(net_id_buy)
+
+    net_id_sell = start_id_sell.fillna(df_res['ORDER_ID'])
+    net_id_buy = start_id_buy.fillna(df_res['ORDER_ID'])
+
+    df_res[grid_id_col_name] = net_id_sell.where(is_sell, net_id_buy).astype(df_res['ORDER_ID'].dtype)
 
     return df_res
 
@@ -103,6 +122,10 @@ def set_grid_id_by_timeline_emulating(df: pd.DataFrame, grid_id_col_name: str) -
         It applies for all next orders until net has at least 1 order.
         When net becomes empty new GRID_ID will be generate.
 
+        Timeline is emulated as a sweep over open (+1) and close (-1) events sorted once by DT.
+        Opens go before closes at the same DT, so order opened at the moment of other order close joins its grid.
+        Running sum of events is a count of open orders. Grid starts at every open event when count was 0.
+
         Pros: Usually one side grid closes when opposite side is still open. And this situation repeats often.
               So grids become huge - more than 20 orders.
               I guess that grid is order with same side.
@@ -111,35 +134,36 @@ def set_grid_id_by_timeline_emulating(df: pd.DataFrame, grid_id_col_name: str) -
     '''    
 
     df_res = df.copy()
-    df_timeline = pd.DataFrame(columns=['ORDER_ID', 'DT', 'EVENT']) # Event 0-open, 1-close
+    orders_cnt = len(df_res)
+    if orders_cnt == 0:
+        df_res[grid_id_col_name] = df_res['ORDER_ID']
+        return df_res
 
-    # Place orders at open and close timeline
-    for order_id, open_dt, close_dt in zip(df_res['ORDER_ID'], df_res['OPEN_DT'], df_res['CLOSE_DT']):
-        event = {'ORDER_ID': order_id, 'DT': open_dt, 'EVENT': 0}
-        df_timeline.loc[len(df_timeline)] = event
+    order_ids = df_res['ORDER_ID'].to_numpy()
+    order_idx = np.arange(orders_cnt)
 
-        event = {'ORDER_ID': order_id, 'DT': close_dt, 'EVENT': 1}
-        df_timeline.loc[len(df_timeline)] = event
+    # Place orders at open and close timeline. Event 0-open, 1-close
+    event_dt = np.concatenate([df_res['OPEN_DT'].to_numpy(), df_res['CLOSE_DT'].to_numpy()])
+    event_type = np.concatenate([np.zeros(orders_cnt, dtype=np.int8), np.ones(orders_cnt, dtype=np.int8)])
+    event_order_idx = np.concatenate([order_idx, order_idx])
+    event_sort_key = np.concatenate([order_ids, order_ids])
 
-    df_timeline = df_timeline.sort_values(['DT', 'EVENT'], ascending=True)
+    events = np.lexsort((event_sort_key, event_type, event_dt))
+    event_type = event_type[events]
+    event_order_idx = event_order_idx[events]
 
     # Emulates opening and closing deal in net
-    grid_curr = []
-    grid_full = []
-    grid_id = None
-    for i, row in df_timeline.iterrows():
-        if len(grid_curr) == 0:
-            if grid_id is not None:
-                df_res.loc[df_res['ORDER_ID'].isin(grid_full), [grid_id_col_name]] = grid_id
-                grid_full = []
-
-            grid_id = row['ORDER_ID']
-
-        if row['EVENT'] == 0:
-            grid_curr.append(row['ORDER_ID'])
-            grid_full.append(row['ORDER_ID'])
-        else:
-            grid_curr = list(filter(lambda i: i == row['ORDER_ID'], grid_curr))
+    event_delta = np.where(event_type == 0, 1, -1)
+    open_cnt_before = np.cumsum(event_delta) - event_delta
+    is_grid_start = (event_type == 0) & (open_cnt_before == 0)
+    event_grid_num = np.cumsum(is_grid_start) - 1
+
+    is_open = event_type == 0
+    grid_first_order_idx = event_order_idx[is_grid_start]
+    order_grid_num = np.empty(orders_cnt, dtype=np.int64)
+    order_grid_num[event_order_idx[is_open]] = event_grid_num[is_open]
+
+    df_res[grid_id_col_name] = order_ids[grid_first_order_idx[order_grid_num]]
 
     return df_res
 
@@ -164,34 +188,53 @@ def set_worst_grid_price(df: pd.DataFrame, new_col_name: str) -> pd.DataFrame:
     df_res = df.copy()
 
     df_res = df_res.sort_values(by=['DK_GRID_ID', 'ORDER_ID'], ascending=False)
-    worst_price_list = []
-    net_id_prev = None
-    open_price_prev = None
-    for (net_id, open_price, side) in zip(df_res['DK_GRID_ID'], df_res['OPEN_PRICE'], df_res['SIDE']):
-        if net_id == net_id_prev:
-            worst_price_list.append(open_price_prev)
-        else:
-            max_price_delta = (OPEN_NEW_ORDER_PRICE_DELTA_PIPS - 1) * XAU_PIP_USD
-            if side == 'buy': 
-                max_price_delta = -1 * max_price_delta
-            worst_price_list.append(open_price + max_price_delta)
-
-        open_price_prev = open_price
-        net_id_prev = net_id
-
-    df_res[new_col_name] = worst_price_list
+
+    # Worst price of order is open price of next order in the same grid.
+    # Last order of grid has no next one, so its worst price is delta pips away from its open price.
+    max_price_delta = (OPEN_NEW_ORDER_PRICE_DELTA_PIPS - 1) * XAU_PIP_USD
+    max_price_delta = np.where(df_res['SIDE'] == 'buy', -1 * max_price_delta, max_price_delta)
+    next_open_price = df_res.groupby('DK_GRID_ID', sort=False)['OPEN_PRICE'].shift(1)
+
+    df_res[new_col_name] = next_open_price.fillna(df_res['OPEN_PRICE'] + max_price_delta)
     return df_res
 
 
-def delete_canceled_trans_from_df(df: pd.DataFrame) -> pd.DataFrame:
-    """Some DF has canceled transactions. Every cancellation consists 2 transaction with opposite signs, e.g.:
+def get_canceled_trans_pairs(df: pd.DataFrame) -> pd.DataFrame:
+    """Finds pairs of canceled transactions. Every cancellation consists 2 transaction with opposite signs, e.g.:
     1st transation comment = 'Withdraw CCTT #21197003'
     2nd transation comment = 'Withdraw canceled 21197003'
 
     To find all pairs of these transactions:
-        1. Find all trans with keyword 'canceled'
-        2. Parse only numbers from that comments.
-        3. Find trans with found number in comment.
+        1. Parse transaction number from comments of all balance trans once.
+        2. Find all trans with keyword 'canceled'.
+        3. Join other balance trans to them by transaction number.
+
+    Args:
+        df (pd.DataFrame): Source DF
+
+    Returns:
+        pd.DataFrame: Pairs with cols DK_TRANS_CODE, ORDER_ID (canceled trans) and DK_CANCEL_ORDER_ID (cancellation trans)
+    """
+    df_balance = df[df['SIDE'] == TYPE_FOR_BALANCE]
+    df_balance = pd.DataFrame({
+        'ORDER_ID': df_balance['ORDER_ID'],
+        'DK_TRANS_CODE': pd.to_numeric(df_balance['COMMENT'].str.extract('([0-9]+)', expand=False)).astype('Int64'),
+        'DK_IS_CANCEL': df_balance['COMMENT'].str.contains(COMMENT_PATTERN_FOR_CANCELED, regex=False),
+    }).dropna(subset=['DK_TRANS_CODE'])
+
+    df_cancels = df_balance[df_balance['DK_IS_CANCEL']]
+    df_canceled = df_balance[~df_balance['DK_IS_CANCEL']]
+
+    df_pairs = pd.merge(df_canceled[['DK_TRANS_CODE', 'ORDER_ID']],
+                        df_cancels[['DK_TRANS_CODE', 'ORDER_ID']].rename(columns={'ORDER_ID': 'DK_CANCEL_ORDER_ID'}),
+                        on='DK_TRANS_CODE', how='inner')
+
+    return df_pairs.reset_index(drop=True)
+
+
+def delete_canceled_trans_from_df(df: pd.DataFrame) -> pd.DataFrame:
+    """Some DF has canceled transactions. Deletes both transactions of every cancellation pair found by get_canceled_trans_pairs.
+    Cancellation trans without pair are deleted too.
 
     Args:
         df (pd.DataFrame): Source DF
@@ -200,16 +243,12 @@ def delete_canceled_trans_from_df(df: pd.DataFrame) -> pd.DataFrame:
         pd.DataFrame: DF without canceled trans
     """    
     
-    df_cancels = df.copy()
-    df_cancels = df_cancels[df_cancels['COMMENT'].str.contains(COMMENT_PATTERN_FOR_CANCELED)]
-    trans_codes_list = [re.findall('[0-9]+', comment)[0] for comment in df_cancels['COMMENT']]
+    df_pairs = get_canceled_trans_pairs(df)
+    df_cancels = df[(df['SIDE'] == TYPE_FOR_BALANCE) & df['COMMENT'].str.contains(COMMENT_PATTERN_FOR_CANCELED, regex=False)]
 
-    df_cancels = df.copy()
-    df_cancels['DELETED'] = 0
-    for trans_code in trans_codes_list:
-        df_cancels.loc[(df_cancels['COMMENT'].str.contains(trans_code, regex=False)), 'DELETED'] = 1
+    deleted_order_ids = set(df_pairs['ORDER_ID']) | set(df_cancels['ORDER_ID'])
 
-    return df_cancels[df_cancels['DELETED'] == 0]
+    return df[~df['ORDER_ID'].isin(deleted_order_ids)]
 
 def calc_balance(df: pd.DataFrame) -> pd.DataFrame:
     """ Add columns of DK_BALANCE_IN and DK_BALANCE_OUT calculated as cumsum of DK_TRANS
@@ -248,12 +287,14 @@ def calc_balance(df: pd.DataFrame) -> pd.DataFrame:
     return df_res
 
 
-def extend_with_grid_details(df: pd.DataFrame) -> pd.DataFrame:
+def extend_with_grid_details(df: pd.DataFrame, set_grid_id_func=set_grid_id_by_one_side_start) -> pd.DataFrame:
     '''
         Extends every order in source df with grid details:
         - DK_GRID_ID - unique grid id
         - DK_GRIP_QTY - cumulative grid qty for current order
         - DK_OPEN_VALUE - cumulative grid value for current order
+
+        set_grid_id_func sets DK_GRID_ID: set_grid_id_by_one_side_start (default) or set_grid_id_by_timeline_emulating
     '''
 
     df_res = df.copy()
@@ -264,7 +305,7 @@ def extend_with_grid_details(df: pd.DataFrame) -> pd.DataFrame:
     df_res = df_res[df_res['COMMENT'].str.contains(COMMENT_PATTERN_FOR_ORDERS_ONLY, regex=False)]
     df_res = df_res.sort_values(by=['OPEN_DT', 'ORDER_ID'], ascending=True)
 
-    df_res = set_grid_id_by_one_side_start(df_res, 'DK_GRID_ID')
+    df_res = set_grid_id_func(df_res, 'DK_GRID_ID')
     df_res = set_cum_of_grids(df_res, 'DK_GRID_ID', 'QTY', 'DK_GRID_QTY')
     df_res = set_cum_of_grids(df_res, 'DK_GRID_ID', 'DK_OPEN_VALUE', 'DK_GRID_VALUE')
 
@@ -289,6 +330,53 @@ def extend_with_grid_details(df: pd.DataFrame) -> pd.DataFrame:
     return df_res
 
 
+@functools.lru_cache
+def get_worst_case_qty_tables(max_order_count: int = EVE_MAX_ORDER_COUNT) -> tuple[np.ndarray, np.ndarray]:
+    '''
+        Tables of QTY_INCREASE_FACTORS for worst case model up to max_order_count order:
+        - qty_cumprod[i] - qty of (i + 1)th order relative to 1st order, i.e. product of factors 1..i
+        - qty_cumprod_cumsum[i] - sum of qty_cumprod[0..i-1], qty_cumprod_cumsum[0] = 0
+
+        Factors after the last one in QTY_INCREASE_FACTORS are QTY_FACTOR_FOR_AVERAGE.
+    '''
+    factors = [QTY_INCREASE_FACTORS.get(i, QTY_FACTOR_FOR_AVERAGE) for i in range(1, max_order_count)]
+    qty_cumprod = np.cumprod([1.0] + factors)
+    qty_cumprod_cumsum = np.concatenate([[0.0], np.cumsum(qty_cumprod)])
+
+    qty_cumprod.flags.writeable = False
+    qty_cumprod_cumsum.flags.writeable = False
+    return qty_cumprod, qty_cumprod_cumsum
+
+
+def calc_drawdown_for_max_grid_order(grid_order_cnt: np.ndarray, last_price: np.ndarray, open_value: np.ndarray, qty: np.ndarray,
+                                     max_order_count: int = EVE_MAX_ORDER_COUNT) -> np.ndarray:
+    '''
+        Calculate for every grid potential drawdown of max order in grid if price will go worst case every next step.
+        Every next order opens by (OPEN_NEW_ORDER_PRICE_DELTA_PIPS - 1) pips worse with qty increased by QTY_INCREASE_FACTORS.
+
+        For grid of n orders and m = max_order_count - n next orders with relative qty R_j (R_0 = 1):
+        - curr_qty = qty * R_m
+        - curr_value = open_value + qty * (last_price * (R_m - 1) + kp * (m * R_m - sum(R_0..R_m-1)))
+        - drawdown = abs(curr_value - curr_qty * (last_price + (m + 1) * kp))
+        So all grids are calculated at once by lookups in get_worst_case_qty_tables.
+    '''
+    kp = (OPEN_NEW_ORDER_PRICE_DELTA_PIPS - 1) * XAU_PIP_USD
+    qty_cumprod, qty_cumprod_cumsum = get_worst_case_qty_tables(max_order_count)
+
+    n = np.clip(np.asarray(grid_order_cnt, dtype=np.int64), 1, max_order_count)
+    m = max_order_count - n
+
+    qty_cumprod_start = qty_cumprod[n - 1]
+    r_m = qty_cumprod[max_order_count - 1] / qty_cumprod_start
+    r_sum = (qty_cumprod_cumsum[max_order_count - 1] - qty_cumprod_cumsum[n - 1]) / qty_cumprod_start
+
+    curr_qty = qty * r_m
+    curr_value = open_value + qty * (last_price * (r_m - 1) + kp * (m * r_m - r_sum))
+    curr_price = last_price + m * kp
+
+    return np.abs(curr_value - curr_qty * (curr_price + kp))
+
+
 def get_grids(df_orders: pd.DataFrame) -> pd.DataFrame:
     """Return df with only with grids
 
@@ -305,20 +393,20 @@ def get_grids(df_orders: pd.DataFrame) -> pd.DataFrame:
     df_grids['DK_GRID_LAST_PRICE'] = df_grids['OPEN_PRICE']
     df_grids['DK_GRID_OPEN_QTY'] = df_grids['QTY']
 
-    df_grids = df_grids.groupby(['DK_GRID_ID']).agg({
-        'OPEN_DT': 'min',
-        'CLOSE_DT': 'max',
-        'ORDER_ID': 'count',
-        'PROFIT': 'sum',
-        'DK_GRID_OPEN_QTY': 'min',
-        'QTY': 'sum',
-        'OPEN_PRICE': 'first',
-        'DK_GRID_LAST_PRICE': 'last',
-        'DK_OPEN_VALUE': 'sum',
-        'DK_WORST_PRICE': 'last',
-        'DK_BALANCE_IN': 'first',
-        'DK_DURATION_TD': 'sum',
-    }).reset_index()
+    df_grids = df_grids.groupby(['DK_GRID_ID']).agg(GRID_AGG_FUNCTIONS).reset_index()
+
+    return calc_grid_details(df_grids)
+
+
+def calc_grid_details(df_grids: pd.DataFrame) -> pd.DataFrame:
+    """Extends grids aggregated by GRID_AGG_FUNCTIONS with drawdown, equity and lot details
+
+    Args:
+        df_grids (pd.DataFrame): Grids dataframe
+
+    Returns:
+        pd.DataFrame: Nets dataframe sorted by OPEN_DT
+    """
 
     df_grids['DK_GRID_AVG_PRICE'] = df_grids['DK_OPEN_VALUE'] / df_grids['QTY']
     df_grids['DK_DRAWDOWN'] = abs(df_grids['QTY'] * (df_grids['DK_WORST_PRICE']) - df_grids['DK_OPEN_VALUE'])  
@@ -326,25 +414,10 @@ def get_grids(df_orders: pd.DataFrame) -> pd.DataFrame:
     df_grids['DK_DRAWDOWN_RATIO'] = df_grids['DK_DRAWDOWN'] / df_grids['DK_BALANCE_IN']
     df_grids = df_grids.sort_values(by='DK_DRAWDOWN_RATIO', ascending=False)
 
-    def calc_drawdown_for_max_grid_order(r):
-        '''
-        Calculate for one given grid potential drawdown of max order in grid if price will go worst case every next step
-        '''
-        kp = (OPEN_NEW_ORDER_PRICE_DELTA_PIPS - 1) * XAU_PIP_USD
-        
-        curr_price = r['DK_GRID_LAST_PRICE']
-        curr_value = r['DK_OPEN_VALUE']
-        curr_qty = r['QTY']
-        for i in range(r['ORDER_ID'] + 1, EVE_MAX_ORDER_COUNT + 1):
-            kq = QTY_INCREASE_FACTORS[i - 1]
-
-            curr_price = curr_price + kp
-            curr_value = curr_value + (curr_price) * (curr_qty * kq - curr_qty)
-            curr_qty = curr_qty * kq
-
-        return abs(curr_value - curr_qty * (curr_price + kp))
-
-    df_grids['DK_DRAWDOWN_20'] = df_grids.apply(calc_drawdown_for_max_grid_order, axis = 1)
+    df_grids['DK_DRAWDOWN_20'] = calc_drawdown_for_max_grid_order(grid_order_cnt=df_grids['ORDER_ID'].to_numpy(),
+                                                                  last_price=df_grids['DK_GRID_LAST_PRICE'].to_numpy(),
+                                                                  open_value=df_grids['DK_OPEN_VALUE'].to_numpy(),
+                                                                  qty=df_grids['QTY'].to_numpy())
     df_grids['DK_DRAWDOWN_20_RATIO'] = df_grids['DK_DRAWDOWN_20'] / df_grids['DK_BALANCE_IN']
     df_grids['DK_EQUITY_20'] = df_grids['DK_BALANCE_IN'] - df_grids['DK_DRAWDOWN_20']
 
@@ -364,76 +437,165 @@ def get_summary(df_full: pd.DataFrame, df_orders: pd.DataFrame, df_grids: pd.Dat
         pd.DataFrame: Summary dataframe
     """
 
-    df_sum = df_full.copy()
+    return calc_summaries(df_full=df_full, df_orders=df_orders, df_grids=df_grids)[0].to_frame()
 
-    df_sum['DAYS'] = df_sum['OPEN_DT'].dt.date
-    df_sum['BALANCE'] = df_sum['DK_BALANCE_IN']
-    df_sum['HAS_ORDER_PROFIT'] = 0
 
-    df_sum.loc[df_sum['PROFIT'] >= 0, ['HAS_ORDER_PROFIT']] = 1
-    df_sum['AVG_ORDER_PROFIT'] = df_sum['PROFIT']
-    df_sum.loc[df_sum['PROFIT'] >= 0, ['MAX_ORDER_PROFIT']] = df_sum['PROFIT']
-    df_sum.loc[(df_sum['PROFIT'] < 0), ['MAX_ORDER_LOSS']] = df_sum['PROFIT']
+def calc_summaries(df_full: pd.DataFrame, df_orders: pd.DataFrame, df_grids: pd.DataFrame, windows: list[tuple] = None) -> list[Summary]:
+    """ Calc summary info for account for many date ranges in one call.
+    Trans and grids are rolled up by days once and all windows are summarized by summarize_days.
+    GRID_CNT is count of grids which have orders in window.
 
-    df_sum = df_sum.groupby(lambda x: True).agg({
-        'DAYS': pd.Series.nunique,
-        'BALANCE': 'last',
+    Args:
+        df_full (pd.DataFrame): Full dataframe with balance
+        df_orders (pd.DataFrame): Orders dataframe
+        df_grids (pd.DataFrame): Grids dataframe
+        windows (list[tuple], optional): List of (start_date, finish_date). Defaults to None means all days.
+
+    Returns:
+        list[Summary]: Summary for every window
+    """
+
+    df_daily = calc_daily_rollup(df_full=df_full, df_orders=df_orders, df_grids=df_grids)
+    summaries = summarize_days(df_daily, windows=windows)
+
+    # Unique (grid, day) pairs sorted by day. Grid is counted in window by its first pair in window,
+    # i.e. pair in window with previous day of the same grid before window start
+    df_grid_days = pd.DataFrame({'DK_GRID_ID': df_orders['DK_GRID_ID'].to_numpy(),
+                                 'DAY': df_orders['OPEN_DT'].to_numpy().astype('datetime64[D]')})
+    df_grid_days = df_grid_days.drop_duplicates().sort_values(by=['DK_GRID_ID', 'DAY'])
+    prev_days = df_grid_days.groupby('DK_GRID_ID')['DAY'].shift(1).to_numpy().astype('datetime64[D]')
+    by_day = np.argsort(df_grid_days['DAY'].to_numpy(), kind='stable')
+    grid_days, prev_days = df_grid_days['DAY'].to_numpy()[by_day].astype('datetime64[D]'), prev_days[by_day]
+
+    for summary, (start_date, finish_date) in zip(summaries, windows or [(None, None)]):
+        start = 0 if start_date is None else np.searchsorted(grid_days, np.datetime64(start_date, 'D'), side='left')
+        end = len(grid_days) if finish_date is None else np.searchsorted(grid_days, np.datetime64(finish_date, 'D'), side='right')
+        window_prev_days = prev_days[start:end]
+        is_first_in_window = np.isnat(window_prev_days) if start_date is None else \
+            np.isnat(window_prev_days) | (window_prev_days < np.datetime64(start_date, 'D'))
+        summary.GRID_CNT = int(is_first_in_window.sum())
+
+    return summaries
+
+
+def _sum_with_inf(x: pd.Series) -> float:
+    # Ratios to zero balance are inf. Groupby 'sum' gives NaN for them because of Kahan summation
+    return x.to_numpy().sum()
+
+
+def calc_daily_rollup(df_full: pd.DataFrame, df_orders: pd.DataFrame, df_grids: pd.DataFrame) -> pd.DataFrame:
+    """ Calc per day aggregates which can be summed up to summary of any date range by get_summary_by_days.
+    Trans are grouped by OPEN_DT day, grids are grouped by day of their OPEN_DT.
+    Durations are stored in seconds.
+
+    Args:
+        df_full (pd.DataFrame): Full dataframe with balance
+        df_orders (pd.DataFrame): Orders dataframe
+        df_grids (pd.DataFrame): Grids dataframe
+
+    Returns:
+        pd.DataFrame: Daily rollup dataframe with one row per DAY
+    """
+
+    df_trans = pd.DataFrame({
+        'DAY': df_full['OPEN_DT'].dt.floor('D'),
+        'ORDER_ID': df_full['ORDER_ID'],
+        'DK_DEPOSIT': df_full['DK_DEPOSIT'],
+        'DK_TRANSFER': df_full['DK_TRANSFER'],
+        'DK_WITHDRAWAL': df_full['DK_WITHDRAWAL'],
+        'DK_MISC_TRANS': df_full['DK_MISC_TRANS'],
+        'PROFIT': df_full['PROFIT'],
+        'HAS_ORDER_PROFIT': (df_full['PROFIT'] >= 0).astype(int),
+        'MAX_ORDER_PROFIT': df_full['PROFIT'].where(df_full['PROFIT'] >= 0),
+        'MAX_ORDER_LOSS': df_full['PROFIT'].where(df_full['PROFIT'] < 0),
+        'DK_BALANCE_IN': df_full['DK_BALANCE_IN'],
+        'BALANCE': df_full['DK_BALANCE_IN'],
+        'DK_BALANCE_OUT': df_full['DK_BALANCE_OUT'],
+    })
+    df_daily = df_trans.groupby('DAY').agg({
+        'ORDER_ID': 'count',
         'DK_DEPOSIT': 'sum',
         'DK_TRANSFER': 'sum',
         'DK_WITHDRAWAL': 'sum',
         'DK_MISC_TRANS': 'sum',
         'PROFIT': 'sum',
-        'ORDER_ID': 'count',
         'HAS_ORDER_PROFIT': 'sum',
-        'AVG_ORDER_PROFIT': 'mean',
         'MAX_ORDER_PROFIT': 'max',
         'MAX_ORDER_LOSS': 'min',
+        'DK_BALANCE_IN': 'first',
+        'BALANCE': 'last',
+        'DK_BALANCE_OUT': 'last',
     })
 
-    df_balance_avg = df_orders.copy()
-    df_balance_avg = df_balance_avg.sort_values('OPEN_DT')
-    df_balance_avg['DK_DAY'] = df_balance_avg['OPEN_DT'].dt.date
-    balance_in_day_avg = df_balance_avg.groupby('DK_DAY').agg({
-        'DK_BALANCE_IN': 'first'
-    })['DK_BALANCE_IN'].mean()    
+    df_orders = df_orders.sort_values('OPEN_DT')
+    df_daily['ORDERS_BALANCE_IN'] = df_orders.groupby(df_orders['OPEN_DT'].dt.floor('D'))['DK_BALANCE_IN'].first()
 
     df_grids = df_grids.sort_values(by=['OPEN_DT'])
+    df_grids_daily = pd.DataFrame({
+        'DAY': df_grids['OPEN_DT'].dt.floor('D'),
+        'GRID_CNT': df_grids['DK_GRID_ID'],
+        'GRID_ORDER_CNT': df_grids['ORDER_ID'],
+        'MAX_GRID_ORDER_CNT': df_grids['ORDER_ID'],
+        'GRID_DURATION_SEC': df_grids['DK_DURATION_TD'].dt.total_seconds(),
+        'MIN_GRID_DURATION_SEC': df_grids['DK_DURATION_TD'].dt.total_seconds(),
+        'MAX_GRID_DURATION_SEC': df_grids['DK_DURATION_TD'].dt.total_seconds(),
+        'GRID_PROFIT': df_grids['PROFIT'],
+        'MAX_GRID_PROFIT': df_grids['PROFIT'],
+        'GRID_DRAWDOWN': df_grids['DK_DRAWDOWN'],
+        'MAX_GRID_DRAWDOWN': df_grids['DK_DRAWDOWN'],
+        'GRID_DRAWDOWN_RATIO': df_grids['DK_DRAWDOWN_RATIO'],
+        'MAX_GRID_DRAWDOWN_RATIO': df_grids['DK_DRAWDOWN_RATIO'],
+        'LOT_1000': df_grids['DK_LOT_1000'],
+        'MIN_LOT_1000': df_grids['DK_LOT_1000'],
+        'MAX_LOT_1000': df_grids['DK_LOT_1000'],
+        'LAST_LOT_1000': df_grids['DK_LOT_1000'],
+    }).groupby('DAY').agg({
+        'GRID_CNT': 'count',
+        'GRID_ORDER_CNT': 'sum',
+        'MAX_GRID_ORDER_CNT': 'max',
+        'GRID_DURATION_SEC': 'sum',
+        'MIN_GRID_DURATION_SEC': 'min',
+        'MAX_GRID_DURATION_SEC': 'max',
+        'GRID_PROFIT': 'sum',
+        'MAX_GRID_PROFIT': 'max',
+        'GRID_DRAWDOWN': 'sum',
+        'MAX_GRID_DRAWDOWN': 'max',
+        'GRID_DRAWDOWN_RATIO': _sum_with_inf,
+        'MAX_GRID_DRAWDOWN_RATIO': 'max',
+        'LOT_1000': _sum_with_inf,
+        'MIN_LOT_1000': 'min',
+        'MAX_LOT_1000': 'max',
+        'LAST_LOT_1000': 'last',
+    })
 
-    df_sum['START_DATE'] = df_full['OPEN_DT'].min().date()
-    df_sum['FINISH_DATE'] = df_full['OPEN_DT'].max().date()
-    df_sum['CAL_DAYS'] = (df_full['OPEN_DT'].max().date() - df_full['OPEN_DT'].min().date()).days + 1
-    
-    df_sum['PROFIT_PCT'] = df_sum['PROFIT'] / df_sum['BALANCE']
-    df_sum['OWN_FUNDS'] = max(df_sum['DK_DEPOSIT'][0]+ df_sum['DK_TRANSFER'][0] + df_sum['DK_WITHDRAWAL'][0], 0)
-    df_sum['BALANCE_IN_DAY_AVG'] = balance_in_day_avg
-    df_sum['PROFIT_PER_DAY'] = df_sum['PROFIT'] / df_sum['DAYS']
-    df_sum['PROFIT_PER_CAL_DAY'] = df_sum['PROFIT'] / df_sum['CAL_DAYS']
-    df_sum['ROE'] = df_sum['PROFIT'] / df_sum['BALANCE']
-    df_sum['ROE_DAYS'] = df_sum['BALANCE'] / df_sum['PROFIT_PER_CAL_DAY']
-    df_sum['ROI'] = df_sum['PROFIT'] / df_sum['OWN_FUNDS'][0] if df_sum['OWN_FUNDS'][0] != 0 else 0
-    df_sum['ROI_DAYS'] = df_sum['OWN_FUNDS'] / df_sum['PROFIT_PER_CAL_DAY']
-    df_sum['WIN_RATE'] = df_sum['HAS_ORDER_PROFIT'] / df_sum['ORDER_ID']
-    df_sum['GRID_CNT'] = df_orders['DK_GRID_ID'].nunique()
-    df_sum['MIN_LOT_1000'] = df_grids['DK_LOT_1000'].min()
-    df_sum['AVG_LOT_1000'] = df_grids['DK_LOT_1000'].mean()
-    df_sum['MAX_LOT_1000'] = df_grids['DK_LOT_1000'].max()
-    df_sum['LAST_LOT_1000'] = df_grids.iloc[- 1]['DK_LOT_1000']
-    df_sum['AVG_GRID_ORDER_CNT'] = df_grids['ORDER_ID'].mean()
-    df_sum['MAX_GRID_ORDER_CNT'] = df_grids['ORDER_ID'].max()
-    df_sum['MIN_GRID_DURATION'] = df_grids['DK_DURATION_TD'].min()
-    df_sum['AVG_GRID_DURATION'] = df_grids['DK_DURATION_TD'].mean()
-    df_sum['MAX_GRID_DURATION'] = df_grids['DK_DURATION_TD'].max()
-    df_sum['AVG_GRID_PROFIT'] = df_grids['PROFIT'].mean()
-    df_sum['MAX_GRID_PROFIT'] = df_grids['PROFIT'].max()
-    df_sum['AVG_GRID_DRAWDOWN'] = df_grids['DK_DRAWDOWN'].mean()
-    df_sum['MAX_GRID_DRAWDOWN'] = df_grids['DK_DRAWDOWN'].max()
-    df_sum['AVG_GRID_DRAWDOWN_RATIO'] = df_grids['DK_DRAWDOWN_RATIO'].mean()
-    df_sum['MAX_GRID_DRAWDOWN_RATIO'] = df_grids['DK_DRAWDOWN_RATIO'].max()
-
-    return df_sum
+    df_daily = df_daily.join(df_grids_daily, how='left')
+    df_daily['GRID_CNT'] = df_daily['GRID_CNT'].fillna(0).astype(int)
+    df_daily.index = df_daily.index.date
+    df_daily.index.name = 'DAY'
+
+    return df_daily.reset_index()
+
+
+def get_summary_by_days(df_daily: pd.DataFrame, start_date: datetime.date = None, finish_date: datetime.date = None) -> pd.DataFrame:
+    """ Calc summary info for account for date range based on daily rollup made by calc_daily_rollup.
+    Result has the same cols as get_summary has. 
+    Grids are taken into date range by their OPEN_DT, so GRID_CNT doesn't count grids opened before start_date.
+
+    Args:
+        df_daily (pd.DataFrame): Daily rollup dataframe
+        start_date (datetime.date, optional): First day of range. Defaults to None means first day of rollup
+        finish_date (datetime.date, optional): Last day of range. Defaults to None means last day of rollup
+
+    Returns:
+        pd.DataFrame: Summary dataframe
+    """
+
+    return summarize_days(df_daily, windows=[(start_date, finish_date)])[0].to_frame()
 
 
 def get_summary_chart(df_grids: pd.DataFrame):
+    import matplotlib.pyplot as plt  # Lazy, so statement processing doesn't pay for matplotlib import
+
     df_plot = df_grids.copy()
     df_plot['DT'] = df_plot['OPEN_DT'].dt.date
     df_plot['DK_DRAWDOWN_RATIO'] = df_plot['DK_DRAWDOWN_RATIO'] * 100
@@ -496,6 +658,8 @@ def get_summary_chart(df_grids: pd.DataFrame):
 
 
 def get_worst_equity_20_chart(df_grids: pd.DataFrame):
+    import matplotlib.pyplot as plt
+
     df_worst_grid = df_grids.copy()
     df_worst_grid = df_worst_grid[df_worst_grid['DK_EQUITY_20'] < 0]
     df_worst_grid = df_worst_grid.sort_values(by=['ORDER_ID', 'DK_EQUITY_20'], ascending=[False, True])
@@ -0,0 +1,113 @@
+import numpy as np
+import pandas as pd
+
+import analizer as an
+
+
+TYPE_FOR_SELL = 'sell'
+TYPE_FOR_BUY = 'buy'
+
+# Grid aggregates are stored in a way that they can be combined with aggregates of next orders of the same grid
+GRID_STATE_AGG_FUNCTIONS = {
+    'SIDE': 'first',
+    'OPEN_DT': 'min',
+    'CLOSE_DT': 'max',
+    'LAST_OPEN_DT': 'max',
+    'ORDER_ID': 'sum',
+    'PROFIT': 'sum',
+    'DK_GRID_OPEN_QTY': 'min',
+    'QTY': 'sum',
+    'OPEN_PRICE': 'first',
+    'DK_GRID_LAST_PRICE': 'last',
+    'DK_OPEN_VALUE': 'sum',
+    'DK_BALANCE_IN': 'first',
+}
+
+
+def get_empty_grid_state() -> dict:
+    '''
+        Grid state of account without processed trans:
+        - LAST_ORDER_ID - max processed ORDER_ID
+        - BALANCE - balance after LAST_ORDER_ID, i.e. DK_BALANCE_OUT of it
+        - GRID_ID_SELL, GRID_ID_BUY - last started grid of every side, so next orders of that side can join it
+    '''
+    return {'LAST_ORDER_ID': None, 'BALANCE': 0.0, 'GRID_ID_SELL': None, 'GRID_ID_BUY': None}
+
+
+def update_grid_state(df_new: pd.DataFrame, grid_state: dict, df_open_grids: pd.DataFrame) -> tuple[dict, pd.DataFrame]:
+    '''
+        Applies new trans of one account to its grid state.
+        All trans of df_new must be newer than grid_state['LAST_ORDER_ID'] and have numeric cols casted.
+        Grids of trading trans are set by an.set_grid_id_by_one_side_start continuing GRID_ID_SELL and GRID_ID_BUY.
+
+    Args:
+        df_new (pd.DataFrame): New trans of account
+        grid_state (dict): Current grid state. See get_empty_grid_state()
+        df_open_grids (pd.DataFrame): Stored grids of GRID_ID_SELL and GRID_ID_BUY with GRID_STATE_AGG_FUNCTIONS cols
+
+    Returns:
+        tuple[dict, pd.DataFrame]: New grid state and all grids updated or created by df_new
+    '''
+    df_new = df_new.sort_values(by='ORDER_ID')
+
+    # Convert USDC to USD
+    trans = df_new['PROFIT'] / 100
+    balance_out = grid_state['BALANCE'] + trans.cumsum()
+
+    df_orders = pd.DataFrame({
+        'ORDER_ID': df_new['ORDER_ID'],
+        'SIDE': df_new['SIDE'],
+        'COMMENT': df_new['COMMENT'],
+        'OPEN_DT': df_new['OPEN_DT'],
+        'CLOSE_DT': df_new['CLOSE_DT'],
+        'LAST_OPEN_DT': df_new['OPEN_DT'],
+        'PROFIT': trans,
+        'DK_GRID_OPEN_QTY': df_new['QTY'],
+        'QTY': df_new['QTY'],
+        'OPEN_PRICE': df_new['OPEN_PRICE'],
+        'DK_GRID_LAST_PRICE': df_new['OPEN_PRICE'],
+        'DK_OPEN_VALUE': df_new['OPEN_PRICE'] * df_new['QTY'],
+        'DK_BALANCE_IN': balance_out - trans,
+    })
+    df_orders = df_orders[df_orders['SIDE'].isin([TYPE_FOR_SELL, TYPE_FOR_BUY])]
+    df_orders = df_orders.sort_values(by=['OPEN_DT', 'ORDER_ID'])
+    df_orders = an.set_grid_id_by_one_side_start(df_orders, 'DK_GRID_ID',
+                                                 net_id_sell=grid_state['GRID_ID_SELL'],
+                                                 net_id_buy=grid_state['GRID_ID_BUY'])
+
+    new_grid_state = {
+        'LAST_ORDER_ID': df_new['ORDER_ID'].max() if len(df_new) > 0 else grid_state['LAST_ORDER_ID'],
+        'BALANCE': balance_out.iloc[-1] if len(df_new) > 0 else grid_state['BALANCE'],
+        'GRID_ID_SELL': _get_last_start_order_id(df_orders, an.COMMENT_PATTERN_FOR_SELL_ORDERS, grid_state['GRID_ID_SELL']),
+        'GRID_ID_BUY': _get_last_start_order_id(df_orders, an.COMMENT_PATTERN_FOR_BUY_ORDERS, grid_state['GRID_ID_BUY']),
+    }
+
+    # Every order is a grid of 1 order here, so the same agg functions combine orders and stored grids
+    df_orders['ORDER_ID'] = 1
+    df_open_grids = df_open_grids[df_open_grids['DK_GRID_ID'].isin(df_orders['DK_GRID_ID'])]
+    df_grids = pd.concat([df_open_grids, df_orders[['DK_GRID_ID'] + list(GRID_STATE_AGG_FUNCTIONS.keys())]])
+    df_grids = df_grids.groupby('DK_GRID_ID').agg(GRID_STATE_AGG_FUNCTIONS).reset_index()
+
+    return new_grid_state, df_grids
+
+
+def _get_last_start_order_id(df_orders: pd.DataFrame, side_pattern: str, default):
+    comments = df_orders['COMMENT'].astype(str)
+    is_start = comments.str.contains(an.COMMENT_PATTERN_FOR_START_ORDERS, regex=False) & comments.str.contains(side_pattern, regex=False)
+    return df_orders.loc[is_start, 'ORDER_ID'].iloc[-1] if is_start.any() else default
+
+
+def get_grids_from_state(df_grids: pd.DataFrame) -> pd.DataFrame:
+    '''
+        Converts stored grids to the same grids DataFrame as an.get_grids returns:
+        - DK_WORST_PRICE of grid is worst price of its last order
+        - DK_DURATION_TD of grid is sum of durations between its orders, i.e. time from first to last order open
+    '''
+    df_res = df_grids.copy()
+
+    max_price_delta = (an.OPEN_NEW_ORDER_PRICE_DELTA_PIPS - 1) * an.XAU_PIP_USD
+    df_res['DK_WORST_PRICE'] = df_res['DK_GRID_LAST_PRICE'] + np.where(df_res['SIDE'] == TYPE_FOR_BUY, -1 * max_price_delta, max_price_delta)
+    df_res['DK_DURATION_TD'] = df_res['LAST_OPEN_DT'] - df_res['OPEN_DT']
+
+    df_res = df_res[['DK_GRID_ID'] + list(an.GRID_AGG_FUNCTIONS.keys())]
+    return an.calc_grid_details(df_res)
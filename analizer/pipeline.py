@@ -0,0 +1,179 @@
+import tracemalloc
+import numpy as np
+import pandas as pd
+
+import analizer as an
+
+
+def measure_peak_memory(func, *args, **kwargs) -> tuple:
+    """Runs func and measures peak of memory allocated by Python and numpy during the call
+
+    Returns:
+        tuple: (func result, peak memory in bytes)
+    """
+    is_tracing = tracemalloc.is_tracing()
+    if not is_tracing:
+        tracemalloc.start()
+    tracemalloc.reset_peak()
+
+    try:
+        res = func(*args, **kwargs)
+        _, peak_memory = tracemalloc.get_traced_memory()
+    finally:
+        if not is_tracing:
+            tracemalloc.stop()
+
+    return res, peak_memory
+
+
+class AnalysisPipeline:
+    '''
+        Fused an.calc_balance -> an.extend_with_grid_details -> an.get_grids -> an.get_summary.
+
+        Source trans DataFrame is sorted only once by ORDER_ID and this sorted frame becomes df_full with all
+        balance DK_* cols set in place. Other orders needed by analysis (OPEN_DT, DK_GRID_ID) are kept as
+        permutation indexes over numpy arrays instead of re-sorted copies of the frame.
+        df_orders is taken from df_full only once, already in the final (DK_GRID_ID, ORDER_ID) order.
+
+        Result frames are equal to the step by step functions:
+            pipeline = AnalysisPipeline(df).run(trace_memory=True)
+            pipeline.df_full, pipeline.df_orders, pipeline.df_grids, pipeline.df_sum, pipeline.peak_memory
+        df_sum is calculated on its first access, so callers which summarize by other ways don't pay for it.
+    '''
+
+    def __init__(self, df: pd.DataFrame, set_grid_id_func=an.set_grid_id_by_one_side_start):
+        self.df_source = df
+        self.set_grid_id_func = set_grid_id_func
+
+        self.order_id_permutation = None
+        self.df_full = None
+        self.df_orders = None
+        self.df_grids = None
+        self._df_sum = None
+        self.peak_memory = None
+
+    @property
+    def df_sum(self) -> pd.DataFrame:
+        if self._df_sum is None:
+            self._df_sum = an.get_summary(df_full=self.df_full, df_orders=self.df_orders, df_grids=self.df_grids)
+        return self._df_sum
+
+    def run(self, trace_memory: bool = False) -> 'AnalysisPipeline':
+        if trace_memory:
+            _, self.peak_memory = measure_peak_memory(self._run)
+        else:
+            self._run()
+
+        return self
+
+    def _run(self) -> None:
+        self._calc_balance()
+        self._extend_with_grid_details()
+        self._get_grids()
+
+    def _calc_balance(self) -> None:
+        self.order_id_permutation = np.argsort(self.df_source['ORDER_ID'].to_numpy(), kind='stable')
+        df = self.df_source.take(self.order_id_permutation)  # The only copy of full history
+
+        # Convert USDC to USD
+        trans = df['PROFIT'].to_numpy(dtype=np.float64) / 100
+        is_balance = (df['SIDE'] == an.TYPE_FOR_BALANCE).to_numpy()
+        comments = df['COMMENT'].astype(str)
+
+        deposit = np.where(is_balance & comments.str.contains(an.COMMENT_PATTERN_FOR_DEPOSIT).to_numpy(), trans, 0)
+        transfer = np.where(is_balance & comments.str.contains(an.COMMENT_PATTERN_FOR_TRANSFER).to_numpy(), trans, 0)
+        withdrawal = np.where(is_balance & comments.str.contains(an.COMMENT_PATTERN_FOR_WITHDRAWAL).to_numpy(), trans, 0)
+        profit = np.where(is_balance, 0, trans)
+        balance_out = np.cumsum(trans)
+
+        df['PROFIT'] = profit
+        df['DK_TRANS'] = trans
+        df['DK_MISC_TRANS'] = trans - (deposit + withdrawal + profit)
+        df['DK_DEPOSIT'] = deposit
+        df['DK_TRANSFER'] = transfer
+        df['DK_WITHDRAWAL'] = withdrawal
+        df['DK_BALANCE_OUT'] = balance_out
+        df['DK_BALANCE_IN'] = balance_out - trans
+
+        self.df_full = df
+
+    def _extend_with_grid_details(self) -> None:
+        df_full = self.df_full
+
+        # Filter only orders without another tansactions such as deposits and withdrawals
+        is_order = df_full['COMMENT'].astype(str).str.contains(an.COMMENT_PATTERN_FOR_ORDERS_ONLY, regex=False).to_numpy()
+        order_pos = np.flatnonzero(is_order)
+
+        order_id = df_full['ORDER_ID'].to_numpy()[order_pos]
+        open_dt = df_full['OPEN_DT'].to_numpy()[order_pos]
+        side = df_full['SIDE'].to_numpy()[order_pos]
+        qty = df_full['QTY'].to_numpy(dtype=np.float64)[order_pos]
+        open_price = df_full['OPEN_PRICE'].to_numpy(dtype=np.float64)[order_pos]
+        balance_in = df_full['DK_BALANCE_IN'].to_numpy()[order_pos]
+        open_value = open_price * qty
+
+        # Grid id needs (OPEN_DT, ORDER_ID) timeline
+        by_open_dt = np.lexsort((order_id, open_dt))
+        df_timeline = df_full[['ORDER_ID', 'OPEN_DT', 'CLOSE_DT', 'COMMENT']].iloc[order_pos[by_open_dt]]
+        grid_id = np.empty_like(order_id)
+        grid_id[by_open_dt] = self.set_grid_id_func(df_timeline, 'DK_GRID_ID')['DK_GRID_ID'].to_numpy()
+
+        # Orders are in ORDER_ID order already, so stable sort by grid gives (DK_GRID_ID, ORDER_ID) order
+        by_grid = np.argsort(grid_id, kind='stable')
+        by_grid_open_dt = by_open_dt[np.argsort(grid_id[by_open_dt], kind='stable')]
+        self._grid_permutation = by_grid
+        self._grid_open_dt_permutation = by_grid_open_dt
+
+        grid_qty = np.empty(len(order_pos))
+        grid_value = np.empty(len(order_pos))
+        grid_qty[by_grid_open_dt] = pd.Series(qty[by_grid_open_dt]).groupby(grid_id[by_grid_open_dt], sort=False).cumsum().to_numpy()
+        grid_value[by_grid_open_dt] = pd.Series(open_value[by_grid_open_dt]).groupby(grid_id[by_grid_open_dt], sort=False).cumsum().to_numpy()
+
+        # Next order of the same grid in (DK_GRID_ID, ORDER_ID) order
+        grid_id_g = grid_id[by_grid]
+        is_last = np.append(grid_id_g[1:] != grid_id_g[:-1], True)
+        open_price_g = open_price[by_grid]
+        next_open_price_g = np.append(open_price_g[1:], np.nan)
+        qty_g = qty[by_grid]
+        open_dt_g = open_dt[by_grid]
+
+        max_price_delta = (an.OPEN_NEW_ORDER_PRICE_DELTA_PIPS - 1) * an.XAU_PIP_USD
+        max_price_delta = np.where(side[by_grid] == 'buy', -1 * max_price_delta, max_price_delta)
+        worst_price_g = np.where(is_last, open_price_g + max_price_delta, next_open_price_g)
+        drawdown_g = np.abs(grid_qty[by_grid] * worst_price_g - grid_value[by_grid])
+
+        segment_start = np.flatnonzero(np.insert(is_last[:-1], 0, True))
+        segment_len = np.diff(np.append(segment_start, len(grid_id_g)))
+        grid_order_num_g = np.arange(len(grid_id_g)) - np.repeat(segment_start, segment_len) + 1
+
+        df_orders = df_full.take(order_pos[by_grid])
+        df_orders['DK_OPEN_VALUE'] = open_value[by_grid]
+        df_orders['DK_GRID_ID'] = grid_id_g
+        df_orders['DK_GRID_QTY'] = grid_qty[by_grid]
+        df_orders['DK_GRID_VALUE'] = grid_value[by_grid]
+        df_orders['DK_WORST_PRICE'] = worst_price_g
+        df_orders['DK_DRAWDOWN'] = drawdown_g
+        with np.errstate(divide='ignore', invalid='ignore'):  # Ratio to zero balance is inf as in an.extend_with_grid_details
+            df_orders['DK_DRAWDOWN_RATIO'] = drawdown_g / balance_in[by_grid]
+        df_orders['DK_OPEN_PRICE_DELTA'] = np.where(is_last, 0, np.abs(next_open_price_g - open_price_g))
+        df_orders['DK_QTY_FACTOR'] = np.append(qty_g[1:], np.nan) / qty_g
+        df_orders['DK_IS_LAST_GRID_ORDER'] = is_last
+        df_orders['DK_DURATION_TD'] = np.where(is_last, np.timedelta64(0, 's'), np.append(open_dt_g[1:], open_dt_g[-1:]) - open_dt_g)
+        df_orders['DK_QTY_DELTA'] = np.where(is_last, 0, np.nan)
+        df_orders['DK_GRID_ORDER_NUM'] = grid_order_num_g
+
+        self.df_orders = df_orders
+
+    def _get_grids(self) -> None:
+        df_orders = self.df_orders
+
+        # an.get_grids aggregates orders in (OPEN_DT, ORDER_ID) order
+        by_grid_open_dt = np.argsort(self._grid_permutation)[self._grid_open_dt_permutation]
+        cols = {col: df_orders[col].to_numpy()[by_grid_open_dt] for col in an.GRID_AGG_FUNCTIONS.keys()
+                if col not in ['DK_GRID_LAST_PRICE', 'DK_GRID_OPEN_QTY']}
+        cols['DK_GRID_LAST_PRICE'] = cols['OPEN_PRICE']
+        cols['DK_GRID_OPEN_QTY'] = cols['QTY']
+        cols['DK_GRID_ID'] = df_orders['DK_GRID_ID'].to_numpy()[by_grid_open_dt]
+
+        df_grids = pd.DataFrame(cols).groupby(['DK_GRID_ID']).agg(an.GRID_AGG_FUNCTIONS).reset_index()
+        self.df_grids = an.calc_grid_details(df_grids)
@@ -0,0 +1,86 @@
+import pandas as pd
+
+
+# Declared dtypes of trans cols:
+# - low-cardinality strings are categories
+# - numeric cols are float64, so trans saved to DB or parsed cache keep the values parsed from statement
+TRANS_SCHEMA = {
+    'ORDER_ID': 'int64',
+    'OPEN_DT': 'datetime64[ns]',
+    'CLOSE_DT': 'datetime64[ns]',
+    'CREATED_DT': 'datetime64[ns]',
+    'SIDE': 'category',
+    'SYMBOL': 'category',
+    'COMMENT': 'category',
+    'FILE_NAME': 'category',
+    'FTP_USER_ID': 'category',
+    'USER_ID': 'category',
+    'QTY': 'float64',
+    'OPEN_PRICE': 'float64',
+    'STOP_LOSS': 'float64',
+    'TAKE_PROFIT': 'float64',
+    'CLOSE_PRICE': 'float64',
+    'FEE': 'float64',
+    'TAXES': 'float64',
+    'SWAP': 'float64',
+    'PROFIT': 'float64',
+}
+
+# Dtypes of trans loaded for in-memory analysis only, they are never saved back.
+# Prices and lots are float32, its 7 significant digits are enough for XAU prices and 0.01 lots.
+# Money cols stay float64, because balance is their cumsum
+ANALYSIS_TRANS_SCHEMA = {**TRANS_SCHEMA, **{col: 'float32' for col in ['QTY', 'OPEN_PRICE', 'STOP_LOSS', 'TAKE_PROFIT', 'CLOSE_PRICE']}}
+
+
+def apply_trans_schema(df: pd.DataFrame, schema: dict = None) -> pd.DataFrame:
+    """
+    Casts trans cols to declared dtypes. Cols which df doesn't have are skipped.
+    Statement numbers can have spaces as thousands separator, e.g. '9 900.00'. Not numeric values become NaN.
+
+    Args:
+        df (pd.DataFrame): Trans DataFrame
+        schema (dict, optional): {col: dtype}, e.g. ANALYSIS_TRANS_SCHEMA. Defaults to None means TRANS_SCHEMA
+
+    Returns:
+        pd.DataFrame: Result DataFrame
+    """
+    schema = TRANS_SCHEMA if schema is None else schema
+
+    df = df.copy()
+    for col, dtype in schema.items():
+        if col not in df.columns or df[col].dtype == dtype:
+            continue
+
+        if dtype == 'category':
+            df[col] = df[col].astype('category')
+        elif dtype.startswith('datetime64'):
+            df[col] = pd.to_datetime(df[col])
+        elif df[col].dtype == object:
+            df[col] = pd.to_numeric(df[col].astype(str).str.replace(' ', '', regex=False), errors='coerce').astype(dtype)
+        else:
+            df[col] = df[col].astype(dtype)
+
+    return df
+
+
+def get_bytes_per_row(df: pd.DataFrame) -> float:
+    """Memory used by df including Python objects of string cols divided by its row count"""
+    return df.memory_usage(index=True, deep=True).sum() / max(len(df), 1)
+
+
+def get_memory_report(df_before: pd.DataFrame, df_after: pd.DataFrame) -> pd.DataFrame:
+    """
+    Compares memory of the same trans before and after apply_trans_schema, e.g. by ANALYSIS_TRANS_SCHEMA.
+
+    Returns:
+        pd.DataFrame: Bytes per row of every col and TOTAL row with cols BEFORE, AFTER, RATIO
+    """
+    rows_before, rows_after = max(len(df_before), 1), max(len(df_after), 1)
+    df_res = pd.DataFrame({
+        'BEFORE': df_before.memory_usage(index=True, deep=True) / rows_before,
+        'AFTER': df_after.memory_usage(index=True, deep=True) / rows_after,
+    })
+    df_res.loc['TOTAL'] = [get_bytes_per_row(df_before), get_bytes_per_row(df_after)]
+    df_res['RATIO'] = df_res['AFTER'] / df_res['BEFORE']
+
+    return df_res
@@ -0,0 +1,185 @@
+import datetime
+from dataclasses import dataclass, asdict, fields
+import numpy as np
+import pandas as pd
+
+
+@dataclass
+class Summary:
+    '''
+        Summary info for account for one date range. Fields are named as cols of summary DataFrame.
+    '''
+    DAYS: int
+    BALANCE: float
+    DK_DEPOSIT: float
+    DK_TRANSFER: float
+    DK_WITHDRAWAL: float
+    DK_MISC_TRANS: float
+    PROFIT: float
+    ORDER_ID: int
+    HAS_ORDER_PROFIT: int
+    AVG_ORDER_PROFIT: float
+    MAX_ORDER_PROFIT: float
+    MAX_ORDER_LOSS: float
+    START_DATE: datetime.date
+    FINISH_DATE: datetime.date
+    CAL_DAYS: int
+    BALANCE_IN_DAY_AVG: float
+    PROFIT_PCT: float
+    OWN_FUNDS: float
+    PROFIT_PER_DAY: float
+    PROFIT_PER_CAL_DAY: float
+    ROE: float
+    ROE_DAYS: float
+    ROI: float
+    ROI_DAYS: float
+    WIN_RATE: float
+    GRID_CNT: int
+    MIN_LOT_1000: float
+    AVG_LOT_1000: float
+    MAX_LOT_1000: float
+    LAST_LOT_1000: float
+    AVG_GRID_ORDER_CNT: float
+    MAX_GRID_ORDER_CNT: float
+    MIN_GRID_DURATION: pd.Timedelta
+    AVG_GRID_DURATION: pd.Timedelta
+    MAX_GRID_DURATION: pd.Timedelta
+    AVG_GRID_PROFIT: float
+    MAX_GRID_PROFIT: float
+    AVG_GRID_DRAWDOWN: float
+    MAX_GRID_DRAWDOWN: float
+    AVG_GRID_DRAWDOWN_RATIO: float
+    MAX_GRID_DRAWDOWN_RATIO: float
+
+    def to_frame(self) -> pd.DataFrame:
+        return summaries_to_frame([self])
+
+
+def summaries_to_frame(summaries: list[Summary]) -> pd.DataFrame:
+    return pd.DataFrame([asdict(s) for s in summaries], columns=[f.name for f in fields(Summary)])
+
+
+def _reduce_windows(ufunc: np.ufunc, values: np.ndarray, starts: np.ndarray, ends: np.ndarray) -> np.ndarray:
+    '''
+        Reduces values[start:end] for every window at once. Result of empty window is NaN.
+    '''
+    values = np.append(values, values[:1] if len(values) > 0 else [np.nan]).astype(np.float64)  # Sentinel for end == len(values)
+    res = ufunc.reduceat(values, np.ravel(np.column_stack([starts, ends])))[::2]
+    return np.where(ends > starts, res, np.nan)
+
+
+def summarize_days(df_daily: pd.DataFrame, windows: list[tuple] = None) -> list[Summary]:
+    '''
+        Calc summaries for many date ranges at once based on daily rollup made by analizer.calc_daily_rollup.
+        Daily rows are turned to numpy arrays once and every metric is reduced for all windows by one ufunc.reduceat call.
+        Grids are taken into date range by their OPEN_DT.
+
+    Args:
+        df_daily (pd.DataFrame): Daily rollup dataframe
+        windows (list[tuple], optional): List of (start_date, finish_date). None date means open range.
+                                         Defaults to None means one window with all days.
+
+    Returns:
+        list[Summary]: Summary for every window
+    '''
+    windows = [(None, None)] if windows is None else windows
+    df_daily = df_daily.sort_values(by='DAY')
+
+    days = pd.to_datetime(df_daily['DAY']).to_numpy().astype('datetime64[D]')
+    starts = np.array([0 if s is None else np.searchsorted(days, np.datetime64(s, 'D'), side='left') for s, _ in windows], dtype=np.int64)
+    ends = np.array([len(days) if f is None else np.searchsorted(days, np.datetime64(f, 'D'), side='right') for _, f in windows], dtype=np.int64)
+    ends = np.maximum(starts, ends)
+
+    def col(name: str) -> np.ndarray:
+        return df_daily[name].to_numpy(dtype=np.float64)
+
+    def sum_col(name: str) -> np.ndarray:
+        values = col(name)
+        return _reduce_windows(np.add, np.where(np.isnan(values), 0, values), starts, ends)
+
+    def last_of(values: np.ndarray, mask: np.ndarray) -> np.ndarray:
+        # Last value in window among days with mask
+        pos = np.flatnonzero(mask)
+        idx = np.searchsorted(pos, ends) - 1
+        has = (idx >= 0) & (pos[np.maximum(idx, 0)] >= starts) if len(pos) > 0 else np.zeros(len(starts), dtype=bool)
+        return np.where(has, values[pos[np.maximum(idx, 0)]] if len(pos) > 0 else np.nan, np.nan)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        day_cnt = ends - starts
+        trans_cnt = sum_col('ORDER_ID')
+        profit = sum_col('PROFIT')
+        deposit = sum_col('DK_DEPOSIT')
+        transfer = sum_col('DK_TRANSFER')
+        withdrawal = sum_col('DK_WITHDRAWAL')
+        balance = last_of(col('BALANCE'), np.ones(len(days), dtype=bool))
+        start_date = np.where(day_cnt > 0, days[np.minimum(starts, max(len(days) - 1, 0))], np.datetime64('NaT'))
+        finish_date = np.where(day_cnt > 0, days[np.maximum(ends - 1, 0)], np.datetime64('NaT'))
+        cal_days = (finish_date - start_date).astype('timedelta64[D]').astype(np.float64) + 1
+
+        orders_balance_in = col('ORDERS_BALANCE_IN')
+        balance_in_day_avg = sum_col('ORDERS_BALANCE_IN') / _reduce_windows(np.add, (~np.isnan(orders_balance_in)).astype(np.float64), starts, ends)
+
+        own_funds = np.maximum(deposit + transfer + withdrawal, 0)
+        profit_per_cal_day = profit / cal_days
+
+        grid_cnt = sum_col('GRID_CNT')
+
+        res = {
+            'DAYS': day_cnt,
+            'BALANCE': balance,
+            'DK_DEPOSIT': deposit,
+            'DK_TRANSFER': transfer,
+            'DK_WITHDRAWAL': withdrawal,
+            'DK_MISC_TRANS': sum_col('DK_MISC_TRANS'),
+            'PROFIT': profit,
+            'ORDER_ID': trans_cnt,
+            'HAS_ORDER_PROFIT': sum_col('HAS_ORDER_PROFIT'),
+            'AVG_ORDER_PROFIT': profit / trans_cnt,
+            'MAX_ORDER_PROFIT': _reduce_windows(np.fmax, col('MAX_ORDER_PROFIT'), starts, ends),
+            'MAX_ORDER_LOSS': _reduce_windows(np.fmin, col('MAX_ORDER_LOSS'), starts, ends),
+            'START_DATE': start_date,
+            'FINISH_DATE': finish_date,
+            'CAL_DAYS': cal_days,
+            'BALANCE_IN_DAY_AVG': balance_in_day_avg,
+            'PROFIT_PCT': profit / balance,
+            'OWN_FUNDS': own_funds,
+            'PROFIT_PER_DAY': profit / day_cnt,
+            'PROFIT_PER_CAL_DAY': profit_per_cal_day,
+            'ROE': profit / balance,
+            'ROE_DAYS': balance / profit_per_cal_day,
+            'ROI': np.where(own_funds != 0, profit / own_funds, 0),
+            'ROI_DAYS': own_funds / profit_per_cal_day,
+            'WIN_RATE': sum_col('HAS_ORDER_PROFIT') / trans_cnt,
+            'GRID_CNT': grid_cnt,
+            'MIN_LOT_1000': _reduce_windows(np.fmin, col('MIN_LOT_1000'), starts, ends),
+            'AVG_LOT_1000': sum_col('LOT_1000') / grid_cnt,
+            'MAX_LOT_1000': _reduce_windows(np.fmax, col('MAX_LOT_1000'), starts, ends),
+            'LAST_LOT_1000': last_of(col('LAST_LOT_1000'), col('GRID_CNT') > 0),
+            'AVG_GRID_ORDER_CNT': sum_col('GRID_ORDER_CNT') / grid_cnt,
+            'MAX_GRID_ORDER_CNT': _reduce_windows(np.fmax, col('MAX_GRID_ORDER_CNT'), starts, ends),
+            'MIN_GRID_DURATION': _reduce_windows(np.fmin, col('MIN_GRID_DURATION_SEC'), starts, ends),
+            'AVG_GRID_DURATION': sum_col('GRID_DURATION_SEC') / grid_cnt,
+            'MAX_GRID_DURATION': _reduce_windows(np.fmax, col('MAX_GRID_DURATION_SEC'), starts, ends),
+            'AVG_GRID_PROFIT': sum_col('GRID_PROFIT') / grid_cnt,
+            'MAX_GRID_PROFIT': _reduce_windows(np.fmax, col('MAX_GRID_PROFIT'), starts, ends),
+            'AVG_GRID_DRAWDOWN': sum_col('GRID_DRAWDOWN') / grid_cnt,
+            'MAX_GRID_DRAWDOWN': _reduce_windows(np.fmax, col('MAX_GRID_DRAWDOWN'), starts, ends),
+            'AVG_GRID_DRAWDOWN_RATIO': sum_col('GRID_DRAWDOWN_RATIO') / grid_cnt,
+            'MAX_GRID_DRAWDOWN_RATIO': _reduce_windows(np.fmax, col('MAX_GRID_DRAWDOWN_RATIO'), starts, ends),
+        }
+
+    summaries = []
+    for i in range(len(windows)):
+        values = {k: v[i] for k, v in res.items()}
+        for k in ['DAYS', 'ORDER_ID', 'HAS_ORDER_PROFIT', 'CAL_DAYS', 'GRID_CNT']:
+            values[k] = int(values[k]) if not np.isnan(values[k]) else 0
+        for k in ['START_DATE', 'FINISH_DATE']:
+            values[k] = pd.Timestamp(values[k]).date() if not np.isnat(values[k]) else None
+        for k in ['MIN_GRID_DURATION', 'AVG_GRID_DURATION', 'MAX_GRID_DURATION']:
+            values[k] = pd.to_timedelta(values[k], unit='s')
+        for k, v in values.items():
+            if isinstance(v, np.floating):
+                values[k] = float(v)
+        summaries.append(Summary(**values))
+
+    return summaries
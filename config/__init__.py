@@ -8,6 +8,19 @@ TELEGRAM_API = os.getenv('RF_HISTORY_TELEGRAM_API')
 # DB settings
 DATABASE_CONNECTION_STRING = '/Users/sournk/dev/rf-history/db.sqlite'
 TRANS_TABLE_NAME = 'Trans'
+GRID_STATE_TABLE_NAME = 'GridState'
+GRIDS_TABLE_NAME = 'Grids'
+DAILY_ROLLUP_TABLE_NAME = 'DailyRollup'
+PROCESSED_FILES_TABLE_NAME = 'ProcessedFiles'
+ACCOUNTS_TABLE_NAME = 'ACCOUNTS'
+SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',      # Readers don't block the writer and vice versa
+    'synchronous': 'NORMAL',    # Safe with WAL, commit doesn't wait for fsync
+    'cache_size': -64 * 1024,   # KiB
+    'temp_store': 'MEMORY',
+    'mmap_size': 256 * 1024 * 1024,
+    'busy_timeout': 30 * 1000,  # ms
+}
 
 # Processing files and dirs settings
 UPLOAD_FILES_PATH = 'files_received' # todo replace by PROCESSING_DIR
@@ -18,6 +31,8 @@ STATEMENT_FILENAME = 'statement.htm'
 
 # Redis
 STATEMENT_PROCESSING_QUEUE_NAME = 'STATEMENT_PROCESSING_QUEUE'
+STATEMENT_INTERACTIVE_PROCESSING_QUEUE_NAME = 'STATEMENT_INTERACTIVE_PROCESSING_QUEUE' # rq worker must listen it first
+STATEMENT_PROCESSING_MAX_QUEUE_DEPTH = 16
 FTP_SCAN_QUEUE_NAME = 'FTP_SCAN_QUEUE'
 
 # Logging
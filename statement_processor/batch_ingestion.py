@@ -0,0 +1,165 @@
+import sys
+import os
+import time
+import pathlib
+import argparse
+import sqlite3
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+sys.path.append("..")
+import config
+from config import statement_dispatcher_logger
+import statement_processor.statement_processor as sp
+import statement_processor.parsed_cache as pc
+import statement_processor.statement_archive as sa
+import statement_processor.db_schema as ds
+
+
+def discover_statement_files(src_dir: str, pattern: str = config.STATEMENT_FILENAME) -> list[tuple[str, pathlib.Path, str]]:
+    """
+    Finds statement files in dirs of FTP users: <src_dir>/<FTP_USER_ID>/<pattern>.
+    Files of every user are sorted by name, so files of processing dir are in order of their processing time.
+
+    Returns:
+        list[tuple[str, pathlib.Path, str]]: List of (FTP_USER_ID, file name, None), content hash is unknown before reading
+    """
+    res = []
+    for user_dir in sorted(p for p in pathlib.Path(src_dir).iterdir() if p.is_dir()):
+        res += [(user_dir.name, file_name, None) for file_name in sorted(user_dir.glob(pattern)) if file_name.is_file()]
+    return res
+
+
+def _parse_statement_file(ftp_user_id: str, src_file_name: pathlib.Path, content_hash: str = None, dst_processing_dir: str = None) -> dict:
+    """
+    Reads and parses one statement file in worker process. Result is saved to DB by the writer.
+    Statement of processing dir is read from archive and loaded from parsed statements cache instead of parsing, if it's there.
+    Archived statement with content_hash from manifest is read without manifest lookup.
+    Statement of FTP dir is parsed as file of dst_processing_dir, like statement_processor.process_statement_file() does,
+    and its content is returned to be archived by the writer.
+    """
+    dst_file_name = None
+    if content_hash is not None:
+        content = sa.read_archived_statement(src_file_name, content_hash=content_hash)
+    elif src_file_name.exists():
+        content = sp.read_statement_file(src_file_name)
+        content_hash = sp.get_content_hash(content)
+        dst_file_name = sp.get_dst_file_name(dst_processing_dir=dst_processing_dir, ftp_user_id=ftp_user_id, src_file_name=src_file_name)
+    else:
+        content = sa.read_archived_statement(src_file_name)
+        content_hash = sp.get_content_hash(content)
+
+    df = pc.load_parsed_statement(cache_dir=src_file_name.parent, content_hash=content_hash) if dst_file_name is None else None
+    if df is not None:
+        file_details = sp.get_file_details(src_file_name, content=content)
+        trans_prefix_size = sp.find_trans_rows_end(content, start=sp.find_trans_header_end(content), row_cnt=len(df))
+    else:
+        file_details, df, trans_prefix_size = sp.parse_statement_content(content=content, 
+                                                                         ftp_user_id=ftp_user_id, 
+                                                                         file_name=src_file_name if dst_file_name is None else dst_file_name)
+    trans_prefix_size, trans_prefix_hash = sp.get_trans_prefix_key(content, trans_rows_end=trans_prefix_size)
+
+    return {
+        'FTP_USER_ID': ftp_user_id,
+        'FILE_NAME': src_file_name if dst_file_name is None else dst_file_name,
+        'ACCOUNT': file_details['account'],
+        'DF': df,
+        'CONTENT': None if dst_file_name is None else content,
+        'CONTENT_HASH': content_hash,
+        'TRANS_PREFIX_SIZE': trans_prefix_size,
+        'TRANS_PREFIX_HASH': trans_prefix_hash,
+    }
+
+
+def _save_parsed_statement(res: dict, conn: sqlite3.Connection) -> int:
+    """
+    Saves parsed statement to DB. Returns count of new trans.
+    Statement of FTP dir is archived and cached in processing dir first, so it's stored the same as by process_statement_file()
+    """
+    if sp.is_file_processed(ftp_user_id=res['FTP_USER_ID'], content_hash=res['CONTENT_HASH'], conn=conn):
+        statement_dispatcher_logger.debug(f'Skipping already processed file {str(res["FILE_NAME"])}')
+        return 0
+
+    if res['CONTENT'] is not None:
+        sa.archive_statement(content=res['CONTENT'], content_hash=res['CONTENT_HASH'], dst_file_name=res['FILE_NAME'])
+    sp.check_account_is_assigned_to_user(ftp_user_id=res['FTP_USER_ID'], account=res['ACCOUNT'], conn=conn)
+    if res['CONTENT'] is not None and len(res['DF']) > 0:
+        pc.save_parsed_statement(df=res['DF'], cache_dir=res['FILE_NAME'].parent, content_hash=res['CONTENT_HASH'])
+
+    new_row_cnt = sp.add_new_statement_data_to_db(df=res['DF'], conn=conn)[0] if len(res['DF']) > 0 else 0
+    sp.register_processed_file(ftp_user_id=res['FTP_USER_ID'],
+                               content_hash=res['CONTENT_HASH'],
+                               trans_prefix_size=res['TRANS_PREFIX_SIZE'],
+                               trans_prefix_hash=res['TRANS_PREFIX_HASH'],
+                               file_name=res['FILE_NAME'].name,
+                               conn=conn)
+    return new_row_cnt
+
+
+def ingest_statement_files(files: list[tuple[str, pathlib.Path, str]], 
+                           conn: sqlite3.Connection, 
+                           max_workers: int = None, 
+                           dst_processing_dir: str = config.PROCESSING_DIR) -> dict:
+    """
+    Parses statement files in process pool and saves them to DB by the only writer, i.e. this process with one connection.
+    Files of one FTP user are saved in the given order, as soon as all previous files of the user are saved.
+    Failed files are logged and skipped.
+
+    Args:
+        files (list[tuple[str, pathlib.Path, str]]): List of (FTP_USER_ID, file name, CONTENT_HASH or None). 
+                                                See discover_statement_files() and statement_archive.get_archived_statement_files()
+        conn (sqlite3.Connection): Connection
+        max_workers (int, optional): Parsing processes count. Defaults to None means all cores
+        dst_processing_dir (str, optional): Processing dir to archive files of FTP dir to. Archived files aren't archived again.
+                                            Defaults to config.PROCESSING_DIR
+
+    Returns:
+        dict: Throughput report {FILES, FAILED_FILES, ROWS, NEW_ROWS, SECONDS, FILES_PER_SEC, ROWS_PER_SEC}
+    """
+    report = {'FILES': 0, 'FAILED_FILES': 0, 'ROWS': 0, 'NEW_ROWS': 0}
+    start_time = time.perf_counter()
+
+    with ProcessPoolExecutor(max_workers=max_workers or os.cpu_count()) as executor:
+        user_futures = {}
+        for ftp_user_id, src_file_name, content_hash in files:
+            user_futures.setdefault(ftp_user_id, []).append(executor.submit(_parse_statement_file, ftp_user_id, src_file_name, 
+                                                                                   content_hash, dst_processing_dir))
+        future_users = {future: ftp_user_id for ftp_user_id, futures in user_futures.items() for future in futures}
+
+        for future in as_completed(future_users):
+            # Write all parsed files of the user which are next in order
+            futures = user_futures[future_users[future]]
+            while len(futures) > 0 and futures[0].done():
+                report['FILES'] += 1
+                try:
+                    res = futures.pop(0).result()
+                    report['ROWS'] += len(res['DF'])
+                    report['NEW_ROWS'] += _save_parsed_statement(res, conn=conn)
+                except Exception as e:
+                    report['FAILED_FILES'] += 1
+                    statement_dispatcher_logger.error(f'Statement processing failed {e}')
+
+    report['SECONDS'] = time.perf_counter() - start_time
+    report['FILES_PER_SEC'] = report['FILES'] / report['SECONDS']
+    report['ROWS_PER_SEC'] = report['ROWS'] / report['SECONDS']
+    statement_dispatcher_logger.info(f'Batch ingestion finished {report}')
+
+    return report
+
+
+if __name__ == '__main__':
+    # python -m statement_processor.batch_ingestion --src-dir <dir> [--dst-dir <processing dir>] [--pattern <glob>] [--workers <n>]
+    # python -m statement_processor.batch_ingestion --src-dir <processing dir> --archive
+    parser = argparse.ArgumentParser(description='Saves to DB all statement files from dirs of FTP users')
+    parser.add_argument('--src-dir', default=config.SRC_FTP_DIR, help='Dir with FTP users dirs')
+    parser.add_argument('--archive', action='store_true', help='Ingest all archived statements of src dir, i.e. rebuild DB from PROCESSING_DIR')
+    parser.add_argument('--pattern', default=config.STATEMENT_FILENAME, help='Glob of statement files in FTP user dir')
+    parser.add_argument('--dst-dir', default=config.PROCESSING_DIR, help='Processing dir to archive statements of FTP dir to')
+    parser.add_argument('--workers', type=int, default=None, help='Parsing processes count. All cores by default')
+    parser.add_argument('--db', default=config.DATABASE_CONNECTION_STRING, help='DB file')
+    args = parser.parse_args()
+
+    conn = ds.connect(args.db)
+    files = sa.get_archived_statement_files(args.src_dir) if args.archive else discover_statement_files(args.src_dir, args.pattern)
+    report = ingest_statement_files(files, conn=conn, max_workers=args.workers, dst_processing_dir=args.dst_dir)
+    print(f'{report["FILES"]} files ({report["FAILED_FILES"]} failed), {report["ROWS"]} rows ({report["NEW_ROWS"]} new) in {report["SECONDS"]:.1f}s: '
+          f'{report["FILES_PER_SEC"]:.2f} files/s, {report["ROWS_PER_SEC"]:.0f} rows/s')
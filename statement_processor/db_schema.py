@@ -0,0 +1,271 @@
+import sys
+import time
+import random
+import sqlite3
+import argparse
+import numpy as np
+import pandas as pd
+
+sys.path.append("..")
+import config
+from config import statement_dispatcher_logger as statement_dispatcher_logger
+from statement_processor.table_writer import get_table_columns, get_table_primary_key, get_table_unique_keys
+
+
+TRANS_TABLE_SQL = f'''
+    CREATE TABLE IF NOT EXISTS {config.TRANS_TABLE_NAME} (
+        ORDER_ID	INTEGER NOT NULL,
+        OPEN_DT	TIMESTAMP,
+        SIDE	TEXT,
+        QTY	REAL,
+        SYMBOL	TEXT,
+        OPEN_PRICE	REAL,
+        STOP_LOSS	REAL,
+        TAKE_PROFIT	REAL,
+        CLOSE_DT	TIMESTAMP,
+        CLOSE_PRICE	REAL,
+        FEE	REAL,
+        TAXES	REAL,
+        SWAP	REAL,
+        PROFIT	REAL,
+        COMMENT	TEXT,
+        FTP_USER_ID	TEXT,
+        FILE_NAME	TEXT,
+        CREATED_DT	TIMESTAMP,
+        USER_ID	TEXT);
+    '''
+
+# Trans is shared by statement processor and the bot, every writer has its own key: trans of statement processor are keyed by 
+# (FTP_USER_ID, ORDER_ID), trans uploaded to the bot by (USER_ID, ORDER_ID). Indexes are partial, so rows of other writer are out of key.
+# Names and conditions are the same as table_writer.create_unique_key() gives
+TRANS_KEYS = [['FTP_USER_ID', 'ORDER_ID'], ['USER_ID', 'ORDER_ID']]
+TRANS_KEYS_SQL = [f'CREATE UNIQUE INDEX IF NOT EXISTS ix_{config.TRANS_TABLE_NAME}_{"_".join(key_columns)} '
+                  f'ON {config.TRANS_TABLE_NAME} ({", ".join(key_columns)}) WHERE {" AND ".join(f"{col} IS NOT NULL" for col in key_columns)}'
+                  for key_columns in TRANS_KEYS]
+
+ACCOUNTS_TABLE_SQL = f'''
+    CREATE TABLE IF NOT EXISTS {config.ACCOUNTS_TABLE_NAME} (
+        TELEGRAM_USER_ID	TEXT,
+        FTP_USER_ID	TEXT,
+        ACCOUNT_NUMBER	TEXT,
+        ACCOUNT_NAME	TEXT,
+        ACTIVE	INTEGER DEFAULT 1,
+        LAST_CHECK_DT	TIMESTAMP);
+    '''
+
+# Every index covers its query, so SQLite doesn't read table rows:
+# - update_daily_rollup_in_db(): trans of account from date
+# - check_account_is_assigned_to_user() and process_account_statement_file(): account and telegram user of FTP user
+# - ftp_scanner.scan_ftp_for_updates(): active accounts ordered by LAST_CHECK_DT
+# Trans of account by FTP_USER_ID and dedup by (FTP_USER_ID, ORDER_ID) use TRANS_KEYS_SQL index.
+INDEXES_SQL = [
+    f'CREATE INDEX IF NOT EXISTS ix_{config.TRANS_TABLE_NAME}_open_dt ON {config.TRANS_TABLE_NAME} (FTP_USER_ID, OPEN_DT)',
+    f'CREATE INDEX IF NOT EXISTS ix_{config.ACCOUNTS_TABLE_NAME}_ftp_user ON {config.ACCOUNTS_TABLE_NAME} (FTP_USER_ID, ACCOUNT_NUMBER, TELEGRAM_USER_ID)',
+    f'CREATE INDEX IF NOT EXISTS ix_{config.ACCOUNTS_TABLE_NAME}_last_check ON {config.ACCOUNTS_TABLE_NAME} (ACTIVE, LAST_CHECK_DT, FTP_USER_ID)',
+]
+
+
+class SchemaMigrationError(Exception):
+    pass
+
+
+def _migration_1_create_tables(conn: sqlite3.Connection) -> None:
+    """
+    Creates ACCOUNTS and Trans with keys of both writers, see TRANS_KEYS. Trans created by DataFrame.to_sql before is rebuilt:
+        - rows without any key, i.e. with NULL ORDER_ID or with both FTP_USER_ID and USER_ID NULL, are moved to Trans_quarantine
+        - duplicates of every key are dropped, the first stored row is kept
+
+    Raises:
+        SchemaMigrationError: Raises when rebuilt table doesn't have every key of legacy one, so migration is rolled back
+    """
+    conn.execute(ACCOUNTS_TABLE_SQL)
+    account_columns = [col.upper() for col in get_table_columns(conn, config.ACCOUNTS_TABLE_NAME)]
+    for col, col_type in [('ACTIVE', 'INTEGER DEFAULT 1'), ('LAST_CHECK_DT', 'TIMESTAMP')]:
+        if col not in account_columns:
+            conn.execute(f'ALTER TABLE {config.ACCOUNTS_TABLE_NAME} ADD COLUMN {col} {col_type}')
+
+    legacy_columns = get_table_columns(conn, config.TRANS_TABLE_NAME)
+    if (len(legacy_columns) > 0 and len(get_table_primary_key(conn, config.TRANS_TABLE_NAME)) == 0
+            and all(key_columns in get_table_unique_keys(conn, config.TRANS_TABLE_NAME) for key_columns in TRANS_KEYS)):
+        return
+
+    legacy_table_name = f'{config.TRANS_TABLE_NAME}_legacy'
+    if len(legacy_columns) > 0:
+        conn.execute(f'ALTER TABLE {config.TRANS_TABLE_NAME} RENAME TO {legacy_table_name}')
+    conn.execute(TRANS_TABLE_SQL)
+    for sql in TRANS_KEYS_SQL:
+        conn.execute(sql)
+    if len(legacy_columns) == 0:
+        return
+
+    # Cols of legacy table which schema doesn't have are kept
+    trans_columns = [col.upper() for col in get_table_columns(conn, config.TRANS_TABLE_NAME)]
+    for col in legacy_columns:
+        if col.upper() not in trans_columns:
+            conn.execute(f'ALTER TABLE {config.TRANS_TABLE_NAME} ADD COLUMN "{col}"')
+
+    # Key cols which legacy table doesn't have are NULL
+    order_id, ftp_user_id, user_id = [col if col in [c.upper() for c in legacy_columns] else 'NULL' for col in ['ORDER_ID', 'FTP_USER_ID', 'USER_ID']]
+    null_key_condition = f'{order_id} IS NULL OR ({ftp_user_id} IS NULL AND {user_id} IS NULL)'
+
+    legacy_cnt = conn.execute(f'SELECT COUNT(*) FROM {legacy_table_name}').fetchone()[0]
+    quarantine_cnt = conn.execute(f'SELECT COUNT(*) FROM {legacy_table_name} WHERE {null_key_condition}').fetchone()[0]
+    if quarantine_cnt > 0:
+        conn.execute(f'CREATE TABLE {config.TRANS_TABLE_NAME}_quarantine AS SELECT * FROM {legacy_table_name} WHERE {null_key_condition}')
+        statement_dispatcher_logger.warning(f'{quarantine_cnt} trans without FTP_USER_ID or USER_ID and ORDER_ID moved to {config.TRANS_TABLE_NAME}_quarantine')
+
+    if quarantine_cnt < legacy_cnt:
+        key_cnt = sum(conn.execute(f'SELECT COUNT(*) FROM (SELECT DISTINCT {key_sql} FROM {legacy_table_name} WHERE {condition})').fetchone()[0]
+                      for key_sql, condition in [(f'{ftp_user_id}, {order_id}', f'NOT ({null_key_condition}) AND {ftp_user_id} IS NOT NULL'),
+                                                 (f'{user_id}, {order_id}', f'NOT ({null_key_condition}) AND {ftp_user_id} IS NULL')])
+        columns = ', '.join(f'"{col}"' for col in legacy_columns)
+        conn.execute(f'INSERT OR IGNORE INTO {config.TRANS_TABLE_NAME} ({columns}) SELECT {columns} FROM {legacy_table_name} '
+                     f'WHERE NOT ({null_key_condition}) ORDER BY rowid')
+
+        trans_cnt = conn.execute(f'SELECT COUNT(*) FROM {config.TRANS_TABLE_NAME}').fetchone()[0]
+        if trans_cnt != key_cnt:
+            raise SchemaMigrationError(f'{config.TRANS_TABLE_NAME} has {trans_cnt} trans after rebuild, but legacy table has {key_cnt} keys')
+        if legacy_cnt - quarantine_cnt > trans_cnt:
+            statement_dispatcher_logger.warning(f'{legacy_cnt - quarantine_cnt - trans_cnt} duplicated trans removed from {config.TRANS_TABLE_NAME}')
+
+    conn.execute(f'DROP TABLE {legacy_table_name}')
+
+
+def _migration_2_create_indexes(conn: sqlite3.Connection) -> None:
+    """Creates covering indexes. Unique index added by create_trans_table() to legacy Trans is replaced by TRANS_KEYS_SQL one.
+    Index of the same name created by the bot on its own key is kept"""
+    legacy_index_name = f'ix_{config.TRANS_TABLE_NAME}_key'
+    if [r[2] for r in conn.execute(f'PRAGMA index_info("{legacy_index_name}")')] == ['FTP_USER_ID', 'ORDER_ID']:
+        conn.execute(f'DROP INDEX "{legacy_index_name}"')
+    for sql in INDEXES_SQL:
+        conn.execute(sql)
+
+
+# Migration N moves DB from schema version N-1 to N. Applied migrations are never changed, new ones are appended
+MIGRATIONS = [
+    _migration_1_create_tables,
+    _migration_2_create_indexes,
+]
+SCHEMA_VERSION = len(MIGRATIONS)
+
+
+def get_schema_version(conn: sqlite3.Connection) -> int:
+    return conn.execute('PRAGMA user_version').fetchone()[0]
+
+
+def migrate(conn: sqlite3.Connection) -> int:
+    """
+    Applies migrations DB doesn't have yet. Every migration and its version are committed in one transaction.
+    Schema version is stored in PRAGMA user_version.
+
+    Returns:
+        int: Schema version
+    """
+    version = get_schema_version(conn)
+    for version, migration in enumerate(MIGRATIONS[version:], start=version + 1):
+        conn.commit()
+        conn.execute('BEGIN')
+        try:
+            migration(conn)
+            conn.execute(f'PRAGMA user_version = {version}')
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        statement_dispatcher_logger.info(f'DB migrated to schema version {version} by {migration.__name__}')
+
+    return version
+
+
+def apply_pragmas(conn: sqlite3.Connection, pragmas: dict = None) -> None:
+    """Sets config.SQLITE_PRAGMAS or given pragmas. journal_mode of DB file is persistent, others are per connection"""
+    for pragma, value in (config.SQLITE_PRAGMAS if pragmas is None else pragmas).items():
+        conn.execute(f'PRAGMA {pragma} = {value}')
+
+
+def connect(database: str = config.DATABASE_CONNECTION_STRING) -> sqlite3.Connection:
+    """Opens connection with tuned pragmas to DB migrated to SCHEMA_VERSION"""
+    conn = sqlite3.connect(database, timeout=config.SQLITE_PRAGMAS['busy_timeout'] / 1000)
+    apply_pragmas(conn)
+    migrate(conn)
+    return conn
+
+
+def _fill_trans_table(conn: sqlite3.Connection, total_rows: int, account_cnt: int, chunk_size: int = 500_000) -> None:
+    """Fills Trans by synthetic trans. Accounts are interleaved like after long appending of statements of all accounts"""
+    rng = np.random.default_rng(0)
+    start_dt = np.datetime64('2020-01-01T00:00:00')
+    for start in range(0, total_rows, chunk_size):
+        order_ids = np.arange(start, min(start + chunk_size, total_rows))
+        df = pd.DataFrame({
+            'ORDER_ID': order_ids,
+            'OPEN_DT': (start_dt + order_ids.astype('timedelta64[m]')).astype(str),
+            'SIDE': np.where(order_ids % 2 == 0, 'buy', 'sell'),
+            'QTY': 0.01,
+            'SYMBOL': 'EURUSD',
+            'OPEN_PRICE': rng.uniform(1.0, 1.2, len(order_ids)).round(5),
+            'PROFIT': rng.normal(0, 10, len(order_ids)).round(2),
+            'FTP_USER_ID': (order_ids % account_cnt).astype(str),
+        })
+        columns = ', '.join(df.columns)
+        with conn:
+            conn.executemany(f'INSERT INTO {config.TRANS_TABLE_NAME} ({columns}) VALUES ({", ".join("?" * len(df.columns))})',
+                             df.itertuples(index=False, name=None))
+
+
+def benchmark_account_load(database: str, total_rows: int = 10_000_000, account_cnt: int = 1000, sample_cnt: int = 20) -> dict:
+    """
+    Measures load of all trans of one account by FTP_USER_ID from Trans of total_rows trans of account_cnt accounts.
+    Trans is created first as DataFrame.to_sql did, without indexes, then migrated to schema.
+    Database file is created from scratch.
+
+    Returns:
+        dict: {LEGACY_LOAD_SEC, SCHEMA_LOAD_SEC, SPEEDUP, MIGRATION_SEC} where load is mean seconds of one account load
+    """
+    conn = sqlite3.connect(database)
+    apply_pragmas(conn)
+    conn.execute(f'DROP TABLE IF EXISTS {config.TRANS_TABLE_NAME}')
+    conn.execute('PRAGMA user_version = 0')
+    conn.execute(f'''CREATE TABLE {config.TRANS_TABLE_NAME} (ORDER_ID INTEGER, OPEN_DT TIMESTAMP, SIDE TEXT, QTY REAL, SYMBOL TEXT,
+                                                             OPEN_PRICE REAL, PROFIT REAL, FTP_USER_ID TEXT)''')
+    _fill_trans_table(conn, total_rows=total_rows, account_cnt=account_cnt)
+
+    ftp_user_ids = [str(ftp_user_id) for ftp_user_id in random.Random(0).sample(range(account_cnt), min(sample_cnt, account_cnt))]
+
+    def measure_load() -> float:
+        start_time = time.perf_counter()
+        for ftp_user_id in ftp_user_ids:
+            pd.read_sql(f'SELECT * FROM {config.TRANS_TABLE_NAME} WHERE FTP_USER_ID = :ftp_user_id', con=conn,
+                        params={'ftp_user_id': ftp_user_id})
+        return (time.perf_counter() - start_time) / len(ftp_user_ids)
+
+    report = {'LEGACY_LOAD_SEC': measure_load()}
+
+    start_time = time.perf_counter()
+    migrate(conn)
+    report['MIGRATION_SEC'] = time.perf_counter() - start_time
+
+    report['SCHEMA_LOAD_SEC'] = measure_load()
+    report['SPEEDUP'] = report['LEGACY_LOAD_SEC'] / report['SCHEMA_LOAD_SEC']
+    conn.close()
+
+    return report
+
+
+if __name__ == '__main__':
+    # python -m statement_processor.db_schema [--db <file>]                                    Migrate DB to the last schema version
+    # python -m statement_processor.db_schema --benchmark --db <new file> [--rows <n>] [--accounts <n>]
+    parser = argparse.ArgumentParser(description='Migrates DB schema or benchmarks per account load of trans')
+    parser.add_argument('--db', default=config.DATABASE_CONNECTION_STRING, help='DB file')
+    parser.add_argument('--benchmark', action='store_true', help='Fill DB file by synthetic trans and measure per account load before and after migration')
+    parser.add_argument('--rows', type=int, default=10_000_000, help='Total trans count for benchmark')
+    parser.add_argument('--accounts', type=int, default=1000, help='Accounts count for benchmark')
+    args = parser.parse_args()
+
+    if args.benchmark:
+        report = benchmark_account_load(args.db, total_rows=args.rows, account_cnt=args.accounts)
+        print(f'{args.rows} trans of {args.accounts} accounts. Account load {report["LEGACY_LOAD_SEC"] * 1000:.1f}ms -> '
+              f'{report["SCHEMA_LOAD_SEC"] * 1000:.1f}ms ({report["SPEEDUP"]:.0f}x). Migration {report["MIGRATION_SEC"]:.1f}s')
+    else:
+        conn = connect(args.db)
+        print(f'DB schema version {get_schema_version(conn)}')
@@ -1,42 +1,104 @@
 import sys
+import os
+import time
 import sqlite3
-import pandas as pd
+import argparse
 import datetime
-import pathlib
+from concurrent.futures import ThreadPoolExecutor
 
 sys.path.append("..")
 import config
 from config import statement_dispatcher_logger as statement_dispatcher_logger
+import statement_processor.db_schema as ds
 
 
-def scan_ftp_for_updates() -> None:
-    conn = sqlite3.connect(config.DATABASE_CONNECTION_STRING)
-    df_accounts = pd.read_sql('SELECT * FROM ACCOUNTS', 
-                              con=conn)
-    
-    df_accounts = df_accounts[df_accounts['ACTIVE'] == 1]
-    df_accounts = df_accounts.sort_values(by='LAST_CHECK_DT')
-    statement_dispatcher_logger.debug(f'Got total list account accounts {len(df_accounts.shape)}')
-    
-    for idx, row in df_accounts.iterrows():
-        src_ftp_file = pathlib.Path(f'{config.SRC_FTP_DIR}/{row["FTP_USER_ID"]}/{config.STATEMENT_FILENAME}')
-        statement_dispatcher_logger.debug(f'Start update scan for {str(src_ftp_file)}')
-        
-        if src_ftp_file.exists():
-            file_modified_dt = datetime.datetime.fromtimestamp(src_ftp_file.lstat().st_mtime)
-            last_check_dt = datetime.datetime.fromisoformat(row["LAST_CHECK_DT"]) if row["LAST_CHECK_DT"] else None
-            
-            if (not last_check_dt) or (file_modified_dt > last_check_dt):
-                cur = conn.cursor()
-                cur.execute('UPDATE ACCOUNTS SET LAST_CHECK_DT = ? WHERE FTP_USER_ID = ?', (datetime.datetime.now(), row["FTP_USER_ID"]))
-                conn.commit()
-                
-                statement_dispatcher_logger.debug(f'Enqueue processing modified file {src_ftp_file}')
-            else:
-                statement_dispatcher_logger.debug(f'Skipping not modified file {file_modified_dt} {src_ftp_file}')
+FTP_SCAN_CHUNK_SIZE = 1000
+
+
+def _scan_accounts_chunk(src_dir: str, file_name: str, accounts: list[tuple[str, float]]) -> list[str]:
+    """
+    Finds modified statement files of accounts chunk by os.scandir of their FTP user dirs.
+
+    Args:
+        src_dir (str): Dir with FTP users dirs
+        file_name (str): Statement file name in FTP user dir
+        accounts (list[tuple[str, float]]): List of (FTP_USER_ID, LAST_CHECK_DT timestamp or None)
+
+    Returns:
+        list[str]: FTP_USER_IDs with statement file modified after last check
+    """
+    res = []
+    for ftp_user_id, last_check_ts in accounts:
+        try:
+            with os.scandir(os.path.join(src_dir, ftp_user_id)) as entries:
+                entry = next((entry for entry in entries if entry.name == file_name and entry.is_file()), None)
+        except (FileNotFoundError, NotADirectoryError):
+            entry = None
+
+        if entry is None:
+            statement_dispatcher_logger.debug(f'File is not exists {ftp_user_id}/{file_name}')
+        elif (last_check_ts is None) or (entry.stat().st_mtime > last_check_ts):
+            res.append(ftp_user_id)
         else:
-            statement_dispatcher_logger.debug(f'File is not exists {src_ftp_file}')
-            
-        statement_dispatcher_logger.info(f'File scan finished {src_ftp_file}')
+            statement_dispatcher_logger.debug(f'Skipping not modified file {ftp_user_id}/{file_name}')
+
+    return res
+
+
+def scan_ftp_for_updates(conn: sqlite3.Connection = None, src_dir: str = config.SRC_FTP_DIR, file_name: str = config.STATEMENT_FILENAME,
+                         max_workers: int = None, chunk_size: int = FTP_SCAN_CHUNK_SIZE) -> dict:
+    """
+    Scans statement files of active accounts for updates. Dirs are listed by chunks of accounts in thread pool.
+    LAST_CHECK_DT of all modified accounts is updated by one executemany in one transaction.
+    It is the time scan started, so file modified while scan is in progress is found by the next scan.
+
+    Args:
+        conn (sqlite3.Connection, optional): Connection. Defaults to None means config.DATABASE_CONNECTION_STRING
+        src_dir (str, optional): Dir with FTP users dirs. Defaults to config.SRC_FTP_DIR
+        file_name (str, optional): Statement file name. Defaults to config.STATEMENT_FILENAME
+        max_workers (int, optional): Scanning threads count. Defaults to None means ThreadPoolExecutor default
+        chunk_size (int, optional): Accounts count scanned by one task. Defaults to FTP_SCAN_CHUNK_SIZE
+
+    Returns:
+        dict: Report {ACCOUNTS, MODIFIED_ACCOUNTS, FTP_USER_IDS, SECONDS, ACCOUNTS_PER_SEC}, FTP_USER_IDS are modified accounts
+    """
+    conn = conn or ds.connect(config.DATABASE_CONNECTION_STRING)
+    start_time = time.perf_counter()
+    check_dt = datetime.datetime.now().isoformat(sep=' ')
+
+    cur = conn.cursor()
+    res = cur.execute('SELECT FTP_USER_ID, LAST_CHECK_DT FROM ACCOUNTS WHERE ACTIVE = 1 ORDER BY LAST_CHECK_DT')
+    accounts = [(ftp_user_id, datetime.datetime.fromisoformat(last_check_dt).timestamp() if last_check_dt else None)
+                for ftp_user_id, last_check_dt in res.fetchall()]
+    statement_dispatcher_logger.debug(f'Got total list account accounts {len(accounts)}')
+
+    chunks = [accounts[idx:idx + chunk_size] for idx in range(0, len(accounts), chunk_size)]
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        ftp_user_ids = [ftp_user_id for chunk_res in executor.map(lambda chunk: _scan_accounts_chunk(src_dir, file_name, chunk), chunks)
+                                    for ftp_user_id in chunk_res]
+
+    with conn:
+        conn.executemany('UPDATE ACCOUNTS SET LAST_CHECK_DT = ? WHERE FTP_USER_ID = ?',
+                         [(check_dt, ftp_user_id) for ftp_user_id in ftp_user_ids])
+
+    report = {'ACCOUNTS': len(accounts), 'MODIFIED_ACCOUNTS': len(ftp_user_ids), 'FTP_USER_IDS': ftp_user_ids}
+    report['SECONDS'] = time.perf_counter() - start_time
+    report['ACCOUNTS_PER_SEC'] = report['ACCOUNTS'] / report['SECONDS']
+    statement_dispatcher_logger.info(f'FTP scan finished {report["ACCOUNTS"]} accounts, {report["MODIFIED_ACCOUNTS"]} modified, '
+                                     f'{report["ACCOUNTS_PER_SEC"]:.0f} accounts/s')
+
+    return report
+
 
+if __name__ == '__main__':
+    # python -m statement_processor.ftp_scanner [--src-dir <dir>] [--workers <n>] [--chunk-size <n>]
+    parser = argparse.ArgumentParser(description='Scans statement files of active accounts for updates')
+    parser.add_argument('--src-dir', default=config.SRC_FTP_DIR, help='Dir with FTP users dirs')
+    parser.add_argument('--workers', type=int, default=None, help='Scanning threads count')
+    parser.add_argument('--chunk-size', type=int, default=FTP_SCAN_CHUNK_SIZE, help='Accounts count scanned by one task')
+    parser.add_argument('--db', default=config.DATABASE_CONNECTION_STRING, help='DB file')
+    args = parser.parse_args()
 
+    report = scan_ftp_for_updates(conn=ds.connect(args.db), src_dir=args.src_dir, max_workers=args.workers, chunk_size=args.chunk_size)
+    print(f'{report["ACCOUNTS"]} accounts ({report["MODIFIED_ACCOUNTS"]} modified) in {report["SECONDS"]:.2f}s: '
+          f'{report["ACCOUNTS_PER_SEC"]:.0f} accounts/s')
@@ -0,0 +1,193 @@
+import sys
+import os
+import time
+import struct
+import select
+import pathlib
+import ctypes
+import ctypes.util
+import abc
+
+sys.path.append("..")
+import config
+from config import statement_dispatcher_logger as statement_dispatcher_logger
+
+
+# inotify(7) constants
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+INOTIFY_EVENT_HEADER = struct.Struct('iIII')  # wd, mask, cookie, len
+
+WATCHER_DEBOUNCE_SEC = 1.0
+WATCHER_POLLING_INTERVAL_SEC = 5.0
+
+
+class StatementWatcher(abc.ABC):
+    '''
+        Watches statement files in FTP users dirs <src_dir>/<FTP_USER_ID>/<file_name>.
+        Changes of one user are debounced: user is reported once, when there were no new changes of its file for debounce_sec.
+        Subclasses find changed users by _wait_for_changes().
+
+            watcher = create_statement_watcher(config.SRC_FTP_DIR)
+            for ftp_user_id, src_file_name in watcher.poll(timeout=watcher.debounce_sec):
+                ...
+    '''
+
+    def __init__(self, src_dir: str, file_name: str = config.STATEMENT_FILENAME, debounce_sec: float = WATCHER_DEBOUNCE_SEC):
+        self.src_dir = pathlib.Path(src_dir)
+        self.file_name = file_name
+        self.debounce_sec = debounce_sec
+        self.pending = {}  # FTP_USER_ID -> time of last change
+
+    def poll(self, timeout: float) -> list[tuple[str, pathlib.Path]]:
+        """
+        Waits for changes up to timeout.
+
+        Returns:
+            list[tuple[str, pathlib.Path]]: List of (FTP_USER_ID, file name) changed and debounced
+        """
+        for ftp_user_id in self._wait_for_changes(timeout):
+            self.pending[ftp_user_id] = time.monotonic()
+
+        now = time.monotonic()
+        res = [ftp_user_id for ftp_user_id, changed_time in self.pending.items() if now - changed_time >= self.debounce_sec]
+        for ftp_user_id in res:
+            del self.pending[ftp_user_id]
+
+        return [(ftp_user_id, self.src_dir.joinpath(ftp_user_id, self.file_name)) for ftp_user_id in res]
+
+    def close(self) -> None:
+        pass
+
+    @abc.abstractmethod
+    def _wait_for_changes(self, timeout: float) -> list[str]:
+        """Waits for changes up to timeout. Returns FTP_USER_IDs with changed statement file, may be repeated"""
+
+
+class InotifyStatementWatcher(StatementWatcher):
+    '''
+        Linux inotify watcher. File is reported after it's closed after writing or moved to user dir,
+        so partial uploads are never reported. Idle watcher is blocked in select() and uses no CPU.
+    '''
+
+    def __init__(self, src_dir: str, file_name: str = config.STATEMENT_FILENAME, debounce_sec: float = WATCHER_DEBOUNCE_SEC):
+        super().__init__(src_dir, file_name, debounce_sec)
+
+        self._libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        self._fd = self._libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+
+        self._wd_users = {}  # watch descriptor -> FTP_USER_ID, None for src_dir
+        self._add_watch(self.src_dir, IN_CREATE | IN_MOVED_TO, None)
+        for entry in os.scandir(self.src_dir):
+            if entry.is_dir():
+                self._add_watch(pathlib.Path(entry.path), IN_CLOSE_WRITE | IN_MOVED_TO, entry.name)
+
+    def close(self) -> None:
+        os.close(self._fd)
+
+    def _add_watch(self, path: pathlib.Path, mask: int, ftp_user_id: str) -> None:
+        wd = self._libc.inotify_add_watch(self._fd, str(path).encode(), mask)
+        if wd < 0:
+            raise OSError(ctypes.get_errno(), f'inotify_add_watch failed for {str(path)}')
+        self._wd_users[wd] = ftp_user_id
+
+    def _wait_for_changes(self, timeout: float) -> list[str]:
+        if not select.select([self._fd], [], [], timeout)[0]:
+            return []
+
+        res = []
+        buffer = os.read(self._fd, 64 * 1024)
+        offset = 0
+        while offset < len(buffer):
+            wd, mask, _, name_len = INOTIFY_EVENT_HEADER.unpack_from(buffer, offset)
+            name = buffer[offset + INOTIFY_EVENT_HEADER.size:offset + INOTIFY_EVENT_HEADER.size + name_len].rstrip(b'\0').decode()
+            offset += INOTIFY_EVENT_HEADER.size + name_len
+
+            if mask & IN_Q_OVERFLOW:
+                # Events are lost, so all users with file are reported
+                statement_dispatcher_logger.warning(f'inotify queue overflow for {str(self.src_dir)}')
+                res += [entry.name for entry in os.scandir(self.src_dir) if os.path.isfile(os.path.join(entry.path, self.file_name))]
+            elif mask & IN_IGNORED:
+                self._wd_users.pop(wd, None)
+            elif self._wd_users.get(wd, '') is None:
+                # New user dir. File can be uploaded before the watch is added
+                if mask & IN_ISDIR:
+                    self._add_watch(self.src_dir.joinpath(name), IN_CLOSE_WRITE | IN_MOVED_TO, name)
+                    if self.src_dir.joinpath(name, self.file_name).is_file():
+                        res.append(name)
+            elif name == self.file_name and wd in self._wd_users:
+                res.append(self._wd_users[wd])
+
+        return res
+
+
+class PollingStatementWatcher(StatementWatcher):
+    '''
+        Fallback watcher for systems without inotify. Files are scanned every polling_interval_sec by os.scandir.
+        File is reported, when its (mtime, size) has changed and then stays the same for debounce_sec,
+        so partial uploads are not reported. Files existing at start are not reported.
+    '''
+
+    def __init__(self, src_dir: str, file_name: str = config.STATEMENT_FILENAME, debounce_sec: float = WATCHER_DEBOUNCE_SEC,
+                 polling_interval_sec: float = WATCHER_POLLING_INTERVAL_SEC):
+        # File must stay the same for one more scan at least
+        super().__init__(src_dir, file_name, max(debounce_sec, polling_interval_sec))
+        self.polling_interval_sec = polling_interval_sec
+        self._last_scan_time = time.monotonic()
+        self._file_stats = self._scan()
+
+    def _scan(self) -> dict:
+        res = {}
+        for entry in os.scandir(self.src_dir):
+            try:
+                stat = os.stat(os.path.join(entry.path, self.file_name))
+                res[entry.name] = (stat.st_mtime_ns, stat.st_size)
+            except (FileNotFoundError, NotADirectoryError):
+                pass
+        return res
+
+    def _wait_for_changes(self, timeout: float) -> list[str]:
+        time.sleep(max(0, min(timeout, self._last_scan_time + self.polling_interval_sec - time.monotonic())))
+        if time.monotonic() - self._last_scan_time < self.polling_interval_sec:
+            return []
+
+        self._last_scan_time = time.monotonic()
+        file_stats = self._scan()
+        res = [ftp_user_id for ftp_user_id, stat in file_stats.items() if self._file_stats.get(ftp_user_id) != stat]
+        self._file_stats = file_stats
+
+        return res
+
+
+def create_statement_watcher(src_dir: str, **kwargs) -> StatementWatcher:
+    """Creates inotify watcher or polling one, if inotify is not available"""
+    try:
+        return InotifyStatementWatcher(src_dir, **kwargs)
+    except (OSError, AttributeError, TypeError) as e:
+        statement_dispatcher_logger.warning(f'inotify is not available, polling is used for {src_dir}: {e}')
+        return PollingStatementWatcher(src_dir, **kwargs)
+
+
+if __name__ == '__main__':
+    # python -m statement_processor.ftp_watcher
+    import statement_processor.statement_dispatcher as statement_dispatcher
+
+    dispatcher = statement_dispatcher.create_statement_job_dispatcher()
+    watcher = create_statement_watcher(config.SRC_FTP_DIR)
+    statement_dispatcher_logger.info(f'Start watching {config.SRC_FTP_DIR} by {type(watcher).__name__}')
+    try:
+        # Dispatch on every poll, so jobs held by full queues are enqueued as soon as queues have room
+        while True:
+            for ftp_user_id, src_file_name in watcher.poll(timeout=watcher.debounce_sec):
+                statement_dispatcher_logger.debug(f'Statement file changed {str(src_file_name)}')
+                dispatcher.submit(ftp_user_id, src_file_name)
+            if dispatcher.dispatch() > 0:
+                statement_dispatcher_logger.info(f'Statement jobs stats {dispatcher.get_stats()}')
+    finally:
+        watcher.close()
@@ -0,0 +1,167 @@
+import sys
+import time
+import collections
+from dataclasses import dataclass
+
+sys.path.append("..")
+import config
+from config import statement_dispatcher_logger as statement_dispatcher_logger
+
+
+JOB_PRIORITY_INTERACTIVE = 0  # Bot uploads
+JOB_PRIORITY_RESCAN = 1  # FTP watcher and scanner
+JOB_DISPATCHER_WAIT_STATS_SIZE = 1000
+# rq.job.JobStatus values of jobs which don't run anymore. Tuple, because JobStatus members are equal but not hash equal to them
+JOB_DONE_STATUSES = ('finished', 'failed', 'stopped', 'canceled')
+
+
+@dataclass
+class PendingJob:
+    ftp_user_id: str
+    src_file_name: str
+    priority: int
+    submitted_time: float  # Time of first submit, so coalescing doesn't reset wait time
+    coalesced_cnt: int = 0
+
+
+class InProcessJob:
+    '''
+        In-process stand-in of rq.job.Job with the same get_status() used by StatementJobDispatcher.
+    '''
+
+    def __init__(self, func, args: tuple, kwargs: dict):
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+        self.status = 'queued'
+
+    def get_status(self) -> str:
+        return self.status
+
+    def perform(self):
+        self.status = 'started'
+        try:
+            res = self.func(*self.args, **self.kwargs)
+        except Exception:
+            self.status = 'failed'
+            raise
+        self.status = 'finished'
+        return res
+
+
+class InProcessQueue:
+    '''
+        In-process stand-in of rq.Queue with the same enqueue() and count used by StatementJobDispatcher.
+        Jobs are called by run_next() in the caller process.
+    '''
+
+    def __init__(self, name: str):
+        self.name = name
+        self.jobs = collections.deque()
+
+    @property
+    def count(self) -> int:
+        return len(self.jobs)
+
+    def enqueue(self, func, *args, **kwargs) -> InProcessJob:
+        job = InProcessJob(func, args, kwargs)
+        self.jobs.append(job)
+        return job
+
+    def run_next(self):
+        return self.jobs.popleft().perform()
+
+
+class StatementJobDispatcher:
+    '''
+        Coalescing buffer in front of statement processing queues.
+            - Submits of one FTP_USER_ID are coalesced to one pending job, the latest file wins
+            - FTP_USER_ID has at most one job in queue or in work. Its next job stays pending and keeps coalescing
+              until dispatch() finds the previous one done, so statements of one account are never processed concurrently
+            - Pending jobs are enqueued by dispatch() in order of priority and wait time
+            - Queue with max_queue_depth jobs gets no more jobs, so they stay pending and keep coalescing
+
+            dispatcher = StatementJobDispatcher(func=process_account_statement_file,
+                                                queues={JOB_PRIORITY_INTERACTIVE: Queue(...), JOB_PRIORITY_RESCAN: Queue(...)})
+            dispatcher.submit(ftp_user_id, src_file_name)
+            dispatcher.dispatch()
+    '''
+
+    def __init__(self, func, queues: dict, max_queue_depth: int = config.STATEMENT_PROCESSING_MAX_QUEUE_DEPTH, clock=time.monotonic):
+        self.func = func
+        self.queues = queues  # priority -> rq.Queue or InProcessQueue
+        self.max_queue_depth = max_queue_depth
+        self.clock = clock
+
+        self.pending = {}  # FTP_USER_ID -> PendingJob
+        self.in_flight = {}  # FTP_USER_ID -> enqueued rq.job.Job or InProcessJob
+        self.submitted_cnt = 0
+        self.coalesced_cnt = 0
+        self.dispatched_cnt = 0
+        self.wait_times = collections.deque(maxlen=JOB_DISPATCHER_WAIT_STATS_SIZE)
+
+    def submit(self, ftp_user_id: str, src_file_name: str, priority: int = JOB_PRIORITY_RESCAN) -> bool:
+        """
+        Adds processing job of FTP user statement file.
+
+        Returns:
+            bool: True if job is coalesced with pending job of the same user
+        """
+        self.submitted_cnt += 1
+        job = self.pending.get(ftp_user_id)
+        if job is None:
+            self.pending[ftp_user_id] = PendingJob(ftp_user_id, str(src_file_name), priority, self.clock())
+            return False
+
+        job.src_file_name = str(src_file_name)
+        job.priority = min(job.priority, priority)
+        job.coalesced_cnt += 1
+        self.coalesced_cnt += 1
+        statement_dispatcher_logger.debug(f'Coalesce processing job of {ftp_user_id} {job.coalesced_cnt} times')
+
+        return True
+
+    def _release_done_jobs(self) -> None:
+        for ftp_user_id, queued_job in list(self.in_flight.items()):
+            status = queued_job.get_status()
+            if status is None or status in JOB_DONE_STATUSES:  # rq returns None for expired job
+                del self.in_flight[ftp_user_id]
+
+    def dispatch(self) -> int:
+        """Enqueues pending jobs of accounts without job in flight while queues have room. Returns count of enqueued jobs"""
+        self._release_done_jobs()
+        queue_depths = {priority: queue.count for priority, queue in self.queues.items()}
+
+        res = 0
+        for job in sorted(self.pending.values(), key=lambda job: (job.priority, job.submitted_time)):
+            if queue_depths[job.priority] >= self.max_queue_depth or job.ftp_user_id in self.in_flight:
+                continue
+
+            self.in_flight[job.ftp_user_id] = self.queues[job.priority].enqueue(self.func, job.ftp_user_id, job.src_file_name)
+            queue_depths[job.priority] += 1
+            del self.pending[job.ftp_user_id]
+            self.wait_times.append(self.clock() - job.submitted_time)
+            statement_dispatcher_logger.info(f'Enqueue statement processing {job.ftp_user_id} {job.src_file_name}')
+            res += 1
+
+        self.dispatched_cnt += res
+        return res
+
+    def get_stats(self) -> dict:
+        """
+        Returns:
+            dict: {PENDING, IN_FLIGHT, QUEUE_DEPTH: {queue name: jobs count}, SUBMITTED, COALESCED, DISPATCHED,
+                   WAIT_SEC_MEAN, WAIT_SEC_MAX, OLDEST_PENDING_SEC}. Wait is time from submit to enqueue of recent jobs
+        """
+        now = self.clock()
+        return {
+            'PENDING': len(self.pending),
+            'IN_FLIGHT': len(self.in_flight),
+            'QUEUE_DEPTH': {queue.name: queue.count for queue in self.queues.values()},
+            'SUBMITTED': self.submitted_cnt,
+            'COALESCED': self.coalesced_cnt,
+            'DISPATCHED': self.dispatched_cnt,
+            'WAIT_SEC_MEAN': sum(self.wait_times) / len(self.wait_times) if self.wait_times else 0.0,
+            'WAIT_SEC_MAX': max(self.wait_times, default=0.0),
+            'OLDEST_PENDING_SEC': max((now - job.submitted_time for job in self.pending.values()), default=0.0),
+        }
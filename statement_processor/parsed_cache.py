@@ -0,0 +1,91 @@
+import json
+import shutil
+import pathlib
+import uuid
+import numpy as np
+import pandas as pd
+
+
+PARSED_CACHE_SUFFIX = '.parsed'
+PARSED_CACHE_META_FILENAME = 'meta.json'
+# Cache saved by other version is ignored, so statement is parsed again. Version 1 typed cols by analizer.schema.TRANS_SCHEMA
+PARSED_CACHE_VERSION = 2
+
+
+def get_parsed_statement_path(cache_dir: pathlib.Path, content_hash: str) -> pathlib.Path:
+    return pathlib.Path(cache_dir).joinpath(f'{content_hash}{PARSED_CACHE_SUFFIX}')
+
+
+def save_parsed_statement(df: pd.DataFrame, cache_dir: pathlib.Path, content_hash: str) -> pathlib.Path:
+    """
+    Saves parsed statement DataFrame as dir of one .npy file per col keyed by content hash of statement file.
+    Cols keep dtypes of parsed statement, so trans loaded from cache are saved to DB the same as parsed ones. 
+    String cols, money cols with statement strings included, are saved as category codes with categories in meta.json, 
+    so every col can be loaded by memory mapping. Object cols are restored from categories on load.
+
+    Args:
+        df (pd.DataFrame): Statement DataFrame after prepare_columns and comments recovery
+        cache_dir (pathlib.Path): Dir of cache, e.g. processing dir of FTP user
+        content_hash (str): Content hash of statement file
+
+    Returns:
+        pathlib.Path: Dir of saved statement
+    """
+    meta = {'version': PARSED_CACHE_VERSION, 'columns': [], 'dtypes': {}, 'categories': {}}
+    tmp_path = pathlib.Path(cache_dir).joinpath(f'{content_hash}_{uuid.uuid4().hex}.tmp')
+    tmp_path.mkdir(parents=True)
+    for idx, col in enumerate(df.columns):
+        values = df[col]
+        meta['dtypes'][col] = str(values.dtype)
+        if not (pd.api.types.is_numeric_dtype(values) or pd.api.types.is_datetime64_any_dtype(values)):
+            values = values.astype('category')
+        if isinstance(values.dtype, pd.CategoricalDtype):
+            meta['categories'][col] = values.cat.categories.tolist()
+            values = values.cat.codes
+
+        meta['columns'].append(col)
+        # Datetime cols of DataFrame unpickled from worker process have dtype with empty metadata, which np.save warns about
+        values = values.to_numpy()
+        np.save(tmp_path.joinpath(f'{idx}.npy'), values.view(np.dtype(values.dtype.str)))
+
+    tmp_path.joinpath(PARSED_CACHE_META_FILENAME).write_text(json.dumps(meta, default=str))
+
+    # Rename is atomic, so readers never see a partially saved statement
+    path = get_parsed_statement_path(cache_dir, content_hash)
+    try:
+        tmp_path.rename(path)
+    except OSError:
+        shutil.rmtree(tmp_path)  # The same statement has been saved already
+
+    return path
+
+
+def load_parsed_statement(cache_dir: pathlib.Path, content_hash: str, mmap: bool = True) -> pd.DataFrame | None:
+    """
+    Loads statement DataFrame saved by save_parsed_statement().
+
+    Args:
+        cache_dir (pathlib.Path): Dir of cache
+        content_hash (str): Content hash of statement file
+        mmap (bool, optional): Map cols files to memory instead of reading. Defaults to True
+
+    Returns:
+        pd.DataFrame | None: Statement DataFrame or None if there is no such statement in cache or it's saved by other version
+    """
+    path = get_parsed_statement_path(cache_dir, content_hash)
+    if not path.joinpath(PARSED_CACHE_META_FILENAME).exists():
+        return None
+
+    meta = json.loads(path.joinpath(PARSED_CACHE_META_FILENAME).read_text())
+    if meta.get('version') != PARSED_CACHE_VERSION:
+        return None
+    cols = {}
+    for idx, col in enumerate(meta['columns']):
+        values = np.load(path.joinpath(f'{idx}.npy'), mmap_mode='r' if mmap else None)
+        if col in meta['categories']:
+            values = pd.Categorical.from_codes(values, categories=meta['categories'][col])
+            if meta['dtypes'][col] == 'object':
+                values = values.astype(object)
+        cols[col] = values
+
+    return pd.DataFrame(cols, copy=False)
@@ -0,0 +1,91 @@
+import csv
+import gzip
+import uuid
+import pathlib
+import datetime
+
+
+ARCHIVE_OBJECTS_DIRNAME = 'objects'
+ARCHIVE_MANIFEST_FILENAME = 'manifest.csv'
+ARCHIVE_MANIFEST_COLUMNS = ['FILE_NAME', 'CONTENT_HASH', 'ARCHIVED_DT']
+
+
+def get_archive_object_path(processing_dir: pathlib.Path, content_hash: str) -> pathlib.Path:
+    return pathlib.Path(processing_dir).joinpath(ARCHIVE_OBJECTS_DIRNAME, content_hash[:2], f'{content_hash}.gz')
+
+
+def archive_statement(content: bytes, content_hash: str, dst_file_name: pathlib.Path) -> pathlib.Path:
+    """
+    Saves statement to processing dir as content-addressed gzip object, instead of full copy per processing:
+        - <processing dir>/objects/<hash[:2]>/<hash>.gz is written only once for the same content
+        - <processing dir>/<FTP_USER_ID>/manifest.csv maps dst_file_name, i.e. FILE_NAME col of trans, to content hash
+
+    Args:
+        content (bytes): Content of statement file
+        content_hash (str): Content hash of statement file
+        dst_file_name (pathlib.Path): File name in processing dir <processing dir>/<FTP_USER_ID>/<file name>
+
+    Returns:
+        pathlib.Path: Object path
+    """
+    dst_file_name = pathlib.Path(dst_file_name)
+    object_path = get_archive_object_path(dst_file_name.parent.parent, content_hash)
+
+    if not object_path.exists():
+        object_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = object_path.with_name(f'{object_path.name}.{uuid.uuid4().hex}.tmp')
+        tmp_path.write_bytes(gzip.compress(content, mtime=0))
+        tmp_path.replace(object_path)  # Rename is atomic, so readers never see a partially written object
+
+    dst_file_name.parent.mkdir(parents=True, exist_ok=True)
+    manifest_path = dst_file_name.parent.joinpath(ARCHIVE_MANIFEST_FILENAME)
+    is_new_manifest = not manifest_path.exists()
+    with open(manifest_path, 'a', newline='') as f:
+        writer = csv.writer(f)
+        if is_new_manifest:
+            writer.writerow(ARCHIVE_MANIFEST_COLUMNS)
+        writer.writerow([dst_file_name.name, content_hash, datetime.datetime.now().isoformat(sep=' ')])
+
+    return object_path
+
+
+def load_archive_manifest(user_dir: pathlib.Path) -> list[dict]:
+    """Returns records of manifest of FTP user dir in order of archiving"""
+    manifest_path = pathlib.Path(user_dir).joinpath(ARCHIVE_MANIFEST_FILENAME)
+    if not manifest_path.exists():
+        return []
+
+    with open(manifest_path, newline='') as f:
+        return list(csv.DictReader(f))
+
+
+def read_archived_statement(file_name: pathlib.Path, content_hash: str = None) -> bytes:
+    """
+    Reads statement archived as file_name by archive_statement().
+    If content_hash of file is given, e.g. by get_archived_statement_files(), its object is read without manifest lookup.
+
+    Raises:
+        FileNotFoundError: Raises when manifest has no such file name
+    """
+    file_name = pathlib.Path(file_name)
+    if content_hash is not None:
+        return gzip.decompress(get_archive_object_path(file_name.parent.parent, content_hash).read_bytes())
+
+    for record in load_archive_manifest(file_name.parent):
+        if record['FILE_NAME'] == file_name.name:
+            return gzip.decompress(get_archive_object_path(file_name.parent.parent, record['CONTENT_HASH']).read_bytes())
+
+    raise FileNotFoundError(f'There is no {file_name.name} in archive manifest of {str(file_name.parent)}')
+
+
+def get_archived_statement_files(processing_dir: pathlib.Path) -> list[tuple[str, pathlib.Path, str]]:
+    """
+    Lists all archived statements in order of archiving for every FTP user. Manifest of every user is read once.
+
+    Returns:
+        list[tuple[str, pathlib.Path, str]]: List of (FTP_USER_ID, file name in processing dir, CONTENT_HASH)
+    """
+    res = []
+    for user_dir in sorted(p for p in pathlib.Path(processing_dir).iterdir() if p.is_dir() and p.name != ARCHIVE_OBJECTS_DIRNAME):
+        res += [(user_dir.name, user_dir.joinpath(record['FILE_NAME']), record['CONTENT_HASH']) for record in load_archive_manifest(user_dir)]
+    return res
@@ -4,30 +4,21 @@ import logging
 import sys
 import sqlite3
 
-import statement_processor
-import ftp_scanner
-
 sys.path.append("..")
 import config
 from config import statement_dispatcher_logger as statement_dispatcher_logger
+import statement_processor.statement_processor as sp
+import statement_processor.ftp_scanner as ftp_scanner
+import statement_processor.job_dispatcher as jd
 
-def enqueue_process_statement_file():
-    ftp_user_name = '123456789'
-    src_file_name = f'{config.SRC_FTP_DIR}/{ftp_user_name}/{config.STATEMENT_FILENAME}'
-    
-    q = Queue(connection=Redis(), name=config.STATEMENT_PROCESSING_QUEUE_NAME)
-    job = q.enqueue(statement_processor.process_statement_file, 
-                    'sournkz',
-                    ftp_user_name,
-                    src_file_name,
-                    config.PROCESSING_DIR)
-    
-    statement_dispatcher_logger.info(f'Enqueue statement processing {job}')
+def create_statement_job_dispatcher() -> jd.StatementJobDispatcher:
+    """Creates dispatcher of statement processing jobs to Redis queues, interactive queue is for bot uploads"""
+    redis = Redis()
+    return jd.StatementJobDispatcher(func=sp.process_account_statement_file,
+                                     queues={jd.JOB_PRIORITY_INTERACTIVE: Queue(connection=redis, name=config.STATEMENT_INTERACTIVE_PROCESSING_QUEUE_NAME),
+                                             jd.JOB_PRIORITY_RESCAN: Queue(connection=redis, name=config.STATEMENT_PROCESSING_QUEUE_NAME)})
     
 def enqueue_scan_ftp_for_updates():
-    ftp_user_name = '123456789'
-    src_file_name = f'{config.SRC_FTP_DIR}/{ftp_user_name}/{config.STATEMENT_FILENAME}'
-    
     q = Queue(connection=Redis(), name=config.FTP_SCAN_QUEUE_NAME)
     job = q.enqueue(ftp_scanner.scan_ftp_for_updates)
     
@@ -1,10 +1,14 @@
 import sys
-import shutil
+import io
+import re
+import hashlib
 import pathlib
 import uuid
 import datetime
 from enum import Enum
+from typing import Iterator
 from bs4 import BeautifulSoup
+from lxml import etree
 import pandas as pd
 import numpy as np
 import sqlite3
@@ -13,6 +17,12 @@ sys.path.append("..")
 import config
 from config import statement_dispatcher_logger
 import analizer as an
+import analizer.grid_state as gs
+import analizer.schema as sc
+import statement_processor.parsed_cache as pc
+import statement_processor.statement_archive as sa
+import statement_processor.db_schema as ds
+import statement_processor.table_writer as tw
 
 
 class HTMLStatementType(Enum):
@@ -64,6 +74,20 @@ TYPE_FOR_BALANCE = "balance"
 TYPE_FOR_SELL = 'sell'
 TYPE_FOR_BUY = 'buy'
 
+TRANS_KEY_COLUMNS = ['FTP_USER_ID', 'ORDER_ID']
+
+TR_END_PATTERN = re.compile(rb'</tr\s*>', re.IGNORECASE)
+
+PROCESSED_PREFIX_LOOKUP_CHUNK_SIZE = 500 # Hashes in one IN (...) of lookup
+
+STATEMENT_HEADER_SIZE = 8 * 1024 # Template type and account are in the first <b> and <td> tags of statement
+
+GRID_STATE_NUMERIC_COLUMNS = ['ORDER_ID', 'QTY', 'OPEN_PRICE', 'PROFIT']
+
+# Cols of prepared statement which are stored to DB as is, so they can be typed without changing stored values.
+# Money cols keep statement strings until loading, cuz MT4 template has broken numbers there.
+PREPARED_COLUMNS_SCHEMA = {col: sc.TRANS_SCHEMA[col] for col in ['ORDER_ID', 'SIDE', 'SYMBOL', 'FTP_USER_ID', 'FILE_NAME']}
+
 
 class StatementProcessingError(Exception):
     pass
@@ -78,119 +102,207 @@ class StatementProcessingFileAccountIsNotAssignedToUserError(StatementProcessing
     pass
 
 
-def get_file_details(file_name: pathlib.Path) -> dict:
+def read_statement_file(file_name: pathlib.Path) -> bytes:
+    """Reads statement file once. Its content is shared by copying, header detection and parsing"""
+    with open(str(file_name), 'rb') as f:
+        return f.read()
+
+def get_file_details(file_name: pathlib.Path, content: bytes = None) -> dict:
     """
-    Parses HTML template and determinants it format - MT4 or Roboforex
+    Parses HTML template and determinants it format - MT4 or Roboforex.
+    Only STATEMENT_HEADER_SIZE first bytes are parsed, if they contain the header.
 
     Args:
         file_name (pathlib.Path): file name
+        content (bytes, optional): Content of file. Defaults to None means file is read
 
     Returns:
         dict: {type: HTMLStatementType, account: <Roboforex account number>, name: <Roboforex account owner name>
     """
-    with open(str(file_name), 'r') as f:
-        content = f.read()
-        soup = BeautifulSoup(content, 'lxml')
-
-        res = {'type': HTMLStatementType(soup.find('b').text), 
-                'account': soup.find('td').b.text.replace('Account: ', '')}
-        res['name'] = soup.find_all('td')[1].b.text.replace('Name: ', '') \
-            if res['type'] == HTMLStatementType.MT4_STATEMENT else ''
-            
-        return res
+    content = read_statement_file(file_name) if content is None else content
+    
+    for size in [STATEMENT_HEADER_SIZE, len(content)]:
+        soup = BeautifulSoup(content[:size].decode('utf-8', errors='ignore'), 'lxml')
+        td_list = soup.find_all('td', limit=2)
+        if soup.find('b') is not None and len(td_list) == 2 and td_list[0].b is not None:
+            break
+
+    res = {'type': HTMLStatementType(soup.find('b').text), 
+            'account': td_list[0].b.text.replace('Account: ', '')}
+    res['name'] = td_list[1].b.text.replace('Name: ', '') \
+        if res['type'] == HTMLStatementType.MT4_STATEMENT else ''
+        
+    return res
+
+def create_processed_files_table(conn: sqlite3.Connection) -> None:
+    conn.execute(f'''
+                 CREATE TABLE IF NOT EXISTS {config.PROCESSED_FILES_TABLE_NAME} (
+                    FTP_USER_ID	TEXT,
+                    CONTENT_HASH	TEXT,
+                    TRANS_PREFIX_SIZE	INTEGER,
+                    TRANS_PREFIX_HASH	TEXT,
+                    FILE_NAME	TEXT,
+                    PROCESSED_DT	TIMESTAMP,
+                    PRIMARY KEY (FTP_USER_ID, CONTENT_HASH));
+                 ''')
+    conn.execute(f'CREATE INDEX IF NOT EXISTS ix_{config.PROCESSED_FILES_TABLE_NAME}_prefix ON {config.PROCESSED_FILES_TABLE_NAME} (FTP_USER_ID, TRANS_PREFIX_HASH)')
+
+def get_content_hash(content: bytes) -> str:
+    return hashlib.sha256(content).hexdigest()
+
+def find_trans_header_end(content: bytes) -> int:
+    """Returns offset of content just after header row of trans table"""
+    return TR_END_PATTERN.search(content, content.index(b'>Ticket<')).end()
+
+def find_trans_rows_end(content: bytes, start: int, row_cnt: int) -> int:
+    """Returns offset of content just after row_cnt trans rows starting from start offset. Every trans row ends by </tr>"""
+    end = start
+    for _, m in zip(range(row_cnt), TR_END_PATTERN.finditer(content, start)):
+        end = m.end()
+    return end
+
+def is_file_processed(ftp_user_id: str, content_hash: str, conn: sqlite3.Connection) -> bool:
+    create_processed_files_table(conn)
+    res = conn.execute(f'SELECT COUNT(*) FROM {config.PROCESSED_FILES_TABLE_NAME} WHERE FTP_USER_ID = ? AND CONTENT_HASH = ?', 
+                       (ftp_user_id, content_hash))
+    return res.fetchone()[0] > 0
+
+def get_trans_prefix_key(content: bytes, trans_rows_end: int) -> tuple[int, str]:
+    """
+    Returns key of processed trans rows registered by register_processed_file(). 
+    Statement header has generation time, so key covers only trans rows after header row of trans table.
 
-def copy_file_from_ftp_to_processing_dir(src: pathlib.Path, dst: pathlib.Path) -> None:
-    dst.parent.mkdir(parents=True, exist_ok=True)  # create path if not exists
-    shutil.copy2(src=str(src), dst=str(dst))
+    Returns:
+        tuple[int, str]: Size and hash of content from the end of trans header up to trans_rows_end
+    """    
+    header_end = find_trans_header_end(content)
+    return trans_rows_end - header_end, get_content_hash(content[header_end:trans_rows_end])
+
+def get_processed_trans_prefix_size(ftp_user_id: str, content: bytes, conn: sqlite3.Connection) -> int:
+    """
+    Finds already processed file of account, which trans rows are the start of trans rows of content, 
+    i.e. content is new export of that file with new trans rows appended. 
+    Content is hashed once: hash of trans rows up to every row end is looked up by index (FTP_USER_ID, TRANS_PREFIX_HASH).
 
-def read_html_file_as_mt4(file_name: pathlib.Path) -> pd.DataFrame:
+    Returns:
+        int: Offset of content just after processed trans rows. 0 if there is no such processed file
+    """    
+    create_processed_files_table(conn)
+    
+    header_end = find_trans_header_end(content)
+    hasher = hashlib.sha256()
+    prefix_ends = {}  # hash -> offset of row end
+    start = header_end
+    for m in TR_END_PATTERN.finditer(content, header_end):
+        hasher.update(content[start:m.end()])
+        prefix_ends[hasher.copy().hexdigest()] = m.end()
+        start = m.end()
+    
+    res = 0
+    prefix_hashes = list(prefix_ends)
+    for idx in range(0, len(prefix_hashes), PROCESSED_PREFIX_LOOKUP_CHUNK_SIZE):
+        chunk = prefix_hashes[idx:idx + PROCESSED_PREFIX_LOOKUP_CHUNK_SIZE]
+        for prefix_size, prefix_hash in conn.execute(f'''SELECT TRANS_PREFIX_SIZE, TRANS_PREFIX_HASH FROM {config.PROCESSED_FILES_TABLE_NAME} 
+                                                         WHERE FTP_USER_ID = ? AND TRANS_PREFIX_HASH IN ({', '.join('?' * len(chunk))})''', 
+                                                     (ftp_user_id, *chunk)):
+            if prefix_ends[prefix_hash] - header_end == prefix_size:
+                res = max(res, prefix_ends[prefix_hash])
+    return res
+
+def register_processed_file(ftp_user_id: str, content_hash: str, trans_prefix_size: int, trans_prefix_hash: str, 
+                            file_name: str, conn: sqlite3.Connection) -> None:
+    create_processed_files_table(conn)
+    with conn:
+        conn.execute(f'INSERT OR REPLACE INTO {config.PROCESSED_FILES_TABLE_NAME} VALUES (?, ?, ?, ?, ?, ?)', 
+                     (ftp_user_id, 
+                      content_hash, 
+                      trans_prefix_size, 
+                      trans_prefix_hash,
+                      file_name,
+                      datetime.datetime.now().isoformat(sep=' ')))
+
+def iter_statement_trans_rows(file_name: pathlib.Path | io.BytesIO) -> Iterator[dict]:
+    """
+    Streams rows of the first trans table ('Closed Transactions') of MT4 or Roboforex statement.
+    HTML is parsed incrementally by <tr> and reading of file stops at the end of the table, 
+    i.e. at the first row without Ticket after the header row. Parsed <tr> are dropped to keep memory low.
+    
+    Cells are keyed by header names. Default MT4 and Roboforex templates contain 2 cols with same name 'Price', 
+    so why the second one is named 'Close'.
+    Balance trans have joined <td> from 'Size' col. Its text is returned as 'Comment', 
+    all cols under it are 0 and 'Close Time' is equal to 'Open Time'.
+
+    Args:
+        file_name (pathlib.Path | io.BytesIO): file name or file object with statement content
+
+    Yields:
+        dict: Row of trans table {col: text}
+    """
+    columns = None
+    source = file_name if isinstance(file_name, io.IOBase) else str(file_name)
+    for _, tr in etree.iterparse(source, events=('end',), tag='tr', html=True):
+        cells = [(' '.join(''.join(td.itertext()).split()), int(td.get('colspan', 1))) for td in tr.iterfind('td')]
+        
+        # Drop parsed rows
+        tr.clear()
+        while tr.getprevious() is not None:
+            del tr.getparent()[0]
+        
+        if columns is None:
+            if len(cells) > 0 and cells[0][0] == 'Ticket':
+                columns = [text for text, _ in cells]
+                columns[9] = 'Close'
+            continue
+
+        if len(cells) == 0 or cells[0][0] == '':
+            break  # End of trans table
+        
+        row, comment = {}, ''
+        col_idx = 0
+        for text, colspan in cells:
+            if colspan > 1:
+                comment = text
+                row.update({col: 0 for col in columns[col_idx:col_idx + colspan]})
+            else:
+                row[columns[col_idx]] = text
+            col_idx += colspan
+        row['Comment'] = comment
+        
+        if row['Type'] == TYPE_FOR_BALANCE:
+            row['Close Time'] = row['Open Time']
+        
+        yield row
+
+def read_html_file_as_mt4(file_name: pathlib.Path | io.BytesIO) -> pd.DataFrame:
     """
     Parses HTML of MT4 default template. 
     Comments for trading trans [buy, sell] is created from scratch and not got from tags. This process is unified with Roboforex template.
+    You can get trading trans ['buy', 'sell'] original comments from title attr of Ticket <td>.
 
     Args:
-        file_name (pathlib.Path): file name
+        file_name (pathlib.Path | io.BytesIO): file name or file object with statement content
 
     Returns:
         pd.DataFrame: Result DataFrame
     """    
-    df_list = pd.read_html(str(file_name))
-    df = df_list[0] # Only one table in default statement.htm template
-    
-    # Get trans comments from <td> title attr and add them to df column
-    # You can get trading trans ['buy', 'sell'] original comments from html
-    # Use code below
-    # with open(str(file_name), 'r') as f:
-    #     contents = f.read()
-    #     soup = BeautifulSoup(contents, 'lxml')
-    #     td_list = soup.find_all('td', title=True)
-    #     trans_comments = {tag.string: tag['title'] for tag in td_list}
-    #     df['Comment'] = [trans_comments.get(row[0], '') for idx, row in df.iterrows()]
-    
-    
-    start_idx = df[df[0] == 'Ticket'][0].index[0]
-    finish_idx = df.iloc[start_idx + 1:][df[0].isna()][0].index[0]
-    df = df.iloc[start_idx:finish_idx] 
-    df.columns = list(df.iloc[0]) # Move 1st row to cols
-    
-    # Default MT4 and Roboforex statement template contains 2 cols with same name 'Price'
-    # So why we make force change name of last price to 'Close'
-    df.columns.values[9] = 'Close' 
-    
-    # Default MT4 and Roboforex statement template has joined <td> for 'Size' for all type='balance' trans.
-    # So why we copy comment from 'Size' to correct col
-    df.loc[(df['Type'] == TYPE_FOR_BALANCE), 'Comment'] = df['Size']
-    
-    # Default MT4 and Roboforex statement template has joined <td> for all type='balance' trans.
-    # So why we clear str for all float cols of all type='balance' trans.
-    df.loc[(df['Type'] == TYPE_FOR_BALANCE), ZERO_COLUMNS_FOR_BALANCE_TRANS_OF_STATEMENT_TEMPLATE[HTMLStatementType.ROBOFOREX_WEB_STATEMENT]] = 0
-    
-    # Copy OPEN_DT tot CLOSE_DT for all type='balance' trans.
-    df.loc[(df['Type'] == TYPE_FOR_BALANCE), 'Close Time'] = df['Open Time']
-    
-    return df.iloc[1:]
+    return pd.DataFrame(iter_statement_trans_rows(file_name))
 
-def read_html_file_as_roboforex(file_name: pathlib.Path) -> pd.DataFrame:
+def read_html_file_as_roboforex(file_name: pathlib.Path | io.BytesIO) -> pd.DataFrame:
     """
     Parses HTML of Roboforex default template. 
     Comments for trading trans [buy, sell] is created from scratch. This process is unified with Roboforex template.
     Adds 0 valued Taxes col, cuz it not exists in default Roboforex template.
 
     Args:
-        file_name (pathlib.Path): file name
+        file_name (pathlib.Path | io.BytesIO): file name or file object with statement content
 
     Returns:
         pd.DataFrame: Result DataFrame
     """        
-    df_list = pd.read_html(str(file_name))
-    df = df_list[0] # Only one table in default statement.htm template
-    
-    start_idx = df[df[0] == 'Ticket'][0].index[0]
-    finish_idx = df.iloc[start_idx + 1:][df[0].isna()][0].index[0]
-    df = df.iloc[start_idx:finish_idx] 
-    df.columns = list(df.iloc[0]) # Move 1st row to cols
-    
-    # Default Roboforex statement template doesn't contain col 'Taxes'.
-    # So why we make force add col 'Taxes'
+    df = pd.DataFrame(iter_statement_trans_rows(file_name))
     df['Taxes'] = 0
     
-    # Default MT4 and Roboforex statement template contains 2 cols with same name 'Price'
-    # So why we make force change name of last price to 'Close'
-    df.columns.values[9] = 'Close' 
-    
-    # Default MT4 and Roboforex statement template has joined <td> for 'Size' for all type='balance' trans.
-    # So why we copy comment from 'Size' to correct col
-    df['Comment'] = ''
-    df.loc[(df['Type'] == TYPE_FOR_BALANCE), 'Comment'] = df['Size']
-    
-    # Default MT4 and Roboforex statement template has joined <td> for all type='balance' trans.
-    # So why we clear str for all float cols of all type='balance' trans.
-    df.loc[(df['Type'] == TYPE_FOR_BALANCE), ZERO_COLUMNS_FOR_BALANCE_TRANS_OF_STATEMENT_TEMPLATE[HTMLStatementType.ROBOFOREX_WEB_STATEMENT]] = 0
-    
-    # Copy OPEN_DT tot CLOSE_DT for all type='balance' trans.
-    df.loc[(df['Type'] == TYPE_FOR_BALANCE), 'Close Time'] = df['Open Time']
-    
-    return df.iloc[1:]
+    return df
 
     
 def df_columns_cast(df: pd.DataFrame) -> pd.DataFrame:
@@ -204,6 +316,7 @@ def prepare_columns(df: pd.DataFrame, columns_mapping_dict: dict, **kwargs) -> p
     """    
     1. Renames columns using COLUMNS_MAPPING. 
     2. Add to DataFrame user meta columns from **kwargs
+    3. Casts ids and low-cardinality string cols by PREPARED_COLUMNS_SCHEMA
 
     Args:
         df (pd.DataFrame): Source DataFrame loaded from file
@@ -229,6 +342,8 @@ def prepare_columns(df: pd.DataFrame, columns_mapping_dict: dict, **kwargs) -> p
     for k, v in kwargs.items():
         df_res[k] = v
     
+    df_res = sc.apply_trans_schema(df_res, schema=PREPARED_COLUMNS_SCHEMA)
+    
     return df_res
 
 def create_comments_for_trading_trans(df: pd.DataFrame) -> pd.DataFrame:
@@ -239,6 +354,7 @@ def create_comments_for_trading_trans(df: pd.DataFrame) -> pd.DataFrame:
         - Start BUY
         - SELL 3
         - BUY 2
+    Orders of one side closed at the same CLOSE_DT are numbered in ORDER_ID order.
 
     Args:
         df (pd.DataFrame): Source DataFrame
@@ -249,31 +365,53 @@ def create_comments_for_trading_trans(df: pd.DataFrame) -> pd.DataFrame:
     df = df.copy()
     df = df.sort_values(by=['CLOSE_DT', 'SIDE', 'ORDER_ID'])
 
-    df_grouped_dt = df.groupby('CLOSE_DT').count()
-    for dt in df_grouped_dt.index:
-        for side in [TYPE_FOR_BUY, TYPE_FOR_SELL]:
-            group_orders_cnt = len(df[(df['CLOSE_DT'] == dt) & (df['SIDE'] == side)])
-            comments_list = [f'Start {side.upper()}'] + [f'{side.upper()} {num}' for num in range(2, group_orders_cnt + 1)]
-            df.loc[(df['CLOSE_DT'] == dt) & (df['SIDE'] == side), 'COMMENT'] = comments_list 
+    # Number of order inside its (CLOSE_DT, SIDE) group
+    is_trading = df['SIDE'].isin([TYPE_FOR_BUY, TYPE_FOR_SELL]) & df['CLOSE_DT'].notna()
+    df_trading = df.loc[is_trading, ['CLOSE_DT', 'SIDE']].astype({'SIDE': str})
+    order_num = df_trading.groupby(['CLOSE_DT', 'SIDE'], sort=False).cumcount() + 1
+    
+    side = df_trading['SIDE'].str.upper()
+    df['COMMENT'] = df['COMMENT'].astype(object)
+    df.loc[is_trading, 'COMMENT'] = np.where(order_num == 1, 'Start ' + side, side + ' ' + order_num.astype(str))
             
     return df  
 
-def save_df_to_db(df: pd.DataFrame, conn: sqlite3.Connection, table_name: str = ''):
-    """Saves DataFrame to DB in given table
+def create_trans_table(df: pd.DataFrame, conn: sqlite3.Connection, table_name: str = '') -> None:
+    """
+    Creates trans table with primary key TRANS_KEY_COLUMNS and cols of df, if table doesn't exist.
+    config.TRANS_TABLE_NAME is created by db_schema migrations and is shared with the bot, so it has partial unique key per writer.
+    Cols of df which existing table doesn't have are added. 
+    Tables created by DataFrame.to_sql before have no primary key, so they are deduplicated and get unique index on TRANS_KEY_COLUMNS.
+    See table_writer.prepare_table()
+    """    
+    table_name = config.TRANS_TABLE_NAME if table_name == '' else table_name
+    
+    if table_name == config.TRANS_TABLE_NAME and len(tw.get_table_columns(conn, table_name)) == 0:
+        ds.migrate(conn)
+    tw.prepare_table(df=df, conn=conn, table_name=table_name, key_columns=TRANS_KEY_COLUMNS)
+
+def save_df_to_db(df: pd.DataFrame, conn: sqlite3.Connection, table_name: str = '') -> int:
+    """Saves DataFrame to DB in given table by one bulk INSERT OR IGNORE, so trans already stored in table are skipped
 
     Args:
         df (pd.DataFrame): DataFrame to save
         conn (sqlite3.Connection): connection
         table_name (str, optional): Table name. Defaults to '' means config.TRANS_TABLE_NAME
+
+    Returns:
+        int: Count of inserted rows
     """    
     table_name = config.TRANS_TABLE_NAME if table_name == '' else table_name
-
-    df = df.set_index(['FTP_USER_ID', 'ORDER_ID'])
-    df.to_sql(name=table_name, con=conn, if_exists='append')
+    create_trans_table(df=df, conn=conn, table_name=table_name)
+    
+    with conn:
+        return tw.insert_df(df=df, conn=conn, table_name=table_name)
 
 def add_new_statement_data_to_db(df: pd.DataFrame, conn: sqlite3.Connection) -> tuple[int, int]:
     """
-    Determinants only new trans from df DataFrame, which haven't already stored in DB.
+    Saves to DB only new trans from df DataFrame, which haven't already stored in DB.
+    New trans, grid state and daily rollup updated by them are committed in one transaction, 
+    so derived state never lags behind Trans.
 
     Args:
         df (pd.DataFrame): DataFrame to save
@@ -284,22 +422,311 @@ def add_new_statement_data_to_db(df: pd.DataFrame, conn: sqlite3.Connection) ->
     """    
     ftp_user_id = df.iloc[0]['FTP_USER_ID']
     
-    main_table_name = config.TRANS_TABLE_NAME
-    temp_table_name = f'{config.TRANS_TABLE_NAME}_{uuid.uuid4().hex}'
-    save_df_to_db(df=df, conn=conn, table_name=temp_table_name)
+    df = df.drop_duplicates(subset=TRANS_KEY_COLUMNS)
+    
+    create_trans_table(df=df, conn=conn)
+    with conn:
+        # New rows get rowid after the max one
+        max_rowid = conn.execute(f'SELECT IFNULL(MAX(rowid), 0) FROM {config.TRANS_TABLE_NAME}').fetchone()[0]
+        inserted_cnt = tw.insert_df(df=df, conn=conn, table_name=config.TRANS_TABLE_NAME)
+        
+        new_order_ids = [r[0] for r in conn.execute(f'SELECT ORDER_ID FROM {config.TRANS_TABLE_NAME} WHERE rowid > ? AND FTP_USER_ID = ?', 
+                                                    (max_rowid, ftp_user_id))]
+        df = df[df['ORDER_ID'].astype(str).isin([str(order_id) for order_id in new_order_ids])]
+        statement_dispatcher_logger.debug(f'{inserted_cnt} new trans inserted for {ftp_user_id=}')
+        
+        if len(df) > 0:
+            df_grids = update_grid_state_in_db(df=df, conn=conn)
+            
+            # Days of new trans and open days of grids they continue are changed
+            from_date = min(pd.to_datetime(df['OPEN_DT']).min(), df_grids['OPEN_DT'].min()).date()
+            update_daily_rollup_in_db(ftp_user_id=ftp_user_id, from_date=from_date, conn=conn)
+    
+    return df.shape
+
+def create_grid_state_tables(conn: sqlite3.Connection) -> None:
+    conn.execute(f'''
+                 CREATE TABLE IF NOT EXISTS {config.GRID_STATE_TABLE_NAME} (
+                    FTP_USER_ID	TEXT PRIMARY KEY,
+                    LAST_ORDER_ID	INTEGER,
+                    BALANCE	REAL,
+                    GRID_ID_SELL	INTEGER,
+                    GRID_ID_BUY	INTEGER,
+                    UPDATED_DT	TIMESTAMP);
+                 ''')
+    conn.execute(f'''
+                 CREATE TABLE IF NOT EXISTS {config.GRIDS_TABLE_NAME} (
+                    FTP_USER_ID	TEXT,
+                    DK_GRID_ID	INTEGER,
+                    SIDE	TEXT,
+                    OPEN_DT	TIMESTAMP,
+                    CLOSE_DT	TIMESTAMP,
+                    LAST_OPEN_DT	TIMESTAMP,
+                    ORDER_ID	INTEGER,
+                    PROFIT	REAL,
+                    DK_GRID_OPEN_QTY	REAL,
+                    QTY	REAL,
+                    OPEN_PRICE	REAL,
+                    DK_GRID_LAST_PRICE	REAL,
+                    DK_OPEN_VALUE	REAL,
+                    DK_BALANCE_IN	REAL,
+                    PRIMARY KEY (FTP_USER_ID, DK_GRID_ID));
+                 ''')
+    # Grids of date range are read by reports and by update_daily_rollup_in_db()
+    conn.execute(f'CREATE INDEX IF NOT EXISTS ix_{config.GRIDS_TABLE_NAME}_open_dt ON {config.GRIDS_TABLE_NAME} (FTP_USER_ID, OPEN_DT)')
+
+def cast_grid_state_columns(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Casts trans loaded from DB by analizer.schema.TRANS_SCHEMA. 
+    Cols used by grid state have not numeric values replaced by 0.
+    """    
+    df = sc.apply_trans_schema(df)
+    df[GRID_STATE_NUMERIC_COLUMNS] = df[GRID_STATE_NUMERIC_COLUMNS].fillna(0)
+    
+    return df
+
+def load_grid_state_from_db(ftp_user_id: str, conn: sqlite3.Connection) -> tuple[dict, pd.DataFrame]:
+    """
+    Loads grid state of account and its open grids, i.e. last started grid of every side
+
+    Returns:
+        tuple[dict, pd.DataFrame]: Grid state and open grids. See analizer.grid_state.update_grid_state()
+    """    
+    create_grid_state_tables(conn)
+    
+    grid_state = gs.get_empty_grid_state()
+    res = conn.execute(f'SELECT LAST_ORDER_ID, BALANCE, GRID_ID_SELL, GRID_ID_BUY FROM {config.GRID_STATE_TABLE_NAME} WHERE FTP_USER_ID = ?', 
+                       (ftp_user_id,)).fetchone()
+    if res is not None:
+        grid_state.update(zip(['LAST_ORDER_ID', 'BALANCE', 'GRID_ID_SELL', 'GRID_ID_BUY'], res))
+    
+    df_open_grids = pd.read_sql(f'SELECT * FROM {config.GRIDS_TABLE_NAME} WHERE FTP_USER_ID = :ftp_user_id AND DK_GRID_ID IN (:grid_id_sell, :grid_id_buy)', 
+                                con=conn,
+                                params={'ftp_user_id': ftp_user_id, 'grid_id_sell': grid_state['GRID_ID_SELL'], 'grid_id_buy': grid_state['GRID_ID_BUY']},
+                                parse_dates=['OPEN_DT', 'CLOSE_DT', 'LAST_OPEN_DT'])
+    
+    return grid_state, df_open_grids.drop(columns='FTP_USER_ID')
+
+def load_grids_from_db(ftp_user_id: str, conn: sqlite3.Connection, from_date: datetime.date = None) -> pd.DataFrame:
+    """
+    Loads materialized grids of account in the same format as analizer.get_grids() returns.
+    If from_date is given only grids opened from that day are loaded.
+    """    
+    create_grid_state_tables(conn)
+    
+    df_grids = pd.read_sql(f'SELECT * FROM {config.GRIDS_TABLE_NAME} WHERE FTP_USER_ID = :ftp_user_id AND OPEN_DT >= :from_date', 
+                           con=conn,
+                           params={'ftp_user_id': ftp_user_id, 'from_date': str(from_date) if from_date else ''},
+                           parse_dates=['OPEN_DT', 'CLOSE_DT', 'LAST_OPEN_DT'])
+    
+    return gs.get_grids_from_state(df_grids.drop(columns='FTP_USER_ID'))
+
+def update_grid_state_in_db(df: pd.DataFrame, conn: sqlite3.Connection) -> pd.DataFrame:
+    """
+    Updates materialized grids of account by new trans have just been saved to DB. 
+    Only grids touched by new trans are rewritten. 
+    If new trans are older than already processed ones, grid state of account is rebuilt from all its trans in DB.
+
+    Args:
+        df (pd.DataFrame): New trans of one account
+        conn (sqlite3.Connection): Connection
+
+    Returns:
+        pd.DataFrame: Updated or created grids
+    """    
+    ftp_user_id = df.iloc[0]['FTP_USER_ID']
+    df = cast_grid_state_columns(df)
+    
+    grid_state, df_open_grids = load_grid_state_from_db(ftp_user_id=ftp_user_id, conn=conn)
+    if grid_state['LAST_ORDER_ID'] is not None and df['ORDER_ID'].min() <= grid_state['LAST_ORDER_ID']:
+        statement_dispatcher_logger.debug(f'New trans are older than grid state of {ftp_user_id=}. Grid state rebuilding')
+        conn.execute(f'DELETE FROM {config.GRIDS_TABLE_NAME} WHERE FTP_USER_ID = ?', (ftp_user_id,))
+        df = pd.read_sql(f'SELECT * FROM {config.TRANS_TABLE_NAME} WHERE FTP_USER_ID = :ftp_user_id', con=conn, 
+                         params={'ftp_user_id': ftp_user_id})
+        df = cast_grid_state_columns(df)
+        grid_state, df_open_grids = gs.get_empty_grid_state(), df_open_grids.iloc[0:0]
+    
+    grid_state, df_grids = gs.update_grid_state(df_new=df, grid_state=grid_state, df_open_grids=df_open_grids)
+    
+    conn.executemany(f'DELETE FROM {config.GRIDS_TABLE_NAME} WHERE FTP_USER_ID = ? AND DK_GRID_ID = ?', 
+                     [(ftp_user_id, int(grid_id)) for grid_id in df_grids['DK_GRID_ID']])
+    df_grids['FTP_USER_ID'] = ftp_user_id
+    tw.insert_df(df=df_grids, conn=conn, table_name=config.GRIDS_TABLE_NAME, or_ignore=False)
+    
+    conn.execute(f'INSERT OR REPLACE INTO {config.GRID_STATE_TABLE_NAME} VALUES (?, ?, ?, ?, ?, ?)', 
+                 (ftp_user_id, 
+                  int(grid_state['LAST_ORDER_ID']), 
+                  float(grid_state['BALANCE']), 
+                  None if grid_state['GRID_ID_SELL'] is None else int(grid_state['GRID_ID_SELL']),
+                  None if grid_state['GRID_ID_BUY'] is None else int(grid_state['GRID_ID_BUY']),
+                  datetime.datetime.now().isoformat(sep=' ')))
+    
+    return df_grids
+
+def create_daily_rollup_table(conn: sqlite3.Connection) -> None:
+    conn.execute(f'''
+                 CREATE TABLE IF NOT EXISTS {config.DAILY_ROLLUP_TABLE_NAME} (
+                    DAY	TEXT,
+                    ORDER_ID	INTEGER,
+                    DK_DEPOSIT	REAL,
+                    DK_TRANSFER	REAL,
+                    DK_WITHDRAWAL	REAL,
+                    DK_MISC_TRANS	REAL,
+                    PROFIT	REAL,
+                    HAS_ORDER_PROFIT	INTEGER,
+                    MAX_ORDER_PROFIT	REAL,
+                    MAX_ORDER_LOSS	REAL,
+                    DK_BALANCE_IN	REAL,
+                    BALANCE	REAL,
+                    DK_BALANCE_OUT	REAL,
+                    ORDERS_BALANCE_IN	REAL,
+                    GRID_CNT	INTEGER,
+                    GRID_ORDER_CNT	INTEGER,
+                    MAX_GRID_ORDER_CNT	INTEGER,
+                    GRID_DURATION_SEC	REAL,
+                    MIN_GRID_DURATION_SEC	REAL,
+                    MAX_GRID_DURATION_SEC	REAL,
+                    GRID_PROFIT	REAL,
+                    MAX_GRID_PROFIT	REAL,
+                    GRID_DRAWDOWN	REAL,
+                    MAX_GRID_DRAWDOWN	REAL,
+                    GRID_DRAWDOWN_RATIO	REAL,
+                    MAX_GRID_DRAWDOWN_RATIO	REAL,
+                    LOT_1000	REAL,
+                    MIN_LOT_1000	REAL,
+                    MAX_LOT_1000	REAL,
+                    LAST_LOT_1000	REAL,
+                    FTP_USER_ID	TEXT,
+                    PRIMARY KEY (FTP_USER_ID, DAY));
+                 ''')
+
+def load_daily_rollup_from_db(ftp_user_id: str, conn: sqlite3.Connection, 
+                              start_date: datetime.date = None, finish_date: datetime.date = None) -> pd.DataFrame:
+    """
+    Loads daily rollup of account in the same format as analizer.calc_daily_rollup() returns.
+    If start_date or finish_date is given only days of that range are loaded.
+    Use analizer.get_summary_by_days() to get summary of any date range from it.
+    """    
+    create_daily_rollup_table(conn)
+    
+    df_daily = pd.read_sql(f'''SELECT * FROM {config.DAILY_ROLLUP_TABLE_NAME} 
+                               WHERE FTP_USER_ID = :ftp_user_id AND DAY >= :start_date AND DAY <= :finish_date ORDER BY DAY''', 
+                           con=conn,
+                           params={'ftp_user_id': ftp_user_id, 
+                                   'start_date': str(start_date) if start_date else '', 
+                                   'finish_date': str(finish_date) if finish_date else '9999-12-31'})
+    df_daily['DAY'] = pd.to_datetime(df_daily['DAY']).dt.date
+    
+    return df_daily.drop(columns='FTP_USER_ID')
+
+def update_daily_rollup_in_db(ftp_user_id: str, from_date: datetime.date, conn: sqlite3.Connection) -> None:
+    """
+    Recalculates daily rollup of account for days from from_date. 
+    Balance is cumsum of trans ordered by ORDER_ID, like analizer.calc_balance() does for all trans, 
+    so trans from the first ORDER_ID of these days are loaded, even older ones. Balance before them is taken from grid state.
+    Only grids of these days are loaded.
 
+    Args:
+        ftp_user_id (str): FTP user
+        from_date (datetime.date): First changed day
+        conn (sqlite3.Connection): Connection
+    """    
+    df = pd.read_sql(f'''SELECT * FROM {config.TRANS_TABLE_NAME} 
+                          WHERE FTP_USER_ID = :ftp_user_id 
+                                AND ORDER_ID >= (SELECT MIN(ORDER_ID) FROM {config.TRANS_TABLE_NAME} 
+                                                 WHERE FTP_USER_ID = :ftp_user_id AND OPEN_DT >= :from_date)''', 
+                     con=conn,
+                     params={'ftp_user_id': ftp_user_id, 'from_date': str(from_date)})
+    df = cast_grid_state_columns(df)
+    
+    df_full = an.calc_balance(df)
+    grid_state, _ = load_grid_state_from_db(ftp_user_id=ftp_user_id, conn=conn)
+    balance_before = grid_state['BALANCE'] - df_full['DK_TRANS'].sum()
+    df_full['DK_BALANCE_IN'] = df_full['DK_BALANCE_IN'] + balance_before
+    df_full['DK_BALANCE_OUT'] = df_full['DK_BALANCE_OUT'] + balance_before
+    df_full = df_full[df_full['OPEN_DT'] >= pd.Timestamp(from_date)]
+    
+    df_orders = df_full[df_full['SIDE'].isin([TYPE_FOR_BUY, TYPE_FOR_SELL])]
+    df_grids = load_grids_from_db(ftp_user_id=ftp_user_id, conn=conn, from_date=from_date)
+    df_daily = an.calc_daily_rollup(df_full=df_full, df_orders=df_orders, df_grids=df_grids)
+    
+    create_daily_rollup_table(conn)
+    conn.execute(f'DELETE FROM {config.DAILY_ROLLUP_TABLE_NAME} WHERE FTP_USER_ID = ? AND DAY >= ?', (ftp_user_id, str(from_date)))
+    
+    df_daily['DAY'] = df_daily['DAY'].astype(str)
+    df_daily['FTP_USER_ID'] = ftp_user_id
+    tw.insert_df(df=df_daily, conn=conn, table_name=config.DAILY_ROLLUP_TABLE_NAME, or_ignore=False)
+
+
+def check_account_is_assigned_to_user(ftp_user_id: str, account: str, conn: sqlite3.Connection) -> None:
     try:
-        query = f'SELECT * FROM {temp_table_name} WHERE ORDER_ID NOT IN (SELECT ORDER_ID FROM {main_table_name} WHERE FTP_USER_ID=:ftp_user_id)'
-        df = pd.read_sql(query, con=conn, 
-                            params={'ftp_user_id': ftp_user_id})
+        cur = conn.cursor()
+        res = cur.execute("SELECT ACCOUNT_NUMBER FROM ACCOUNTS WHERE (FTP_USER_ID = ?) AND (ACCOUNT_NUMBER = ?)", (ftp_user_id, account))
+        if res.fetchone()[0] != account:
+            raise StatementProcessingFileAccountIsNotAssignedToUserError(f"File account {account} is not assigned to user {ftp_user_id=}")
     except:
-        pass
-    
-    save_df_to_db(df=df, conn=conn)
+            raise StatementProcessingFileAccountIsNotAssignedToUserError(f"File account {account} is not assigned to user {ftp_user_id=}")
+
+def parse_statement_content(
+        content: bytes, 
+        ftp_user_id: str, 
+        file_name: pathlib.Path, 
+        trans_prefix_size: int = 0, 
+        file_details: dict = None) -> tuple[dict, pd.DataFrame, int]:
+    """
+    Parses statement content to trans DataFrame ready to save to DB. Doesn't use DB, so can be run in another process.
+        1. Get template type and details, if they aren't given
+        2. Parse template by a function designed for template type. 
+           If trans_prefix_size is given, only trans after it are parsed.
+        3. Rename and add new meta cols to standardized DataFrame.
+        4. Create comments for only trading trans.
 
-    conn.execute(f'DROP TABLE {temp_table_name};')        
-    return df.shape
+    Args:
+        content (bytes): Content of statement file
+        ftp_user_id (str): FTP user
+        file_name (pathlib.Path): Name of file to store in FILE_NAME col
+        trans_prefix_size (int, optional): Size of already processed part of trans table. Defaults to 0 means all trans are parsed
+        file_details (dict, optional): Details of content by get_file_details(). Defaults to None means they are got from content
 
+    Returns:
+        tuple[dict, pd.DataFrame, int]: File details, trans DataFrame and size of content up to the end of its trans rows
+    """
+    if file_details is None:
+        file_details = get_file_details(file_name, content=content)
+    statement_dispatcher_logger.debug(f'File type is {file_details["type"]}. Account {file_details["account"]} data in file {str(file_name.name)}')
+    
+    # If file is processed one with new trans rows appended, only these rows are parsed after the header of trans table
+    header_end = find_trans_header_end(content)
+    parse_content = content if trans_prefix_size == 0 else content[:header_end] + content[trans_prefix_size:]
+    statement_dispatcher_logger.debug(f'Trans rows are parsed from {max(trans_prefix_size, header_end)} byte of {str(file_name.name)}')
+    
+    df_file = PARSE_FUNCTION_FOR_STATEMENT_TEMPLATE[file_details['type']](io.BytesIO(parse_content))
+    statement_dispatcher_logger.debug(f'File successfully parsed to DataFrame {df_file.shape} {str(file_name.name)}')
+    
+    trans_prefix_size = find_trans_rows_end(content, start=max(trans_prefix_size, header_end), row_cnt=len(df_file))
+    if len(df_file) == 0:
+        return file_details, df_file, trans_prefix_size
+        
+    bytes_per_row = sc.get_bytes_per_row(df_file)
+    df_file = prepare_columns(df=df_file, 
+                              columns_mapping_dict=COLUMNS_MAPPING_STATEMENT_TEMPLATE[file_details['type']],
+                              **{'FTP_USER_ID': ftp_user_id,
+                               'FILE_NAME': str(file_name.name),
+                               'CREATED_DT': datetime.datetime.now()})
+    statement_dispatcher_logger.debug(f'Statement DataFrame successfully prepared {df_file.shape}. '
+                                      f'Bytes per row {bytes_per_row:.0f} -> {sc.get_bytes_per_row(df_file):.0f}')
+    
+    # Comments recovery
+    df_file = create_comments_for_trading_trans(df_file) 
+    statement_dispatcher_logger.debug(f'Comments generated successfully {df_file.shape}')
+    
+    return file_details, df_file, trans_prefix_size
+
+def get_dst_file_name(dst_processing_dir: str, ftp_user_id: str, src_file_name: pathlib.Path) -> pathlib.Path:
+    """Returns unique file name of statement in processing dir of FTP user, i.e. FILE_NAME of its trans"""
+    time_stamp = datetime.datetime.now().strftime('%Y%m%dT%H%M%S')
+    uuid_file = uuid.uuid4().hex
+    return pathlib.Path(f'{dst_processing_dir}/{ftp_user_id}').joinpath(f'{time_stamp}_{uuid_file}_{pathlib.Path(src_file_name).name}')
 
 def _process_statement_file(
         telegram_user_id: str, 
@@ -309,12 +736,13 @@ def _process_statement_file(
         conn: sqlite3.Connection) -> None:
     """
     Process workflow to save to DB of trans from given statement file:
-        1. Copy src file to processing dir
-        2. Get template type and details
-        3. Parse template by a function designed for template type
-        4. Rename and add new meta cols to standardized DataFrame.
-        5. Create comments for only trading trans.
-        6. Save new trans from DataFrame to DB. 
+        1. Read src file once and archive its content to processing dir as dst file name. See statement_archive. 
+           Next steps use the same content. Already processed file of account is skipped.
+        2. Parse content by parse_statement_content(). 
+           If file is already processed one with appended trans, only appended trans are parsed.
+        3. Save new trans from DataFrame to DB. 
+        4. Register processed file by its content hash.
+    Statement parsed in full is saved to parsed statements cache next to its archive manifest in processing dir. See parsed_cache.
 
     Args:
         telegram_user_id (str): _description_
@@ -327,44 +755,44 @@ def _process_statement_file(
         _type_: _description_
     """
     src_file_name = pathlib.Path(src_file_name)
-
-    dst_path = pathlib.Path(f'{dst_processing_dir}/{ftp_user_id}')
-    time_stamp = datetime.datetime.now().strftime('%Y%m%dT%H%M%S')
-    uuid_file = uuid.uuid4().hex
-    dst_file_name = dst_path.joinpath(f'{time_stamp}_{uuid_file}_{src_file_name.name}')
-
-    copy_file_from_ftp_to_processing_dir(src=src_file_name, dst=dst_file_name) 
-    statement_dispatcher_logger.debug(f'File successfully copied from {str(src_file_name)} to {str(dst_file_name)}')
+    dst_file_name = get_dst_file_name(dst_processing_dir=dst_processing_dir, ftp_user_id=ftp_user_id, src_file_name=src_file_name)
+    dst_path = dst_file_name.parent
+
+    content = read_statement_file(src_file_name)
+    content_hash = get_content_hash(content)
+    if is_file_processed(ftp_user_id=ftp_user_id, content_hash=content_hash, conn=conn):
+        statement_dispatcher_logger.debug(f'Skipping already processed file {str(src_file_name)} {content_hash}')
+        return pd.DataFrame()
     
-    file_details = get_file_details(dst_file_name)
-    statement_dispatcher_logger.debug(f'File type is {file_details["type"]}. Account {file_details["account"]} data in file {str(dst_file_name.name)}')
+    object_path = sa.archive_statement(content=content, content_hash=content_hash, dst_file_name=dst_file_name)
+    statement_dispatcher_logger.debug(f'File successfully archived from {str(src_file_name)} as {str(dst_file_name)} to {str(object_path)}')
     
     # Check that file Account belongs to current user
-    try:
-        cur = conn.cursor()
-        res = cur.execute("SELECT ACCOUNT_NUMBER FROM ACCOUNTS WHERE (FTP_USER_ID = ?) AND (ACCOUNT_NUMBER = ?)", (ftp_user_id, file_details['account']))
-        if res.fetchone()[0] != file_details['account']:
-            raise StatementProcessingFileAccountIsNotAssignedToUserError(f"File account {file_details['account']} is not assigned to user {ftp_user_id=}")
-    except:
-            raise StatementProcessingFileAccountIsNotAssignedToUserError(f"File account {file_details['account']} is not assigned to user {ftp_user_id=}")
-        
+    file_details = get_file_details(dst_file_name, content=content)
+    check_account_is_assigned_to_user(ftp_user_id=ftp_user_id, account=file_details['account'], conn=conn)
     
-    df_file = PARSE_FUNCTION_FOR_STATEMENT_TEMPLATE[file_details['type']](dst_file_name)
-    statement_dispatcher_logger.debug(f'File successfully parsed to DataFrame {df_file.shape} {str(dst_file_name.name)}')
-        
-    df_file = prepare_columns(df=df_file, 
-                              columns_mapping_dict=COLUMNS_MAPPING_STATEMENT_TEMPLATE[file_details['type']],
-                              **{'FTP_USER_ID': ftp_user_id,
-                               'FILE_NAME': str(dst_file_name.name),
-                               'CREATED_DT': datetime.datetime.now()})
-    statement_dispatcher_logger.debug(f'Statement DataFrame successfully prepared {df_file.shape}')
+    processed_trans_prefix_size = get_processed_trans_prefix_size(ftp_user_id=ftp_user_id, content=content, conn=conn)
+    _, df_file, trans_prefix_size = parse_statement_content(content=content, 
+                                                            ftp_user_id=ftp_user_id, 
+                                                            file_name=dst_file_name, 
+                                                            trans_prefix_size=processed_trans_prefix_size,
+                                                            file_details=file_details)
     
-    # Comments recovery
-    df_file = create_comments_for_trading_trans(df_file) 
-    statement_dispatcher_logger.debug(f'Comments generated successfully {df_file.shape}')
+    # Only statement parsed in full is cached
+    if processed_trans_prefix_size == 0 and len(df_file) > 0:
+        pc.save_parsed_statement(df=df_file, cache_dir=dst_path, content_hash=content_hash)
+    
+    if len(df_file) > 0:
+        save_df_shape = add_new_statement_data_to_db(df=df_file, conn=conn)
+        statement_dispatcher_logger.debug(f'New data from statement DataFrame successfully saved to DB {save_df_shape}')
     
-    save_df_shape = add_new_statement_data_to_db(df=df_file, conn=conn)
-    statement_dispatcher_logger.debug(f'New data from statement DataFrame successfully saved to DB {save_df_shape}')
+    trans_prefix_size, trans_prefix_hash = get_trans_prefix_key(content, trans_rows_end=trans_prefix_size)
+    register_processed_file(ftp_user_id=ftp_user_id, 
+                            content_hash=content_hash, 
+                            trans_prefix_size=trans_prefix_size, 
+                            trans_prefix_hash=trans_prefix_hash,
+                            file_name=str(dst_file_name.name), 
+                            conn=conn)
     
     # save_df_to_db()
     # update_dt()
@@ -390,6 +818,22 @@ def process_statement_file(
     except Exception as e:
         raise StatementProcessingError(e)
         
+def process_account_statement_file(ftp_user_id: str, src_file_name: str) -> pd.DataFrame:
+    """
+    Processing job for changed statement file of FTP user. 
+    Opens its own connection to DB, so can be run by queue worker.
+    """    
+    conn = ds.connect(config.DATABASE_CONNECTION_STRING)
+    try:
+        res = conn.execute("SELECT TELEGRAM_USER_ID FROM ACCOUNTS WHERE FTP_USER_ID = ?", (ftp_user_id,)).fetchone()
+        return process_statement_file(telegram_user_id=res[0] if res else None,
+                                      ftp_user_id=ftp_user_id,
+                                      src_file_name=str(src_file_name),
+                                      dst_processing_dir=config.PROCESSING_DIR,
+                                      conn=conn)
+    finally:
+        conn.close()
+
 
 PARSE_FUNCTION_FOR_STATEMENT_TEMPLATE = {
     HTMLStatementType.MT4_STATEMENT: read_html_file_as_mt4,
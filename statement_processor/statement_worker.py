@@ -0,0 +1,75 @@
+import sys
+import time
+import pathlib
+import argparse
+import importlib
+import subprocess
+
+sys.path.append("..")
+import config
+from config import statement_dispatcher_logger as statement_dispatcher_logger
+
+
+# Parsing stack of statement processing jobs. Charts are not drawn by jobs, so matplotlib is not here
+PRELOAD_MODULES = ['numpy', 'pandas', 'lxml.etree', 'bs4', 'analizer', 'analizer.grid_state', 'analizer.schema', 'statement_processor.statement_processor']
+
+# Import statements of cold start before and after lazy import of matplotlib by analizer
+IMPORT_BENCHMARK_STATEMENTS = {
+    'BEFORE': 'import matplotlib.pyplot, statement_processor.statement_processor',
+    'AFTER': 'import statement_processor.statement_processor',
+}
+
+
+def preload_modules(modules: list[str] = PRELOAD_MODULES) -> float:
+    """Imports modules in current process, so forked work horses get them warm. Returns import seconds"""
+    start_time = time.perf_counter()
+    for module in modules:
+        importlib.import_module(module)
+    return time.perf_counter() - start_time
+
+
+def measure_import_time(statement: str, repeat: int = 3) -> float:
+    """
+    Measures cold import time of statement in new interpreter started in repo root.
+
+    Returns:
+        float: Min seconds of repeats
+    """
+    code = f'import time; t = time.perf_counter(); {statement}; print(time.perf_counter() - t)'
+    cwd = pathlib.Path(__file__).parent.parent
+    return min(float(subprocess.run([sys.executable, '-c', code], cwd=cwd, capture_output=True, text=True, check=True).stdout)
+               for _ in range(repeat))
+
+
+def run_worker(queue_names: list[str], burst: bool = False, fork: bool = True) -> None:
+    """
+    Runs RQ worker with preloaded parsing stack.
+        - fork=True: rq.Worker forks work horse per job from this warm process, so a job doesn't import anything
+        - fork=False: rq.SimpleWorker runs jobs in this long-lived process
+    Queues are listened in the given order, so the first is the priority one.
+    """
+    from redis import Redis
+    from rq import Worker, SimpleWorker
+
+    statement_dispatcher_logger.info(f'Parsing stack preloaded in {preload_modules():.2f}s')
+
+    worker_class = Worker if fork else SimpleWorker
+    worker = worker_class(queue_names, connection=Redis())
+    worker.work(burst=burst)
+
+
+if __name__ == '__main__':
+    # python -m statement_processor.statement_worker [--simple] [--burst]
+    # python -m statement_processor.statement_worker --benchmark
+    parser = argparse.ArgumentParser(description='Statement processing worker with preloaded parsing stack')
+    parser.add_argument('--simple', action='store_true', help='Run jobs in this long-lived process instead of forking per job')
+    parser.add_argument('--burst', action='store_true', help='Quit when queues are empty')
+    parser.add_argument('--benchmark', action='store_true', help='Print cold import time before and after lazy imports and exit')
+    args = parser.parse_args()
+
+    if args.benchmark:
+        for name, statement in IMPORT_BENCHMARK_STATEMENTS.items():
+            print(f'{name}: {measure_import_time(statement):.3f}s {statement}')
+    else:
+        run_worker([config.STATEMENT_INTERACTIVE_PROCESSING_QUEUE_NAME, config.STATEMENT_PROCESSING_QUEUE_NAME],
+                   burst=args.burst, fork=not args.simple)
@@ -0,0 +1,105 @@
+import logging
+import sqlite3
+import pandas as pd
+
+
+# Doesn't import config, so the bot with its own config shares it with statement processor
+logger = logging.getLogger(__name__)
+
+
+def get_table_columns(conn: sqlite3.Connection, table_name: str) -> list[str]:
+    return [r[1] for r in conn.execute(f'PRAGMA table_info("{table_name}")')]
+
+
+def get_table_primary_key(conn: sqlite3.Connection, table_name: str) -> list[str]:
+    return [r[1] for r in sorted((r for r in conn.execute(f'PRAGMA table_info("{table_name}")') if r[5] > 0), key=lambda r: r[5])]
+
+
+def get_table_unique_keys(conn: sqlite3.Connection, table_name: str) -> list[list[str]]:
+    """Returns cols of primary key and of every unique index of table, partial ones included"""
+    res = [get_table_primary_key(conn, table_name)]
+    for _, index_name, is_unique, *_ in conn.execute(f'PRAGMA index_list("{table_name}")'):
+        if is_unique:
+            res.append([r[2] for r in conn.execute(f'PRAGMA index_info("{index_name}")')])
+    return [key_columns for key_columns in res if len(key_columns) > 0]
+
+
+def create_unique_key(conn: sqlite3.Connection, table_name: str, key_columns: list[str]) -> int:
+    """
+    Creates unique index ix_<table>_<key cols> on key_columns, if table doesn't have primary key or unique index on them yet.
+    Index is partial on rows with all key cols set, so writers with different keys share table, each row is keyed by its writer only.
+    Table filled before without key may have duplicates, so they are deleted first: the first stored row of every key is kept.
+
+    Returns:
+        int: Count of deleted duplicates
+    """
+    if key_columns in get_table_unique_keys(conn, table_name):
+        return 0
+
+    key_sql = ', '.join(key_columns)
+    not_null_sql = ' AND '.join(f'{col} IS NOT NULL' for col in key_columns)
+    with conn:
+        removed_cnt = conn.execute(f'''DELETE FROM "{table_name}"
+                                       WHERE {not_null_sql} AND rowid NOT IN (SELECT MIN(rowid) FROM "{table_name}" GROUP BY {key_sql})''').rowcount
+        conn.execute(f'CREATE UNIQUE INDEX "ix_{table_name}_{"_".join(key_columns)}" ON "{table_name}" ({key_sql}) WHERE {not_null_sql}')
+
+    if removed_cnt > 0:
+        logger.warning(f'{removed_cnt} duplicates of ({key_sql}) deleted from {table_name} to create its unique key')
+    return removed_cnt
+
+
+def prepare_table(df: pd.DataFrame, conn: sqlite3.Connection, table_name: str, key_columns: list[str]) -> None:
+    """
+    Makes table ready to store df rows by INSERT OR IGNORE:
+        - table doesn't exist: it's created with cols of df and primary key key_columns
+        - cols of df which table doesn't have are added
+        - table without primary key or unique index on key_columns, e.g. created by DataFrame.to_sql, gets unique index on them.
+          See create_unique_key()
+    """
+    table_columns = [col.upper() for col in get_table_columns(conn, table_name)]
+    if len(table_columns) == 0:
+        conn.execute(pd.io.sql.get_schema(df, table_name, keys=key_columns, con=conn))
+        return
+
+    for col in df.columns:
+        if col.upper() not in table_columns:
+            conn.execute(f'ALTER TABLE "{table_name}" ADD COLUMN "{col}"')
+    create_unique_key(conn, table_name, key_columns)
+
+
+def insert_df(df: pd.DataFrame, conn: sqlite3.Connection, table_name: str, or_ignore: bool = True) -> int:
+    """Inserts DataFrame rows to existing table by one executemany. Transaction is left to the caller
+
+    Args:
+        df (pd.DataFrame): DataFrame to insert
+        conn (sqlite3.Connection): connection
+        table_name (str): Table name
+        or_ignore (bool, optional): Skip rows already stored for key of table. Defaults to True
+
+    Returns:
+        int: Count of inserted rows
+    """
+    # sqlite3 binds only Python types. Datetimes are stored as text in the same format as DataFrame.to_sql does
+    values = []
+    for col in df.columns:
+        if pd.api.types.is_datetime64_any_dtype(df[col]):
+            values.append([None if pd.isna(v) else v.isoformat(sep=' ') for v in df[col]])
+        else:
+            values.append(df[col].astype(object).where(df[col].notna(), None).tolist())
+
+    columns = ', '.join(f'"{col}"' for col in df.columns)
+    params = ', '.join('?' * len(df.columns))
+    cur = conn.executemany(f'INSERT {"OR IGNORE " if or_ignore else ""}INTO "{table_name}" ({columns}) VALUES ({params})', zip(*values))
+
+    return cur.rowcount
+
+
+def save_df(df: pd.DataFrame, conn: sqlite3.Connection, table_name: str, key_columns: list[str]) -> int:
+    """Saves DataFrame to table by one bulk INSERT OR IGNORE in one transaction, rows already stored for key_columns are skipped
+
+    Returns:
+        int: Count of inserted rows
+    """
+    prepare_table(df=df, conn=conn, table_name=table_name, key_columns=key_columns)
+    with conn:
+        return insert_df(df=df, conn=conn, table_name=table_name)
@@ -0,0 +1,355 @@
+import sys
+import subprocess
+import datetime
+import pathlib
+import unittest
+
+import numpy as np
+import pandas as pd
+
+import analizer as an
+from analizer.pipeline import AnalysisPipeline
+import analizer.grid_state as gs
+import analizer.schema as sc
+import statement_processor.statement_processor as sp
+
+
+FIXTURES_DIR = pathlib.Path('tests/statement_processor_test')
+NUMERIC_COLUMNS = ['ORDER_ID', 'QTY', 'OPEN_PRICE', 'STOP_LOSS', 'TAKE_PROFIT', 'CLOSE_PRICE', 'FEE', 'SWAP', 'PROFIT']
+
+
+def load_statement(file_name: str) -> pd.DataFrame:
+    """Loads statement fixture the same way as statement processor does with numeric cols casted"""
+    file_name = FIXTURES_DIR.joinpath(file_name)
+    file_details = sp.get_file_details(file_name)
+
+    df = sp.PARSE_FUNCTION_FOR_STATEMENT_TEMPLATE[file_details['type']](file_name)
+    df = sp.prepare_columns(df=df,
+                            columns_mapping_dict=sp.COLUMNS_MAPPING_STATEMENT_TEMPLATE[file_details['type']],
+                            **{'FTP_USER_ID': 'test_ftp_user_id',
+                               'FILE_NAME': file_name.name,
+                               'CREATED_DT': datetime.datetime.now()})
+    df = sp.create_comments_for_trading_trans(df)
+
+    df[NUMERIC_COLUMNS] = df[NUMERIC_COLUMNS].apply(pd.to_numeric)
+    return df
+
+
+def load_statement_as_orders(file_name: str) -> pd.DataFrame:
+    """Loads statement fixture and keeps only trading trans"""
+    df = load_statement(file_name)
+    df = df[df['SIDE'].isin([sp.TYPE_FOR_BUY, sp.TYPE_FOR_SELL])]
+    return df.sort_values(by=['OPEN_DT', 'ORDER_ID'])
+
+
+def load_statement_as_trans(file_name: str) -> pd.DataFrame:
+    """Loads statement fixture with trading trans marked by an.COMMENT_PATTERN_FOR_ORDERS_ONLY as in xls export"""
+    df = load_statement(file_name)
+    is_order = df['SIDE'].isin([sp.TYPE_FOR_BUY, sp.TYPE_FOR_SELL])
+    df.loc[is_order, 'COMMENT'] = df.loc[is_order, 'COMMENT'] + ' ' + an.COMMENT_PATTERN_FOR_ORDERS_ONLY
+    return df
+
+
+def set_grid_id_by_one_side_start_iterrows(df: pd.DataFrame, grid_id_col_name: str) -> pd.DataFrame:
+    """Reference row-by-row implementation of an.set_grid_id_by_one_side_start"""
+    df_res = df.copy()
+
+    net_id_sell, net_id_buy = None, None
+    net_id_list = []
+    for i, row in df_res.iterrows():
+        if an.COMMENT_PATTERN_FOR_START_ORDERS in row['COMMENT']:
+            if an.COMMENT_PATTERN_FOR_SELL_ORDERS in row['COMMENT']:
+                net_id_sell = row['ORDER_ID']
+            if an.COMMENT_PATTERN_FOR_BUY_ORDERS in row['COMMENT']:
+                net_id_buy = row['ORDER_ID']
+
+        if an.COMMENT_PATTERN_FOR_SELL_ORDERS in row['COMMENT']:
+            net_id_list.append(net_id_sell if net_id_sell is not None else row['ORDER_ID'])
+        if an.COMMENT_PATTERN_FOR_BUY_ORDERS in row['COMMENT']:
+            net_id_list.append(net_id_buy if net_id_buy is not None else row['ORDER_ID'])
+
+    df_res[grid_id_col_name] = net_id_list
+
+    return df_res
+
+
+def calc_drawdown_for_max_grid_order_loop(r) -> float:
+    """Reference step-by-step implementation of an.calc_drawdown_for_max_grid_order"""
+    kp = (an.OPEN_NEW_ORDER_PRICE_DELTA_PIPS - 1) * an.XAU_PIP_USD
+
+    curr_price = r['DK_GRID_LAST_PRICE']
+    curr_value = r['DK_OPEN_VALUE']
+    curr_qty = r['QTY']
+    for i in range(int(r['ORDER_ID']) + 1, an.EVE_MAX_ORDER_COUNT + 1):
+        kq = an.QTY_INCREASE_FACTORS[i - 1]
+
+        curr_price = curr_price + kp
+        curr_value = curr_value + (curr_price) * (curr_qty * kq - curr_qty)
+        curr_qty = curr_qty * kq
+
+    return abs(curr_value - curr_qty * (curr_price + kp))
+
+
+def set_worst_grid_price_loop(df: pd.DataFrame, new_col_name: str) -> pd.DataFrame:
+    """Reference row-by-row implementation of an.set_worst_grid_price"""
+    df_res = df.copy()
+
+    df_res = df_res.sort_values(by=['DK_GRID_ID', 'ORDER_ID'], ascending=False)
+    worst_price_list = []
+    net_id_prev = None
+    open_price_prev = None
+    for (net_id, open_price, side) in zip(df_res['DK_GRID_ID'], df_res['OPEN_PRICE'], df_res['SIDE']):
+        if net_id == net_id_prev:
+            worst_price_list.append(open_price_prev)
+        else:
+            max_price_delta = (an.OPEN_NEW_ORDER_PRICE_DELTA_PIPS - 1) * an.XAU_PIP_USD
+            if side == 'buy':
+                max_price_delta = -1 * max_price_delta
+            worst_price_list.append(open_price + max_price_delta)
+
+        open_price_prev = open_price
+        net_id_prev = net_id
+
+    df_res[new_col_name] = worst_price_list
+    return df_res
+
+
+def get_summary_groupby(df_full: pd.DataFrame, df_orders: pd.DataFrame, df_grids: pd.DataFrame) -> pd.DataFrame:
+    """Reference groupby implementation of an.get_summary as it was before the single-pass summary kernel"""
+    df_sum = df_full.copy()
+
+    df_sum['DAYS'] = df_sum['OPEN_DT'].dt.date
+    df_sum['BALANCE'] = df_sum['DK_BALANCE_IN']
+    df_sum['HAS_ORDER_PROFIT'] = 0
+
+    df_sum.loc[df_sum['PROFIT'] >= 0, ['HAS_ORDER_PROFIT']] = 1
+    df_sum['AVG_ORDER_PROFIT'] = df_sum['PROFIT']
+    df_sum.loc[df_sum['PROFIT'] >= 0, ['MAX_ORDER_PROFIT']] = df_sum['PROFIT']
+    df_sum.loc[(df_sum['PROFIT'] < 0), ['MAX_ORDER_LOSS']] = df_sum['PROFIT']
+
+    df_sum = df_sum.groupby(lambda x: True).agg({
+        'DAYS': pd.Series.nunique,
+        'BALANCE': 'last',
+        'DK_DEPOSIT': 'sum',
+        'DK_TRANSFER': 'sum',
+        'DK_WITHDRAWAL': 'sum',
+        'DK_MISC_TRANS': 'sum',
+        'PROFIT': 'sum',
+        'ORDER_ID': 'count',
+        'HAS_ORDER_PROFIT': 'sum',
+        'AVG_ORDER_PROFIT': 'mean',
+        'MAX_ORDER_PROFIT': 'max',
+        'MAX_ORDER_LOSS': 'min',
+    })
+
+    df_balance_avg = df_orders.sort_values('OPEN_DT')
+    df_balance_avg['DK_DAY'] = df_balance_avg['OPEN_DT'].dt.date
+    balance_in_day_avg = df_balance_avg.groupby('DK_DAY').agg({'DK_BALANCE_IN': 'first'})['DK_BALANCE_IN'].mean()
+
+    df_grids = df_grids.sort_values(by=['OPEN_DT'])
+
+    df_sum['START_DATE'] = df_full['OPEN_DT'].min().date()
+    df_sum['FINISH_DATE'] = df_full['OPEN_DT'].max().date()
+    df_sum['CAL_DAYS'] = (df_full['OPEN_DT'].max().date() - df_full['OPEN_DT'].min().date()).days + 1
+    df_sum['BALANCE_IN_DAY_AVG'] = balance_in_day_avg
+
+    df_sum['PROFIT_PCT'] = df_sum['PROFIT'] / df_sum['BALANCE']
+    df_sum['OWN_FUNDS'] = max(df_sum['DK_DEPOSIT'].iloc[0] + df_sum['DK_TRANSFER'].iloc[0] + df_sum['DK_WITHDRAWAL'].iloc[0], 0)
+    df_sum['PROFIT_PER_DAY'] = df_sum['PROFIT'] / df_sum['DAYS']
+    df_sum['PROFIT_PER_CAL_DAY'] = df_sum['PROFIT'] / df_sum['CAL_DAYS']
+    df_sum['ROE'] = df_sum['PROFIT'] / df_sum['BALANCE']
+    df_sum['ROE_DAYS'] = df_sum['BALANCE'] / df_sum['PROFIT_PER_CAL_DAY']
+    df_sum['ROI'] = df_sum['PROFIT'] / df_sum['OWN_FUNDS'].iloc[0] if df_sum['OWN_FUNDS'].iloc[0] != 0 else 0
+    df_sum['ROI_DAYS'] = df_sum['OWN_FUNDS'] / df_sum['PROFIT_PER_CAL_DAY']
+    df_sum['WIN_RATE'] = df_sum['HAS_ORDER_PROFIT'] / df_sum['ORDER_ID']
+
+    df_sum['GRID_CNT'] = df_orders['DK_GRID_ID'].nunique()
+    df_sum['MIN_LOT_1000'] = df_grids['DK_LOT_1000'].min()
+    df_sum['AVG_LOT_1000'] = df_grids['DK_LOT_1000'].mean()
+    df_sum['MAX_LOT_1000'] = df_grids['DK_LOT_1000'].max()
+    df_sum['LAST_LOT_1000'] = df_grids.iloc[- 1]['DK_LOT_1000'] if len(df_grids) > 0 else np.nan
+    df_sum['AVG_GRID_ORDER_CNT'] = df_grids['ORDER_ID'].mean()
+    df_sum['MAX_GRID_ORDER_CNT'] = df_grids['ORDER_ID'].max()
+    df_sum['MIN_GRID_DURATION'] = df_grids['DK_DURATION_TD'].min()
+    df_sum['AVG_GRID_DURATION'] = df_grids['DK_DURATION_TD'].mean()
+    df_sum['MAX_GRID_DURATION'] = df_grids['DK_DURATION_TD'].max()
+    df_sum['AVG_GRID_PROFIT'] = df_grids['PROFIT'].mean()
+    df_sum['MAX_GRID_PROFIT'] = df_grids['PROFIT'].max()
+    df_sum['AVG_GRID_DRAWDOWN'] = df_grids['DK_DRAWDOWN'].mean()
+    df_sum['MAX_GRID_DRAWDOWN'] = df_grids['DK_DRAWDOWN'].max()
+    df_sum['AVG_GRID_DRAWDOWN_RATIO'] = df_grids['DK_DRAWDOWN_RATIO'].mean()
+    df_sum['MAX_GRID_DRAWDOWN_RATIO'] = df_grids['DK_DRAWDOWN_RATIO'].max()
+
+    return df_sum.reset_index(drop=True)
+
+
+def assert_summary_equal(df_sum: pd.DataFrame, df_expected: pd.DataFrame) -> None:
+    """Compares summaries with durations in seconds, so nanoseconds of rounded mean don't matter"""
+    df_sum, df_expected = df_sum.reset_index(drop=True), df_expected.reset_index(drop=True)
+    for df in [df_sum, df_expected]:
+        for col in df.columns[df.dtypes == 'timedelta64[ns]']:
+            df[col] = df[col].dt.total_seconds()
+    pd.testing.assert_frame_equal(df_sum, df_expected, check_dtype=False, check_like=True)
+
+
+class TestAnalizer(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls) -> None:
+        cls.df_trans_list = [load_statement_as_trans('statement_roboforex_june.html'),
+                             load_statement_as_trans('statement_roboforex_july.html')]
+        cls.df_orders_list = [load_statement_as_orders('statement_roboforex_june.html'),
+                              load_statement_as_orders('statement_roboforex_july.html')]
+
+        return super().setUpClass()
+
+    def test_set_grid_id_by_one_side_start_equals_iterrows(self):
+        for df in self.df_orders_list:
+            df_expected = set_grid_id_by_one_side_start_iterrows(df, 'DK_GRID_ID')
+            df_res = an.set_grid_id_by_one_side_start(df, 'DK_GRID_ID')
+
+            pd.testing.assert_series_equal(df_res['DK_GRID_ID'], df_expected['DK_GRID_ID'])
+            assert(df_res['DK_GRID_ID'].nunique() > 1)
+
+    def test_set_grid_id_by_timeline_emulating(self):
+        dt = pd.Timestamp('2023-06-01 10:00:00')
+        df = pd.DataFrame({
+            'ORDER_ID': [1, 2, 3, 4, 5],
+            'OPEN_DT': [dt, dt + pd.Timedelta(minutes=1), dt + pd.Timedelta(minutes=5), dt + pd.Timedelta(minutes=10), dt + pd.Timedelta(minutes=11)],
+            'CLOSE_DT': [dt + pd.Timedelta(minutes=3), dt + pd.Timedelta(minutes=5), dt + pd.Timedelta(minutes=6), dt + pd.Timedelta(minutes=12), dt + pd.Timedelta(minutes=11)],
+        })
+
+        # Order 3 opens at the moment of order 2 close, so it joins the 1st grid
+        df_res = an.set_grid_id_by_timeline_emulating(df, 'DK_GRID_ID')
+        assert(list(df_res['DK_GRID_ID']) == [1, 1, 1, 4, 4])
+
+        for df in self.df_orders_list:
+            df_res = an.set_grid_id_by_timeline_emulating(df, 'DK_GRID_ID')
+            assert(df_res['DK_GRID_ID'].isin(df['ORDER_ID']).all())
+            assert((df_res.groupby('DK_GRID_ID')['ORDER_ID'].min() == df_res.groupby('DK_GRID_ID')['DK_GRID_ID'].first()).all())
+
+    def test_calc_drawdown_for_max_grid_order_equals_loop(self):
+        df_grids = pd.DataFrame({
+            'ORDER_ID': range(1, an.EVE_MAX_ORDER_COUNT + 3),
+            'DK_GRID_LAST_PRICE': [1900 + i * 1.79 for i in range(an.EVE_MAX_ORDER_COUNT + 2)],
+            'DK_OPEN_VALUE': [19.5 * i for i in range(1, an.EVE_MAX_ORDER_COUNT + 3)],
+            'QTY': [0.01 * i for i in range(1, an.EVE_MAX_ORDER_COUNT + 3)],
+        })
+
+        expected = df_grids.apply(calc_drawdown_for_max_grid_order_loop, axis=1).to_numpy()
+        res = an.calc_drawdown_for_max_grid_order(grid_order_cnt=df_grids['ORDER_ID'].to_numpy(),
+                                                  last_price=df_grids['DK_GRID_LAST_PRICE'].to_numpy(),
+                                                  open_value=df_grids['DK_OPEN_VALUE'].to_numpy(),
+                                                  qty=df_grids['QTY'].to_numpy())
+
+        np.testing.assert_allclose(res, expected, rtol=1e-9)
+
+    def test_set_worst_grid_price_equals_loop(self):
+        for df in self.df_orders_list:
+            df = an.set_grid_id_by_one_side_start(df, 'DK_GRID_ID')
+            df_expected = set_worst_grid_price_loop(df, 'DK_WORST_PRICE')
+            df_res = an.set_worst_grid_price(df, 'DK_WORST_PRICE')
+
+            pd.testing.assert_series_equal(df_res['DK_WORST_PRICE'], df_expected['DK_WORST_PRICE'])
+
+    def test_delete_canceled_trans_from_df(self):
+        df = pd.DataFrame({
+            'ORDER_ID': [1, 2, 3, 4, 5, 6],
+            'SIDE': ['balance', 'balance', 'balance', 'buy', 'balance', 'balance'],
+            'COMMENT': ['Withdraw CCTT #21197003', 'Deposit CCTT 211', 'Deposit CCTT 2119', 'Start BUY', 'Rebate', 'Withdraw canceled 21197003'],
+        })
+
+        df_pairs = an.get_canceled_trans_pairs(df)
+        assert(df_pairs[['DK_TRANS_CODE', 'ORDER_ID', 'DK_CANCEL_ORDER_ID']].values.tolist() == [[21197003, 1, 6]])
+
+        df_res = an.delete_canceled_trans_from_df(df)
+        assert(list(df_res['ORDER_ID']) == [2, 3, 4, 5])
+
+    def test_analysis_pipeline_equals_step_by_step(self):
+        for df in self.df_trans_list:
+            df_full = an.calc_balance(df)
+            df_orders = an.extend_with_grid_details(df_full)
+            df_grids = an.get_grids(df_orders)
+            df_sum = an.get_summary(df_full=df_full, df_orders=df_orders, df_grids=df_grids)
+            assert_summary_equal(df_sum, get_summary_groupby(df_full=df_full, df_orders=df_orders, df_grids=df_grids))
+
+            pipeline = AnalysisPipeline(df).run(trace_memory=True)
+
+            pd.testing.assert_frame_equal(pipeline.df_full, df_full, check_dtype=False)
+            pd.testing.assert_frame_equal(pipeline.df_orders, df_orders, check_dtype=False)
+            pd.testing.assert_frame_equal(pipeline.df_grids, df_grids, check_dtype=False)
+            pd.testing.assert_frame_equal(pipeline.df_sum, df_sum, check_dtype=False)
+            assert(pipeline.peak_memory > 0)
+
+    def test_incremental_grid_state_equals_get_grids(self):
+        for df in self.df_trans_list:
+            df_grids_expected = AnalysisPipeline(df).run().df_grids
+
+            grid_state = gs.get_empty_grid_state()
+            df_grids = pd.DataFrame(columns=['DK_GRID_ID'] + list(gs.GRID_STATE_AGG_FUNCTIONS.keys()))
+            split_order_id = df['ORDER_ID'].quantile(0.5)
+            for df_new in [df[df['ORDER_ID'] <= split_order_id], df[df['ORDER_ID'] > split_order_id]]:
+                df_open_grids = df_grids[df_grids['DK_GRID_ID'].isin([grid_state['GRID_ID_SELL'], grid_state['GRID_ID_BUY']])]
+                grid_state, df_updated_grids = gs.update_grid_state(df_new, grid_state, df_open_grids)
+                df_grids = pd.concat([df_grids[~df_grids['DK_GRID_ID'].isin(df_updated_grids['DK_GRID_ID'])], df_updated_grids])
+
+            assert(grid_state['LAST_ORDER_ID'] == df['ORDER_ID'].max())
+            assert(abs(grid_state['BALANCE'] - df['PROFIT'].sum() / 100) < 0.001)
+
+            df_grids = gs.get_grids_from_state(df_grids)
+            pd.testing.assert_frame_equal(df_grids.reset_index(drop=True), df_grids_expected.reset_index(drop=True), check_dtype=False)
+
+    def test_get_summary_by_days_equals_get_summary(self):
+        for df in self.df_trans_list:
+            pipeline = AnalysisPipeline(df).run()
+            df_daily = an.calc_daily_rollup(df_full=pipeline.df_full, df_orders=pipeline.df_orders, df_grids=pipeline.df_grids)
+
+            df_sum = an.get_summary_by_days(df_daily)
+            df_sum_expected = get_summary_groupby(df_full=pipeline.df_full, df_orders=pipeline.df_orders, df_grids=pipeline.df_grids)
+            assert_summary_equal(df_sum, df_sum_expected)
+
+    def test_calc_summaries_for_many_windows(self):
+        for df in self.df_trans_list:
+            pipeline = AnalysisPipeline(df).run()
+            days = sorted(pipeline.df_full['OPEN_DT'].dt.date.unique())
+            windows = [(None, None), (days[0], days[len(days) // 2]), (days[len(days) // 2], None), (days[1], days[1])]
+
+            summaries = an.calc_summaries(df_full=pipeline.df_full, df_orders=pipeline.df_orders, df_grids=pipeline.df_grids, windows=windows)
+            assert(all(isinstance(summary, an.Summary) for summary in summaries))
+
+            for summary, (start_date, finish_date) in zip(summaries, windows):
+                start_date = start_date or days[0]
+                finish_date = finish_date or days[-1]
+                df_sum_expected = get_summary_groupby(*[df[(df['OPEN_DT'].dt.date >= start_date) & (df['OPEN_DT'].dt.date <= finish_date)]
+                                                        for df in [pipeline.df_full, pipeline.df_orders, pipeline.df_grids]])
+                assert_summary_equal(summary.to_frame(), df_sum_expected)
+
+    def test_trans_schema_reduces_memory(self):
+        for df in self.df_trans_list:
+            # Trans are loaded from DB as strings
+            df_db = df.astype(str)
+            df_typed = sc.apply_trans_schema(df_db, schema=sc.ANALYSIS_TRANS_SCHEMA)
+
+            for col, dtype in sc.ANALYSIS_TRANS_SCHEMA.items():
+                if col in df_typed.columns:
+                    assert(df_typed[col].dtype == dtype)
+            df_report = sc.get_memory_report(df_db, df_typed)
+            assert(df_report.loc['TOTAL', 'AFTER'] < df_report.loc['TOTAL', 'BEFORE'] / 2)
+
+            np.testing.assert_array_equal(df_typed['ORDER_ID'], df['ORDER_ID'])
+            np.testing.assert_allclose(df_typed['OPEN_PRICE'], df['OPEN_PRICE'], rtol=1e-6)
+            
+            # Trans to persist keep parsed prices
+            np.testing.assert_array_equal(sc.apply_trans_schema(df_db)['OPEN_PRICE'], df['OPEN_PRICE'].astype(float))
+
+            df_sum = AnalysisPipeline(df).run().df_sum
+            df_sum_typed = AnalysisPipeline(df_typed).run().df_sum
+            pd.testing.assert_frame_equal(df_sum_typed, df_sum, check_dtype=False, rtol=1e-4)
+
+    def test_statement_processing_import_does_not_load_matplotlib(self):
+        code = 'import sys, statement_processor.statement_processor; print("matplotlib" in sys.modules)'
+        res = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True)
+        assert(res.stdout.strip() == 'False')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,8 +1,37 @@
 import sqlite3
 import unittest
+import unittest.mock
 import tempfile
+import pathlib
+import shutil
+
+import pandas as pd
 
 import statement_processor.statement_processor as sp
+import statement_processor.batch_ingestion as bi
+import statement_processor.parsed_cache as pc
+import statement_processor.statement_archive as sa
+import statement_processor.ftp_watcher as fw
+import statement_processor.ftp_scanner as fs
+import statement_processor.job_dispatcher as jd
+import statement_processor.db_schema as ds
+import statement_processor.table_writer as tw
+import analizer.schema as sc
+
+
+def create_comments_for_trading_trans_loop(df: pd.DataFrame) -> pd.DataFrame:
+    """Reference loop implementation of sp.create_comments_for_trading_trans"""
+    df = df.copy()
+    df = df.sort_values(by=['CLOSE_DT', 'SIDE', 'ORDER_ID'])
+
+    df_grouped_dt = df.groupby('CLOSE_DT').count()
+    for dt in df_grouped_dt.index:
+        for side in [sp.TYPE_FOR_BUY, sp.TYPE_FOR_SELL]:
+            group_orders_cnt = len(df[(df['CLOSE_DT'] == dt) & (df['SIDE'] == side)])
+            comments_list = [f'Start {side.upper()}'] + [f'{side.upper()} {num}' for num in range(2, group_orders_cnt + 1)]
+            df.loc[(df['CLOSE_DT'] == dt) & (df['SIDE'] == side), 'COMMENT'] = comments_list 
+            
+    return df
 
 class TestStatementProcessor(unittest.TestCase):
     def setUp(self) -> None:
@@ -117,6 +146,506 @@ class TestStatementProcessor(unittest.TestCase):
         res = cur.execute("SELECT SUM(PROFIT) FROM Trans")
         assert(abs(2150517.33-res.fetchone()[0]) < 0.1)
 
+    def test_grid_state_is_updated_incrementally(self):
+        with tempfile.TemporaryDirectory(dir='tests/statement_processor_test') as dst_temp_processing_dir:
+            for src_file_name in ['tests/statement_processor_test/statement_roboforex_june.html',
+                                  'tests/statement_processor_test/statement_roboforex_july.html']:
+                sp.process_statement_file(telegram_user_id=self.telegram_user_id,
+                                          ftp_user_id=self.ftp_user_id,
+                                          src_file_name=src_file_name,
+                                          dst_processing_dir=dst_temp_processing_dir,
+                                          conn=self.conn)
+
+        # Every trading trans is in one of materialized grids
+        cur = self.conn.cursor()
+        res = cur.execute("SELECT COUNT(ORDER_ID) FROM Trans WHERE SIDE IN ('buy', 'sell')")
+        df_grids = sp.load_grids_from_db(ftp_user_id=self.ftp_user_id, conn=self.conn)
+        assert(df_grids['ORDER_ID'].sum() == res.fetchone()[0])
+        
+        res = cur.execute("SELECT LAST_ORDER_ID FROM GridState WHERE FTP_USER_ID = ?", (self.ftp_user_id,))
+        last_order_id = res.fetchone()[0]
+        res = cur.execute("SELECT MAX(CAST(ORDER_ID AS INTEGER)) FROM Trans")
+        assert(last_order_id == res.fetchone()[0])
+
+        # Incrementally updated daily rollup is equal to rollup of all trans
+        df_daily = sp.load_daily_rollup_from_db(ftp_user_id=self.ftp_user_id, conn=self.conn)
+        cur.execute("DELETE FROM DailyRollup")
+        sp.update_daily_rollup_in_db(ftp_user_id=self.ftp_user_id, from_date=df_daily['DAY'].min(), conn=self.conn)
+        df_daily_expected = sp.load_daily_rollup_from_db(ftp_user_id=self.ftp_user_id, conn=self.conn)
+        
+        res = cur.execute("SELECT COUNT(ORDER_ID) FROM Trans")
+        assert(df_daily['ORDER_ID'].sum() == res.fetchone()[0])
+        pd.testing.assert_frame_equal(df_daily, df_daily_expected)
+        
+        # Rollup rows of date range are loaded by key
+        start_date, finish_date = df_daily['DAY'].iloc[5], df_daily['DAY'].iloc[10]
+        df_daily_range = sp.load_daily_rollup_from_db(ftp_user_id=self.ftp_user_id, conn=self.conn, start_date=start_date, finish_date=finish_date)
+        pd.testing.assert_frame_equal(df_daily_range, df_daily.iloc[5:11].reset_index(drop=True), check_dtype=False)
+        
+        # Grids of days from date are read by index
+        df_grids_from = sp.load_grids_from_db(ftp_user_id=self.ftp_user_id, conn=self.conn, from_date=start_date)
+        assert(len(df_grids_from) == (df_grids['OPEN_DT'].dt.date >= start_date).sum())
+        plan = ' '.join(r[-1] for r in cur.execute("EXPLAIN QUERY PLAN SELECT * FROM Grids WHERE FTP_USER_ID = ? AND OPEN_DT >= ?", 
+                                                  (self.ftp_user_id, str(start_date))))
+        assert('ix_Grids_open_dt' in plan)
+        
+        # Trans of later day with the smallest ORDER_ID, e.g. late balance operation, is the first one of balance cumsum
+        from_date = df_daily['DAY'].iloc[10]
+        cur.execute('''UPDATE Trans SET ORDER_ID = (SELECT MIN(ORDER_ID) - 1 FROM Trans) 
+                       WHERE rowid = (SELECT MIN(rowid) FROM Trans WHERE OPEN_DT >= ? AND PROFIT <> 0)''', (str(df_daily['DAY'].iloc[12]), ))
+        cur.execute("DELETE FROM DailyRollup")
+        sp.update_daily_rollup_in_db(ftp_user_id=self.ftp_user_id, from_date=df_daily['DAY'].min(), conn=self.conn)
+        df_daily_full = sp.load_daily_rollup_from_db(ftp_user_id=self.ftp_user_id, conn=self.conn)
+        
+        sp.update_daily_rollup_in_db(ftp_user_id=self.ftp_user_id, from_date=from_date, conn=self.conn)
+        df_daily_incremental = sp.load_daily_rollup_from_db(ftp_user_id=self.ftp_user_id, conn=self.conn)
+        pd.testing.assert_frame_equal(df_daily_incremental, df_daily_full)
+
+    def test_new_trans_and_derived_state_are_saved_in_one_transaction(self):
+        # DailyRollup without rollup cols makes the last step of saving fail after trans and grids are written
+        self.conn.execute('CREATE TABLE DailyRollup (FTP_USER_ID TEXT, DAY TEXT)')
+        
+        with tempfile.TemporaryDirectory(dir='tests/statement_processor_test') as dst_temp_processing_dir:
+            with self.assertRaises(sp.StatementProcessingError):
+                sp.process_statement_file(telegram_user_id=self.telegram_user_id,
+                                          ftp_user_id=self.ftp_user_id,
+                                          src_file_name='tests/statement_processor_test/statement_roboforex_june.html',
+                                          dst_processing_dir=dst_temp_processing_dir,
+                                          conn=self.conn)
+        
+        # Grid state tables are created in the rolled back transaction too
+        cur = self.conn.cursor()
+        table_names = [r[0] for r in cur.execute("SELECT name FROM sqlite_master WHERE type = 'table'")]
+        assert('Trans' in table_names and 'Grids' not in table_names and 'GridState' not in table_names)
+        for table_name in ['Trans', 'ProcessedFiles']:
+            res = cur.execute(f"SELECT COUNT(*) FROM {table_name}")
+            assert(res.fetchone()[0] == 0)
+
+    def test_iter_statement_trans_rows(self):
+        for src_file_name, row_cnt in [('tests/statement_processor_test/statement_mt4_full.htm', 2085),
+                                       ('tests/statement_processor_test/statement_roboforex_june.html', 1350)]:
+            rows = list(sp.iter_statement_trans_rows(src_file_name))
+            assert(len(rows) == row_cnt)
+            
+            # Balance trans have comment from joined <td> and 0 in cols under it
+            row = next(row for row in rows if row['Ticket'] == '69906476')
+            assert(row['Type'] == sp.TYPE_FOR_BALANCE)
+            assert(row['Comment'] == 'Deposit CCTT 21364338')
+            assert(row['Size'] == 0 and row['Close'] == 0)
+            assert(row['Close Time'] == row['Open Time'])
+
+    def test_processed_file_is_skipped_and_appended_trans_are_parsed_only(self):
+        content = pathlib.Path('tests/statement_processor_test/statement_roboforex_june.html').read_bytes()
+        
+        # The same statement before last 350 trans
+        header_end = sp.find_trans_header_end(content)
+        rows_end = sp.find_trans_rows_end(content, start=header_end, row_cnt=1350)
+        content_before = content[:sp.find_trans_rows_end(content, start=header_end, row_cnt=1000)] + content[rows_end:]
+        
+        with tempfile.TemporaryDirectory(dir='tests/statement_processor_test') as dst_temp_processing_dir:
+            df_list = []
+            for file_content in [content_before, content, content]:
+                src_file_name = pathlib.Path(dst_temp_processing_dir).joinpath('statement.htm')
+                src_file_name.write_bytes(file_content)
+                df_list.append(sp.process_statement_file(telegram_user_id=self.telegram_user_id,
+                                                         ftp_user_id=self.ftp_user_id,
+                                                         src_file_name=str(src_file_name),
+                                                         dst_processing_dir=dst_temp_processing_dir,
+                                                         conn=self.conn))
+        
+        assert([len(df) for df in df_list] == [1000, 350, 0])
+        
+        cur = self.conn.cursor()
+        res = cur.execute("SELECT COUNT(ORDER_ID) FROM Trans")
+        assert(res.fetchone()[0] == 1350)
+        res = cur.execute("SELECT SUM(PROFIT) FROM Trans")
+        assert(abs(1443066-res.fetchone()[0]) < 0.1)
+        res = cur.execute("SELECT TRANS_PREFIX_SIZE FROM ProcessedFiles ORDER BY TRANS_PREFIX_SIZE DESC")
+        assert(res.fetchone()[0] == rows_end - header_end)
+
+    def test_appended_trans_are_found_in_new_export_with_other_header(self):
+        content = pathlib.Path('tests/statement_processor_test/statement_roboforex_june.html').read_bytes()
+        header_end = sp.find_trans_header_end(content)
+        rows_end = sp.find_trans_rows_end(content, start=header_end, row_cnt=1350)
+        
+        # Earlier export has 1000 trans. The later one is generated at other time for longer period
+        content_before = content[:sp.find_trans_rows_end(content, start=header_end, row_cnt=1000)] + content[rows_end:]
+        content_after = (content[:header_end].replace(b'2023 July 28, 15:33', b'2023 July 30, 09:12')
+                                             .replace(b'2023-06-30 23:59:59', b'2023-07-01 23:59:59') + content[header_end:])
+        assert(content_after[:header_end] != content[:header_end])
+        
+        with tempfile.TemporaryDirectory(dir='tests/statement_processor_test') as dst_temp_processing_dir:
+            df_list = []
+            for file_content in [content_before, content_after]:
+                src_file_name = pathlib.Path(dst_temp_processing_dir).joinpath('statement.htm')
+                src_file_name.write_bytes(file_content)
+                df_list.append(sp.process_statement_file(telegram_user_id=self.telegram_user_id,
+                                                         ftp_user_id=self.ftp_user_id,
+                                                         src_file_name=str(src_file_name),
+                                                         dst_processing_dir=dst_temp_processing_dir,
+                                                         conn=self.conn))
+        
+        assert([len(df) for df in df_list] == [1000, 350])
+        assert(sp.get_processed_trans_prefix_size(self.ftp_user_id, content_after, self.conn) == rows_end + len(content_after) - len(content))
+
+    def test_batch_ingestion(self):
+        with tempfile.TemporaryDirectory(dir='tests/statement_processor_test') as src_dir:
+            for ftp_user_id, file_names in [(self.ftp_user_id, ['statement_roboforex_june.html', 'statement_roboforex_july.html']),
+                                            ('unknown_ftp_user_id', ['statement_mt4_part.htm'])]:
+                pathlib.Path(src_dir).joinpath(ftp_user_id).mkdir()
+                for idx, file_name in enumerate(file_names):
+                    shutil.copy2(f'tests/statement_processor_test/{file_name}', pathlib.Path(src_dir).joinpath(ftp_user_id, f'{idx}_statement.htm'))
+            
+            files = bi.discover_statement_files(src_dir, pattern='*.htm')
+            with tempfile.TemporaryDirectory(dir='tests/statement_processor_test') as dst_temp_processing_dir:
+                report = bi.ingest_statement_files(files, conn=self.conn, max_workers=2, dst_processing_dir=dst_temp_processing_dir)
+                
+                # Files are archived and cached as process_statement_file() does, FILE_NAME of trans is the archived one
+                archived_files = sa.get_archived_statement_files(dst_temp_processing_dir)
+                assert(sorted(ftp_user_id for ftp_user_id, _, _ in archived_files) == [self.ftp_user_id, self.ftp_user_id, 'unknown_ftp_user_id'])
+                file_names = [r[0] for r in self.conn.execute('SELECT DISTINCT FILE_NAME FROM Trans ORDER BY FILE_NAME')]
+                assert(file_names == sorted(file_name.name for ftp_user_id, file_name, _ in archived_files if ftp_user_id == self.ftp_user_id))
+                assert(file_names == [r[0] for r in self.conn.execute('SELECT FILE_NAME FROM ProcessedFiles ORDER BY FILE_NAME')])
+                for _, file_name, content_hash in archived_files[:2]:
+                    assert(pc.load_parsed_statement(cache_dir=file_name.parent, content_hash=content_hash) is not None)
+        
+        assert(report['FILES'] == 3 and report['FAILED_FILES'] == 1)
+        assert(report['ROWS'] == 1350 + 904 + 2019)
+        assert(report['ROWS_PER_SEC'] > 0)
+        
+        # Trans of both files of user are saved with grid state
+        cur = self.conn.cursor()
+        res = cur.execute("SELECT COUNT(ORDER_ID) FROM Trans")
+        assert(res.fetchone()[0] == report['NEW_ROWS'])
+        res = cur.execute("SELECT LAST_ORDER_ID FROM GridState WHERE FTP_USER_ID = ?", (self.ftp_user_id,))
+        last_order_id = res.fetchone()[0]
+        res = cur.execute("SELECT MAX(ORDER_ID) FROM Trans")
+        assert(last_order_id == res.fetchone()[0])
+
+    def test_process_statement_file_gets_file_details_once(self):
+        src_file_name = 'tests/statement_processor_test/statement_roboforex_june.html'
+        with tempfile.TemporaryDirectory(dir='tests/statement_processor_test') as dst_temp_processing_dir:
+            with unittest.mock.patch.object(sp, 'get_file_details', wraps=sp.get_file_details) as get_file_details:
+                df = sp.process_statement_file(telegram_user_id=self.telegram_user_id,
+                                               ftp_user_id=self.ftp_user_id,
+                                               src_file_name=src_file_name,
+                                               dst_processing_dir=dst_temp_processing_dir,
+                                               conn=self.conn)
+        
+        assert(len(df) == 1350 and get_file_details.call_count == 1)
+
+    def test_statement_archive_stores_content_once(self):
+        src_file_name = 'tests/statement_processor_test/statement_roboforex_june.html'
+        with tempfile.TemporaryDirectory(dir='tests/statement_processor_test') as dst_temp_processing_dir:
+            for _ in range(2):
+                df = sp.process_statement_file(telegram_user_id=self.telegram_user_id,
+                                               ftp_user_id=self.ftp_user_id,
+                                               src_file_name=src_file_name,
+                                               dst_processing_dir=dst_temp_processing_dir,
+                                               conn=self.conn)
+            self.conn.execute('DELETE FROM ProcessedFiles')
+            df = sp.process_statement_file(telegram_user_id=self.telegram_user_id,
+                                           ftp_user_id=self.ftp_user_id,
+                                           src_file_name=src_file_name,
+                                           dst_processing_dir=dst_temp_processing_dir,
+                                           conn=self.conn)
+            
+            # Every FILE_NAME of trans is resolved to the only archived object
+            files = sa.get_archived_statement_files(dst_temp_processing_dir)
+            assert(len(files) == 2)
+            assert(len(list(pathlib.Path(dst_temp_processing_dir).joinpath(sa.ARCHIVE_OBJECTS_DIRNAME).glob('*/*.gz'))) == 1)
+            
+            res = self.conn.execute('SELECT DISTINCT FILE_NAME FROM Trans').fetchone()
+            content = sa.read_archived_statement(pathlib.Path(dst_temp_processing_dir).joinpath(self.ftp_user_id, res[0]))
+            assert(content == pathlib.Path(src_file_name).read_bytes())
+            
+            # Files listed from manifest are read by their content hash
+            for ftp_user_id, file_name, content_hash in files:
+                assert(sa.read_archived_statement(file_name, content_hash=content_hash) == content)
+
+    def test_parsed_statement_is_cached_in_processing_dir(self):
+        src_file_name = 'tests/statement_processor_test/statement_mt4_full.htm'
+        with tempfile.TemporaryDirectory(dir='tests/statement_processor_test') as dst_temp_processing_dir:
+            df = sp.process_statement_file(telegram_user_id=self.telegram_user_id,
+                                           ftp_user_id=self.ftp_user_id,
+                                           src_file_name=src_file_name,
+                                           dst_processing_dir=dst_temp_processing_dir,
+                                           conn=self.conn)
+            
+            cache_dir = pathlib.Path(dst_temp_processing_dir).joinpath(self.ftp_user_id)
+            content_hash = sp.get_content_hash(pathlib.Path(src_file_name).read_bytes())
+            df_cached = pc.load_parsed_statement(cache_dir=cache_dir, content_hash=content_hash)
+            pd.testing.assert_frame_equal(df_cached.astype(object), df.reset_index(drop=True).astype(object))
+            
+            # DB is rebuilt from processing archive by cached statements
+            conn = sqlite3.connect(':memory:')
+            self.conn.backup(conn)
+            conn.execute('DELETE FROM Trans')
+            conn.execute('DELETE FROM ProcessedFiles')
+            report = bi.ingest_statement_files(sa.get_archived_statement_files(dst_temp_processing_dir), conn=conn, max_workers=1)
+            
+            # Cache saved by previous version with float32 prices is parsed again
+            meta_file_name = pc.get_parsed_statement_path(cache_dir, content_hash).joinpath(pc.PARSED_CACHE_META_FILENAME)
+            meta_file_name.write_text(meta_file_name.read_text().replace(f'"version": {pc.PARSED_CACHE_VERSION}', '"version": 1'))
+            assert(pc.load_parsed_statement(cache_dir=cache_dir, content_hash=content_hash) is None)
+        
+        assert(report['FILES'] == 1 and report['NEW_ROWS'] == 2085)
+        
+        # Trans saved from cache are the same as ones saved from HTML
+        sql = 'SELECT * FROM Trans ORDER BY ORDER_ID'
+        assert(conn.execute(sql).fetchall() == self.conn.execute(sql).fetchall())
+
+    def test_save_df_to_db_skips_stored_trans(self):
+        src_file_name = 'tests/statement_processor_test/statement_roboforex_june.html'
+        df = sp.read_html_file_as_roboforex(src_file_name)
+        df = sp.prepare_columns(df=df, 
+                                columns_mapping_dict=sp.COLUMNS_MAPPING_STATEMENT_TEMPLATE[sp.HTMLStatementType.ROBOFOREX_WEB_STATEMENT],
+                                **{'FTP_USER_ID': self.ftp_user_id})
+        
+        # Table created by to_sql before has no primary key
+        df.iloc[:100].to_sql(name='Trans', con=self.conn, index=False)
+        
+        assert(sp.save_df_to_db(df=df, conn=self.conn) == len(df) - 100)
+        assert(sp.save_df_to_db(df=df, conn=self.conn) == 0)
+        
+        cur = self.conn.cursor()
+        res = cur.execute("SELECT COUNT(ORDER_ID) FROM Trans")
+        assert(res.fetchone()[0] == 1350)
+
+    def test_save_df_deduplicates_legacy_table_before_unique_key(self):
+        # Legacy table of bot trans has duplicates of key and rows without key
+        df = pd.DataFrame({'USER_ID': ['1', '1', '1', '2', None], 'ORDER_ID': [10, 10, 11, 10, 12], 'PROFIT': [1.0, 2.0, 3.0, 4.0, 5.0]})
+        df.to_sql(name='BotTrans', con=self.conn, index=False)
+        df.to_sql(name='BotTrans', con=self.conn, index=False, if_exists='append')
+        
+        df_new = pd.DataFrame({'USER_ID': ['1', '3'], 'ORDER_ID': [10, 10], 'PROFIT': [0.0, 6.0], 'COMMENT': ['old', 'new']})
+        assert(tw.save_df(df=df_new, conn=self.conn, table_name='BotTrans', key_columns=['USER_ID', 'ORDER_ID']) == 1)
+        assert(tw.save_df(df=df_new, conn=self.conn, table_name='BotTrans', key_columns=['USER_ID', 'ORDER_ID']) == 0)
+        
+        # The first stored row of every key is kept, rows without key are kept all
+        res = self.conn.execute('SELECT USER_ID, ORDER_ID, PROFIT, COMMENT FROM BotTrans ORDER BY rowid')
+        assert(res.fetchall() == [('1', 10, 1.0, None), ('1', 11, 3.0, None), ('2', 10, 4.0, None), (None, 12, 5.0, None), 
+                                  (None, 12, 5.0, None), ('3', 10, 6.0, 'new')])
+
+    def test_save_df_keeps_unique_key_of_each_writer(self):
+        # Bot and statement processor share table, each with its own key
+        df_bot = pd.DataFrame({'USER_ID': ['1', '1'], 'ORDER_ID': [10, 11], 'PROFIT': [1.0, 2.0]})
+        df_ftp = pd.DataFrame({'FTP_USER_ID': ['f1', 'f1'], 'ORDER_ID': [10, 11], 'PROFIT': [3.0, 4.0]})
+        df_bot.to_sql(name='SharedTrans', con=self.conn, index=False)
+        
+        assert(tw.save_df(df=df_ftp, conn=self.conn, table_name='SharedTrans', key_columns=['FTP_USER_ID', 'ORDER_ID']) == 2)
+        assert(tw.save_df(df=df_bot, conn=self.conn, table_name='SharedTrans', key_columns=['USER_ID', 'ORDER_ID']) == 0)
+        assert(tw.save_df(df=df_ftp, conn=self.conn, table_name='SharedTrans', key_columns=['FTP_USER_ID', 'ORDER_ID']) == 0)
+        
+        assert(sorted(tw.get_table_unique_keys(self.conn, 'SharedTrans')) == [['FTP_USER_ID', 'ORDER_ID'], ['USER_ID', 'ORDER_ID']])
+        assert(self.conn.execute('SELECT COUNT(*) FROM SharedTrans').fetchone()[0] == 4)
+
+    def test_create_comments_for_trading_trans_equals_loop(self):
+        for src_file_name in ['tests/statement_processor_test/statement_mt4_full.htm',
+                              'tests/statement_processor_test/statement_roboforex_june.html']:
+            statement_type = sp.get_file_details(src_file_name)['type']
+            df = sp.PARSE_FUNCTION_FOR_STATEMENT_TEMPLATE[statement_type](src_file_name)
+            df = sp.prepare_columns(df=df, columns_mapping_dict=sp.COLUMNS_MAPPING_STATEMENT_TEMPLATE[statement_type])
+            
+            df_res = sp.create_comments_for_trading_trans(df)
+            pd.testing.assert_frame_equal(df_res, create_comments_for_trading_trans_loop(df))
+            assert(df_res.loc[df_res['ORDER_ID'] == 71409437, 'COMMENT'].iloc[0] == 'Start BUY')
+
+    def test_statement_watchers_report_changed_file_once(self):
+        with tempfile.TemporaryDirectory() as src_dir:
+            pathlib.Path(src_dir).joinpath('111').mkdir()
+            
+            for watcher in [fw.InotifyStatementWatcher(src_dir, debounce_sec=0.1),
+                            fw.PollingStatementWatcher(src_dir, debounce_sec=0.1, polling_interval_sec=0.1)]:
+                assert(watcher.poll(timeout=0.2) == [])
+                
+                # File is written in two parts and into new user dir
+                src_file_name = pathlib.Path(src_dir).joinpath('111', 'statement.htm')
+                with open(src_file_name, 'ab') as f:
+                    f.write(b'<html>')
+                with open(src_file_name, 'ab') as f:
+                    f.write(b'</html>')
+                pathlib.Path(src_dir).joinpath('222').mkdir(exist_ok=True)
+                pathlib.Path(src_dir).joinpath('222', 'statement.htm').write_bytes(b'<html></html>')
+                
+                res = []
+                for _ in range(10):
+                    res += watcher.poll(timeout=0.1)
+                watcher.close()
+                
+                assert(sorted(res) == [('111', src_file_name), ('222', pathlib.Path(src_dir).joinpath('222', 'statement.htm'))])
+
+    def test_scan_ftp_for_updates_updates_modified_accounts_once(self):
+        conn = sqlite3.connect(':memory:')
+        conn.execute('CREATE TABLE ACCOUNTS (FTP_USER_ID TEXT, ACTIVE INTEGER, LAST_CHECK_DT TEXT)')
+        conn.executemany('INSERT INTO ACCOUNTS VALUES (?, ?, ?)', [('111', 1, None), 
+                                                                   ('222', 1, '2000-01-01 00:00:00'),
+                                                                   ('333', 1, '2100-01-01 00:00:00'),
+                                                                   ('444', 0, None),
+                                                                   ('555', 1, None)])
+        
+        with tempfile.TemporaryDirectory() as src_dir:
+            for ftp_user_id in ['111', '222', '333', '444']:
+                pathlib.Path(src_dir).joinpath(ftp_user_id).mkdir()
+                pathlib.Path(src_dir).joinpath(ftp_user_id, 'statement.htm').write_bytes(b'<html></html>')
+            
+            report = fs.scan_ftp_for_updates(conn=conn, src_dir=src_dir, file_name='statement.htm', chunk_size=2)
+            assert(report['ACCOUNTS'] == 4 and sorted(report['FTP_USER_IDS']) == ['111', '222'])
+            
+            res = conn.execute("SELECT COUNT(*) FROM ACCOUNTS WHERE LAST_CHECK_DT > '2001'")
+            assert(res.fetchone()[0] == 3)
+            
+            report = fs.scan_ftp_for_updates(conn=conn, src_dir=src_dir, file_name='statement.htm', chunk_size=2)
+            assert(report['MODIFIED_ACCOUNTS'] == 0)
+
+    def test_scan_ftp_for_updates_finds_file_modified_during_scan(self):
+        conn = sqlite3.connect(':memory:')
+        conn.execute('CREATE TABLE ACCOUNTS (FTP_USER_ID TEXT, ACTIVE INTEGER, LAST_CHECK_DT TEXT)')
+        conn.execute("INSERT INTO ACCOUNTS VALUES ('111', 1, NULL)")
+        
+        with tempfile.TemporaryDirectory() as src_dir:
+            file_name = pathlib.Path(src_dir).joinpath('111', 'statement.htm')
+            file_name.parent.mkdir()
+            file_name.write_bytes(b'<html></html>')
+            
+            # File is modified after its dir is listed, but before scan finishes
+            scan_accounts_chunk = fs._scan_accounts_chunk
+            def scan_accounts_chunk_and_modify_file(*args):
+                res = scan_accounts_chunk(*args)
+                file_name.write_bytes(b'<html>new</html>')
+                return res
+            
+            with unittest.mock.patch.object(fs, '_scan_accounts_chunk', scan_accounts_chunk_and_modify_file):
+                assert(fs.scan_ftp_for_updates(conn=conn, src_dir=src_dir, file_name='statement.htm')['FTP_USER_IDS'] == ['111'])
+            assert(fs.scan_ftp_for_updates(conn=conn, src_dir=src_dir, file_name='statement.htm')['FTP_USER_IDS'] == ['111'])
+
+    def test_job_dispatcher_coalesces_and_prioritizes_jobs(self):
+        now = [0.0]
+        processed = []
+        queues = {jd.JOB_PRIORITY_INTERACTIVE: jd.InProcessQueue('INTERACTIVE'), jd.JOB_PRIORITY_RESCAN: jd.InProcessQueue('RESCAN')}
+        dispatcher = jd.StatementJobDispatcher(func=lambda ftp_user_id, src_file_name: processed.append((ftp_user_id, src_file_name)),
+                                               queues=queues, max_queue_depth=2, clock=lambda: now[0])
+        
+        # Five uploads of one account become one job with the latest file
+        for idx in range(5):
+            dispatcher.submit('111', f'statement_{idx}.htm')
+        for ftp_user_id in ['222', '333']:
+            dispatcher.submit(ftp_user_id, 'statement.htm')
+        dispatcher.submit('444', 'statement.htm', priority=jd.JOB_PRIORITY_INTERACTIVE)
+        
+        now[0] = 3.0
+        assert(dispatcher.dispatch() == 3)
+        
+        # Rescan queue is full, so 333 is pending
+        stats = dispatcher.get_stats()
+        assert(stats['PENDING'] == 1 and stats['COALESCED'] == 4 and stats['QUEUE_DEPTH'] == {'INTERACTIVE': 1, 'RESCAN': 2})
+        assert(stats['WAIT_SEC_MAX'] == 3.0 and stats['OLDEST_PENDING_SEC'] == 3.0)
+        
+        queues[jd.JOB_PRIORITY_INTERACTIVE].run_next()
+        queues[jd.JOB_PRIORITY_RESCAN].run_next()
+        assert(processed == [('444', 'statement.htm'), ('111', 'statement_4.htm')])
+        
+        assert(dispatcher.dispatch() == 1 and dispatcher.get_stats()['PENDING'] == 0)
+
+    def test_job_dispatcher_holds_jobs_of_account_in_flight(self):
+        processed = []
+        queues = {jd.JOB_PRIORITY_INTERACTIVE: jd.InProcessQueue('INTERACTIVE'), jd.JOB_PRIORITY_RESCAN: jd.InProcessQueue('RESCAN')}
+        dispatcher = jd.StatementJobDispatcher(func=lambda ftp_user_id, src_file_name: processed.append((ftp_user_id, src_file_name)),
+                                               queues=queues, max_queue_depth=10)
+        
+        # Queue has room, but account has job in flight, so the next submits are coalesced to one pending job
+        for idx in range(5):
+            dispatcher.submit('111', f'statement_{idx}.htm')
+            dispatcher.dispatch()
+        stats = dispatcher.get_stats()
+        assert(stats['DISPATCHED'] == 1 and stats['IN_FLIGHT'] == 1 and stats['PENDING'] == 1 and stats['COALESCED'] == 3)
+        
+        # Interactive upload of account in flight waits too
+        dispatcher.submit('111', 'statement_5.htm', priority=jd.JOB_PRIORITY_INTERACTIVE)
+        assert(dispatcher.dispatch() == 0)
+        
+        queues[jd.JOB_PRIORITY_RESCAN].run_next()
+        assert(dispatcher.dispatch() == 1 and dispatcher.get_stats()['PENDING'] == 0)
+        queues[jd.JOB_PRIORITY_INTERACTIVE].run_next()
+        assert(processed == [('111', 'statement_0.htm'), ('111', 'statement_5.htm')])
+        
+        # Failed job doesn't hold account
+        dispatcher.func = lambda ftp_user_id, src_file_name: 1 / 0
+        dispatcher.submit('111', 'statement_6.htm')
+        assert(dispatcher.dispatch() == 1)
+        with self.assertRaises(ZeroDivisionError):
+            queues[jd.JOB_PRIORITY_RESCAN].run_next()
+        dispatcher.submit('111', 'statement_7.htm')
+        assert(dispatcher.dispatch() == 1)
+
+    def test_db_schema_migrates_legacy_trans_table(self):
+        src_file_name = 'tests/statement_processor_test/statement_roboforex_june.html'
+        df = sp.read_html_file_as_roboforex(src_file_name)
+        df = sp.prepare_columns(df=df, 
+                                columns_mapping_dict=sp.COLUMNS_MAPPING_STATEMENT_TEMPLATE[sp.HTMLStatementType.ROBOFOREX_WEB_STATEMENT],
+                                **{'FTP_USER_ID': self.ftp_user_id})
+        
+        # Legacy table created by to_sql has duplicated trans
+        pd.concat([df, df.iloc[:100]]).to_sql(name='Trans', con=self.conn, index=False)
+        
+        assert(ds.migrate(self.conn) == ds.SCHEMA_VERSION)
+        assert(ds.migrate(self.conn) == ds.SCHEMA_VERSION)
+        assert(sp.TRANS_KEY_COLUMNS in ds.get_table_unique_keys(self.conn, 'Trans'))
+        assert(self.conn.execute("SELECT COUNT(ORDER_ID) FROM Trans").fetchone()[0] == 1350)
+        
+        # Lookups are done by indexes only
+        for sql in ["SELECT * FROM Trans WHERE FTP_USER_ID = 'x'",
+                    "SELECT * FROM Trans WHERE FTP_USER_ID = 'x' AND OPEN_DT >= '2023-06-01'",
+                    "SELECT ACCOUNT_NUMBER FROM ACCOUNTS WHERE FTP_USER_ID = 'x' AND ACCOUNT_NUMBER = 'y'",
+                    "SELECT FTP_USER_ID, LAST_CHECK_DT FROM ACCOUNTS WHERE ACTIVE = 1 ORDER BY LAST_CHECK_DT"]:
+            plan = ' '.join(r[-1] for r in self.conn.execute(f'EXPLAIN QUERY PLAN {sql}'))
+            assert('USING' in plan and 'TEMP B-TREE' not in plan)
+        
+        assert(sp.save_df_to_db(df=df, conn=self.conn) == 0)
+    
+    def test_db_schema_migration_quarantines_trans_without_key(self):
+        # Bot trans are keyed by USER_ID and have no FTP_USER_ID, they are kept
+        self.conn.execute('CREATE TABLE Trans (ORDER_ID INTEGER, USER_ID TEXT, FTP_USER_ID TEXT, PROFIT REAL)')
+        self.conn.executemany('INSERT INTO Trans VALUES (?, ?, ?, ?)', [(1, 'bot_user', None, 1.0), 
+                                                                       (2, 'bot_user', None, 2.0), 
+                                                                       (2, 'bot_user', None, 2.0), 
+                                                                       (1, None, self.ftp_user_id, 3.0),
+                                                                       (1, None, self.ftp_user_id, 3.0),
+                                                                       (3, None, None, 4.0),
+                                                                       (None, 'bot_user', None, 5.0)])
+        
+        ds.migrate(self.conn)
+        
+        assert(self.conn.execute("SELECT COUNT(*) FROM Trans WHERE USER_ID = 'bot_user'").fetchone()[0] == 2)
+        assert(self.conn.execute("SELECT COUNT(*) FROM Trans WHERE FTP_USER_ID = ?", (self.ftp_user_id, )).fetchone()[0] == 1)
+        assert(self.conn.execute("SELECT PROFIT FROM Trans_quarantine ORDER BY PROFIT").fetchall() == [(4.0, ), (5.0, )])
+    
+    def test_db_schema_migration_keeps_legacy_bot_trans(self):
+        # Bot created Trans first with its own primary key, statement processor migrates it later
+        df_bot = pd.DataFrame({'ORDER_ID': [1, 2], 'PROFIT': [1.0, 2.0], 'USER_ID': ['bot_user', 'bot_user']})
+        tw.save_df(df=df_bot, conn=self.conn, table_name='Trans', key_columns=['USER_ID', 'ORDER_ID'])
+        
+        src_file_name = 'tests/statement_processor_test/statement_roboforex_june.html'
+        df = sp.read_html_file_as_roboforex(src_file_name)
+        df = sp.prepare_columns(df=df, 
+                                columns_mapping_dict=sp.COLUMNS_MAPPING_STATEMENT_TEMPLATE[sp.HTMLStatementType.ROBOFOREX_WEB_STATEMENT],
+                                **{'FTP_USER_ID': self.ftp_user_id})
+        ds.migrate(self.conn)
+        assert(sp.save_df_to_db(df=df, conn=self.conn) == 1350)
+        
+        # Bot keeps saving new uploads to shared Trans, trans already stored are skipped for each writer
+        df_bot_new = pd.DataFrame({'ORDER_ID': [2, 3], 'PROFIT': [2.0, 3.0], 'USER_ID': ['bot_user', 'bot_user']})
+        assert(tw.save_df(df=df_bot_new, conn=self.conn, table_name='Trans', key_columns=['USER_ID', 'ORDER_ID']) == 1)
+        assert(sp.save_df_to_db(df=df, conn=self.conn) == 0)
+        assert(self.conn.execute("SELECT ORDER_ID FROM Trans WHERE USER_ID = 'bot_user'").fetchall() == [(1, ), (2, ), (3, )])
+        assert(self.conn.execute("SELECT COUNT(*) FROM sqlite_master WHERE name = 'Trans_quarantine'").fetchone()[0] == 0)
+    
+    def test_db_schema_benchmark_account_load(self):
+        with tempfile.TemporaryDirectory() as db_dir:
+            report = ds.benchmark_account_load(str(pathlib.Path(db_dir).joinpath('db.sqlite')), total_rows=20000, account_cnt=100, sample_cnt=5)
+        
+        assert(report['SCHEMA_LOAD_SEC'] > 0 and report['LEGACY_LOAD_SEC'] > 0)
+
         
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
@@ -1,9 +1,25 @@
 import os
 import logging
+import multiprocessing
 
 
 TELEGRAM_API = os.getenv('RF_HISTORY_TELEGRAM_API')
 TRANS_TABLE_NAME = 'Trans'
+# Persisted by statement processor for FTP accounts
+ACCOUNTS_TABLE_NAME = 'ACCOUNTS'
+GRIDS_TABLE_NAME = 'Grids'
+DAILY_ROLLUP_TABLE_NAME = 'DailyRollup'
 UPLOAD_FILES_PATH = 'files_received'
 SEND_FILES_PATH = 'files_sent'
 LOG_LEVEL = logging.INFO
+
+# DB access from async handlers
+DATABASE_FILE_NAME = 'db.sqlite'
+DB_MAX_WORKERS = 4 # Threads with own connection. Only one of them writes at a time, readers don't wait it in WAL mode
+DB_BUSY_TIMEOUT_SEC = 30
+
+# Reports are calculated and rendered in process pool
+REPORT_MAX_WORKERS = os.cpu_count()
+REPORT_MAX_CONCURRENCY_PER_USER = 1
+# Workers are started by clean server process, not forked from bot process with running event loop and DB threads
+REPORT_MP_START_METHOD = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
@@ -0,0 +1,53 @@
+import asyncio
+import sqlite3
+import threading
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
+import config
+
+
+class AsyncDB:
+    '''
+        Runs DB functions on bounded thread pool, so async handlers don't block event loop while DB works.
+        Every thread has its own connection. Connection caches prepared statements (sqlite3 default is 128),
+        so the same parameterized SQL is compiled once per thread.
+
+            db = AsyncDB(config.DATABASE_FILE_NAME)
+            df = await db.run(load_df_from_db, user_id)  # Calls load_df_from_db(user_id, conn=<thread connection>)
+    '''
+
+    def __init__(self, database: str, max_workers: int = config.DB_MAX_WORKERS):
+        self.database = database
+        self._local = threading.local()
+        self._connections = []
+        self._connections_lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='db')
+
+    def _get_connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            # Connection is used by its thread only, check_same_thread is off to close it in close()
+            conn = sqlite3.connect(self.database,
+                                   timeout=config.DB_BUSY_TIMEOUT_SEC,
+                                   check_same_thread=False)
+            conn.execute('PRAGMA journal_mode = WAL')
+            conn.execute('PRAGMA synchronous = NORMAL')
+            self._local.conn = conn
+            with self._connections_lock:
+                self._connections.append(conn)
+        return conn
+
+    def _call(self, func, args: tuple, kwargs: dict):
+        return func(*args, conn=self._get_connection(), **kwargs)
+
+    async def run(self, func, *args, **kwargs):
+        """Calls func(*args, conn=conn, **kwargs) in DB thread and returns its result"""
+        return await asyncio.get_running_loop().run_in_executor(self._executor, functools.partial(self._call, func, args, kwargs))
+
+    def close(self) -> None:
+        self._executor.shutdown(wait=True)
+        with self._connections_lock:
+            for conn in self._connections:
+                conn.close()
+            self._connections.clear()
@@ -13,10 +13,14 @@ import os.path
 sys.path.append(
     os.path.abspath(os.path.join(os.path.dirname(__file__), os.path.pardir)))
 
-import dk_dateutil as du
 import exceptions
 import config
+from db import AsyncDB
+from report import ReportPool, build_summary_report, get_interval_dates
 import analizer as an
+import analizer.schema as sc
+import analizer.grid_state as gs
+import statement_processor.table_writer as tw
 
 
 def slugify(value, allow_unicode=False):
@@ -47,15 +51,82 @@ def load_df_from_file(file_name: str, **kwargs) -> pd.DataFrame:
 def load_df_from_db(user_id: str, conn: sqlite3.Connection) -> pd.DataFrame:
     df = pd.read_sql(f'SELECT * FROM {config.TRANS_TABLE_NAME} WHERE USER_ID = :user_id', conn,
                      params={'user_id': user_id})
-    df = an.df_columns_cast(df)
+    df = sc.apply_trans_schema(df, schema=sc.ANALYSIS_TRANS_SCHEMA)
+    logging.debug(f'Trans of {user_id=} loaded {df.shape}. Bytes per row {sc.get_bytes_per_row(df):.0f}')
     return df
 
 
-def save_df_to_db(df: pd.DataFrame, conn: sqlite3.Connection, table_name: str = ''):
+def is_table_exists(table_name: str, conn: sqlite3.Connection) -> bool:
+    return conn.execute("SELECT COUNT(*) FROM sqlite_master WHERE type = 'table' AND name = ?", (table_name,)).fetchone()[0] > 0
+
+
+def get_ftp_user_id(user_id: str, conn: sqlite3.Connection) -> str | None:
+    """Returns FTP user of the first active account assigned to telegram user or None"""
+    if not is_table_exists(config.ACCOUNTS_TABLE_NAME, conn):
+        return None
+
+    res = conn.execute(f'SELECT FTP_USER_ID FROM {config.ACCOUNTS_TABLE_NAME} WHERE TELEGRAM_USER_ID = ? AND ACTIVE = 1 ORDER BY rowid',
+                       (str(user_id),)).fetchone()
+    return None if res is None else res[0]
+
+
+def load_report_data_from_db(user_id: str, interval: str, conn: sqlite3.Connection) -> dict:
+    """Loads data of report.build_summary_report. Runs in DB thread.
+    Account processed from FTP has daily rollup and grids persisted by statement processor,
+    so only their rows of interval are loaded. Otherwise all trans uploaded by user are loaded.
+
+    Returns:
+        dict: {'DF_DAILY', 'DF_GRIDS', 'START_DATE', 'FINISH_DATE'} or {'DF'}
+    """
+    ftp_user_id = get_ftp_user_id(user_id, conn)
+    last_day = None
+    if ftp_user_id is not None and is_table_exists(config.DAILY_ROLLUP_TABLE_NAME, conn) and is_table_exists(config.GRIDS_TABLE_NAME, conn):
+        last_day = conn.execute(f'SELECT MAX(DAY) FROM {config.DAILY_ROLLUP_TABLE_NAME} WHERE FTP_USER_ID = ?', (ftp_user_id,)).fetchone()[0]
+
+    if last_day is None:
+        return {'DF': load_df_from_db(user_id, conn=conn)}
+
+    start_date, finish_date = get_interval_dates(datetime.date.fromisoformat(last_day), interval)
+    params = {'ftp_user_id': ftp_user_id,
+              'start_date': str(start_date) if start_date else '',
+              'finish_date': str(finish_date) if finish_date else '9999-12-31'}
+
+    df_daily = pd.read_sql(f'''SELECT * FROM {config.DAILY_ROLLUP_TABLE_NAME}
+                               WHERE FTP_USER_ID = :ftp_user_id AND DAY >= :start_date AND DAY <= :finish_date ORDER BY DAY''',
+                           conn, params=params)
+    df_daily['DAY'] = pd.to_datetime(df_daily['DAY']).dt.date
+
+    # Grids are taken into interval by day of their OPEN_DT, the same as rollup does
+    params['finish_date'] = str(finish_date + datetime.timedelta(days=1)) if finish_date else '9999-12-31'
+    df_grids = pd.read_sql(f'''SELECT * FROM {config.GRIDS_TABLE_NAME}
+                               WHERE FTP_USER_ID = :ftp_user_id AND OPEN_DT >= :start_date AND OPEN_DT < :finish_date ORDER BY DK_GRID_ID''',
+                           conn, params=params, parse_dates=['OPEN_DT', 'CLOSE_DT', 'LAST_OPEN_DT'])
+    logging.debug(f'Report data of {user_id=} {ftp_user_id=} loaded: {len(df_daily)} days, {len(df_grids)} grids')
+
+    return {'DF_DAILY': df_daily.drop(columns='FTP_USER_ID'),
+            'DF_GRIDS': gs.get_grids_from_state(df_grids.drop(columns='FTP_USER_ID')),
+            'START_DATE': start_date,
+            'FINISH_DATE': finish_date}
+
+
+def save_df_to_db(df: pd.DataFrame, conn: sqlite3.Connection, table_name: str = '') -> int:
+    """Saves trans by one bulk INSERT OR IGNORE, trans already stored for (USER_ID, ORDER_ID) are skipped.
+    Table is prepared the same way as statement processor does, see statement_processor.table_writer.prepare_table()
+
+    Returns:
+        int: Count of inserted rows
+    """
     table_name = config.TRANS_TABLE_NAME if table_name == '' else table_name
+    return tw.save_df(df=df, conn=conn, table_name=table_name, key_columns=['USER_ID', 'ORDER_ID'])
 
-    df = df.set_index(['USER_ID', 'ORDER_ID'])
-    df.to_sql(name=table_name, con=conn, if_exists='append')
+
+def import_file_to_db(file_name: str, conn: sqlite3.Connection, **kwargs) -> int:
+    """Loads uploaded file and saves its new trans to DB. Runs in DB thread
+
+    Returns:
+        int: Count of inserted rows
+    """
+    return save_df_to_db(df=load_df_from_file(file_name, **kwargs), conn=conn)
 
 
 async def get_file_from_message(message, context):
@@ -99,21 +170,8 @@ async def process_uploaded_file(context: ContextTypes.DEFAULT_TYPE) -> None:
     """
     try:
         job = context.job
-        df_file = load_df_from_file(job.data['FILE_NAME'], **job.data)
-
-        main_table_name = config.TRANS_TABLE_NAME
-        temp_table_name = f'{config.TRANS_TABLE_NAME}_{uuid.uuid4().hex}'
-        save_df_to_db(df=df_file, conn=conn, table_name=temp_table_name)
-
-        try:
-            query = f'SELECT * FROM {temp_table_name} WHERE ORDER_ID NOT IN (SELECT ORDER_ID FROM {main_table_name} WHERE USER_ID=:user_id)'
-            df_new_rows = pd.read_sql(query, con=conn, params={
-                                      'user_id': job.data['USER_ID']})
-            save_df_to_db(df=df_new_rows, conn=conn)
-        except:
-            save_df_to_db(df=df_file, conn=conn)
-
-        conn.execute(f'DROP TABLE {temp_table_name};')
+        inserted_cnt = await db.run(import_file_to_db, job.data['FILE_NAME'], **job.data)
+        logging.debug(f'{inserted_cnt} new trans saved from {job.data["FILE_NAME"]}')
 
         context.job_queue.run_once(get_tech_data_stat,
                                    when=0,
@@ -127,7 +185,7 @@ async def get_tech_data_stat(context: ContextTypes.DEFAULT_TYPE) -> None:
     try:
         job = context.job
 
-        df = load_df_from_db(job.data['USER_ID'], conn=conn)
+        df = await db.run(load_df_from_db, job.data['USER_ID'])
 
         min_date = (df['OPEN_DT'].dt.date).min()
         max_date = (df['OPEN_DT'].dt.date).max()
@@ -153,108 +211,15 @@ async def get_tech_data_stat(context: ContextTypes.DEFAULT_TYPE) -> None:
 
 async def get_summary(context: ContextTypes.DEFAULT_TYPE) -> None:
     job = context.job
-    df_full = load_df_from_db(job.data['USER_ID'], conn=conn)
-    df_full = an.calc_balance(df_full)
-
-    interval = job.data['INTERVAL']
-
-    # df_full = an.prepare_columns(df_origin)
-    df_orders = an.extend_with_grid_details(df_full)
-    df_orders = df_orders.sort_values(by='OPEN_DT', ascending=False)
-    df_grids = an.get_grids(df_orders)
-
-    last_open_df_dt = df_full['OPEN_DT'].dt.date.max()
-
-    if interval == 'month':
-        start_date = du.get_start_of_month(last_open_df_dt)
-        finish_date = du.get_finish_of_month(last_open_df_dt)
-
-    if interval == 'monthprev':
-        start_date = du.get_start_of_month(last_open_df_dt)
-        last_open_df_dt = start_date - datetime.timedelta(days=1)
-        start_date = du.get_start_of_month(last_open_df_dt)
-        finish_date = du.get_finish_of_month(last_open_df_dt)
-
-    if interval == 'week':
-        start_date = du.get_start_of_week(last_open_df_dt)
-        finish_date = du.get_finish_of_week(last_open_df_dt)
-
-    if interval == 'weekprev':
-        start_date = du.get_start_of_week(last_open_df_dt)
-        last_open_df_dt = start_date - datetime.timedelta(days=1)
-        start_date = du.get_start_of_week(last_open_df_dt)
-        finish_date = du.get_finish_of_week(last_open_df_dt)
-
-    if interval != 'summary':
-        df_full = df_full[(df_full['OPEN_DT'].dt.date >= start_date) & (
-            df_full['OPEN_DT'].dt.date <= finish_date)]
-        df_orders = df_orders[(df_orders['OPEN_DT'].dt.date >= start_date) & (
-            df_orders['OPEN_DT'].dt.date <= finish_date)]
-        df_grids = df_grids[(df_grids['OPEN_DT'].dt.date >= start_date) & (
-            df_grids['OPEN_DT'].dt.date <= finish_date)]
-
-    df_sum = an.get_summary(df_full=df_full,
-                            df_orders=df_orders,
-                            df_grids=df_grids)
-
-    summary_answer_dict = {'message001': (f"Период: {df_sum.iloc[0]['START_DATE']} - {df_sum.iloc[0]['FINISH_DATE']}\n"
-                                          f"Календарных дней: {df_sum.iloc[0]['CAL_DAYS']:,.0f}\n"
-                                          f"Торговых дней: {df_sum.iloc[0]['DAYS']:,.0f}"),
-
-                           'message002': (f"Пополнения: ${df_sum.iloc[0]['DK_DEPOSIT']:,.2f}\n"
-                                          f"Переводы: ${df_sum.iloc[0]['DK_TRANSFER']:,.2f}\n"
-                                          f"Снятия: ${df_sum.iloc[0]['DK_WITHDRAWAL']:,.2f}\n"
-                                          f"Прочие движения: ${df_sum.iloc[0]['DK_MISC_TRANS']:,.2f}\n"
-                                          f"*Прибыль: ${df_sum.iloc[0]['PROFIT']:,.2f}*\n"),
-                           'message003': (f"Баланс: ${df_sum.iloc[0]['BALANCE']:,.2f}\n"
-                                          f"Собственных средств: ${df_sum.iloc[0]['OWN_FUNDS']:,.2f}"),
-                           'message004': (f"Средний баланс на начало торгового дня: ${df_sum.iloc[0]['BALANCE_IN_DAY_AVG']:,.2f}\n"
-                                          f"Средняя прибыль в календарный день: ${df_sum.iloc[0]['PROFIT_PER_CAL_DAY']:,.2f}\n"
-                                          f"Средняя прибыль в торговый день: ${df_sum.iloc[0]['PROFIT_PER_DAY']:,.2f}\n"
-                                          f"Доходность в календарный день: {df_sum.iloc[0]['PROFIT_PER_CAL_DAY'] / df_sum.iloc[0]['BALANCE_IN_DAY_AVG']*100:,.1f}%\n"
-                                          f"Доходность в месяц: {df_sum.iloc[0]['PROFIT_PER_CAL_DAY'] / df_sum.iloc[0]['BALANCE_IN_DAY_AVG']*30*100:,.1f}%\n"
-                                          f"Доходность в год: {df_sum.iloc[0]['PROFIT_PER_CAL_DAY'] / df_sum.iloc[0]['BALANCE_IN_DAY_AVG']*365*100:,.1f}%"),
-                           'message005': (f"ROE: {df_sum.iloc[0]['ROE']*100:,.1f}%\n"
-                                          f"ROE календарных дней: {df_sum.iloc[0]['ROE_DAYS']:,.0f}\n"
-                                          f"ROI: {df_sum.iloc[0]['ROI']*100:,.1f}%\n"
-                                          f"ROI календарных дней: {df_sum.iloc[0]['ROI_DAYS']:,.0f}"),
-                           'message006': (f"Ордеров: {df_sum.iloc[0]['ORDER_ID']:,.0f}\n"
-                                          f"Прибыльных: {df_sum.iloc[0]['HAS_ORDER_PROFIT']:,.0f}\n"
-                                          f"Win Rate: {df_sum.iloc[0]['WIN_RATE']*100:,.1f}%\n"
-                                          f"Прибыль ордера: AVG=${df_sum.iloc[0]['AVG_ORDER_PROFIT']:,.2f} | MAX=${df_sum.iloc[0]['MAX_ORDER_PROFIT']:,.2f}\n"
-                                          f"Убыток ордера: MAX=${df_sum.iloc[0]['MAX_ORDER_LOSS']:,.2f}"),
-                           'message007': (f"Cеток однонаправленных: {df_sum.iloc[0]['GRID_CNT']:,.0f}\n"
-                                          f"Лот на $1000 депозита: MIN={df_sum.iloc[0]['MIN_LOT_1000']:,.4f} | AVG={df_sum.iloc[0]['AVG_LOT_1000']:,.4f} | MAX={df_sum.iloc[0]['MAX_LOT_1000']:,.4f} | LAST={df_sum.iloc[0]['LAST_LOT_1000']:,.4f}\n"
-                                          f"Ордеров в сетке: AVG={df_sum.iloc[0]['AVG_GRID_ORDER_CNT']:,.1f} | MAX={df_sum.iloc[0]['MAX_GRID_ORDER_CNT']:,.0f}\n"
-                                          f"Длительность сетки: MIN={df_sum.iloc[0]['MIN_GRID_DURATION']} | AVG={df_sum.iloc[0]['AVG_GRID_DURATION']} | MAX={df_sum.iloc[0]['MAX_GRID_DURATION']}\n"
-                                          f"Прибыль сетки: AVG=${df_sum.iloc[0]['AVG_GRID_PROFIT']:,.2f} | MAX=${df_sum.iloc[0]['MAX_GRID_PROFIT']:,.2f}\n"
-                                          f"Просадка сетки: AVG=-${df_sum.iloc[0]['AVG_GRID_DRAWDOWN']:,.2f} | MAX=-${df_sum.iloc[0]['MAX_GRID_DRAWDOWN']:,.2f}\n"
-                                          f"Просадка сетки от депозита: AVG={df_sum.iloc[0]['AVG_GRID_DRAWDOWN_RATIO']*100:,.1f}% | MAX={df_sum.iloc[0]['MAX_GRID_DRAWDOWN_RATIO']*100:,.1f}%"),
-                           }
-
-    for k, v in summary_answer_dict.items():
-        await context.bot.send_message(job.chat_id, text=v, parse_mode='Markdown')
-
-    temp_path = pathlib.Path(f"{config.SEND_FILES_PATH}/{job.data['USER_ID']}")
-    temp_path.mkdir(parents=True, exist_ok=True)  # create path if not exists
-    logging.debug(f'Dir {str(temp_path)} ready/created for pictures')
-
-    time_stamp = datetime.datetime.now().strftime('%Y%m%dT%H%M%S')
-    uuid_file = uuid.uuid4().hex
-    summary_file_name = str(temp_path.joinpath(f'{time_stamp}_{uuid_file}_summary.png'))
-    drawdown_file_name = str(temp_path.joinpath(f'{time_stamp}_{uuid_file}_drawdown.png'))
-
-    fig = an.get_summary_chart(df_grids)
-    fig.savefig(summary_file_name, format='png')
-    logging.debug(f'Summary chart saved in {summary_file_name}')
+    data = await db.run(load_report_data_from_db, job.data['USER_ID'], job.data['INTERVAL'])
+    report = await report_pool.run(job.data['USER_ID'], build_summary_report, data, job.data['INTERVAL'])
 
-    fig = an.get_worst_equity_20_chart(df_grids=df_grids)
-    logging.debug('get_worst_equity_20_chart finished')
-    fig.savefig(drawdown_file_name, format='png')
-    logging.debug(f'Drawdown chart saved in {summary_file_name}')
+    for text in report['MESSAGES']:
+        await context.bot.send_message(job.chat_id, text=text, parse_mode='Markdown')
 
-    await context.bot.send_photo(job.chat_id, photo=open(summary_file_name, 'rb'))
-    await context.bot.send_photo(job.chat_id, photo=open(drawdown_file_name, 'rb'))
+    for png in report['CHARTS']:
+        await context.bot.send_photo(job.chat_id, photo=png)
 
 
-conn = sqlite3.connect('db.sqlite')
+db = AsyncDB(config.DATABASE_FILE_NAME)
+report_pool = ReportPool()
@@ -0,0 +1,166 @@
+import io
+import asyncio
+import datetime
+import functools
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import pandas as pd
+
+import sys
+import os.path
+sys.path.append(
+    os.path.abspath(os.path.join(os.path.dirname(__file__), os.path.pardir)))
+
+import dk_dateutil as du
+import config
+import analizer as an
+from analizer.pipeline import AnalysisPipeline
+
+
+def _init_report_worker() -> None:
+    """Worker renders charts without display and has matplotlib imported before the first report"""
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot
+
+
+def _get_chart_png(fig) -> bytes:
+    import matplotlib.pyplot as plt
+
+    buffer = io.BytesIO()
+    fig.savefig(buffer, format='png')
+    plt.close(fig)  # Long-lived worker keeps every not closed figure
+    return buffer.getvalue()
+
+
+def get_interval_dates(last_date: datetime.date, interval: str) -> tuple[datetime.date, datetime.date]:
+    """Returns (start_date, finish_date) of report interval for account with the last trans on last_date.
+    Interval 'summary' is (None, None) means all days"""
+    start_date, finish_date = None, None
+
+    if interval == 'month':
+        start_date = du.get_start_of_month(last_date)
+        finish_date = du.get_finish_of_month(last_date)
+
+    if interval == 'monthprev':
+        start_date = du.get_start_of_month(last_date)
+        last_date = start_date - datetime.timedelta(days=1)
+        start_date = du.get_start_of_month(last_date)
+        finish_date = du.get_finish_of_month(last_date)
+
+    if interval == 'week':
+        start_date = du.get_start_of_week(last_date)
+        finish_date = du.get_finish_of_week(last_date)
+
+    if interval == 'weekprev':
+        start_date = du.get_start_of_week(last_date)
+        last_date = start_date - datetime.timedelta(days=1)
+        start_date = du.get_start_of_week(last_date)
+        finish_date = du.get_finish_of_week(last_date)
+
+    return start_date, finish_date
+
+
+def build_summary_report(data: dict, interval: str) -> dict:
+    """Calculates summary of trans for interval and renders its charts. Runs in report worker process
+
+    Args:
+        data (dict): Report data loaded from DB by model.load_report_data_from_db:
+            - {'DF_DAILY', 'DF_GRIDS', 'START_DATE', 'FINISH_DATE'}: daily rollup and grids of interval persisted by statement processor
+            - {'DF'}: all trans of user uploaded to bot, they are analyzed from scratch
+        interval (str): One of 'summary', 'month', 'monthprev', 'week', 'weekprev'
+
+    Returns:
+        dict: {'MESSAGES': list of Markdown texts, 'CHARTS': list of PNG bytes}
+    """
+    if 'DF_DAILY' in data:
+        df_sum = an.get_summary_by_days(data['DF_DAILY'], start_date=data['START_DATE'], finish_date=data['FINISH_DATE'])
+        df_grids = data['DF_GRIDS']
+    else:
+        pipeline = AnalysisPipeline(data['DF']).run()
+        df_full, df_orders, df_grids = pipeline.df_full, pipeline.df_orders, pipeline.df_grids
+
+        start_date, finish_date = get_interval_dates(df_full['OPEN_DT'].dt.date.max(), interval)
+        if interval != 'summary':
+            df_daily = an.calc_daily_rollup(df_full=df_full, df_orders=df_orders, df_grids=df_grids)
+            df_sum = an.get_summary_by_days(df_daily, start_date=start_date, finish_date=finish_date)
+
+            df_grids = df_grids[(df_grids['OPEN_DT'].dt.date >= start_date) & (
+                df_grids['OPEN_DT'].dt.date <= finish_date)]
+        else:
+            df_sum = pipeline.df_sum
+
+    summary_answer_dict = {'message001': (f"Период: {df_sum.iloc[0]['START_DATE']} - {df_sum.iloc[0]['FINISH_DATE']}\n"
+                                          f"Календарных дней: {df_sum.iloc[0]['CAL_DAYS']:,.0f}\n"
+                                          f"Торговых дней: {df_sum.iloc[0]['DAYS']:,.0f}"),
+
+                           'message002': (f"Пополнения: ${df_sum.iloc[0]['DK_DEPOSIT']:,.2f}\n"
+                                          f"Переводы: ${df_sum.iloc[0]['DK_TRANSFER']:,.2f}\n"
+                                          f"Снятия: ${df_sum.iloc[0]['DK_WITHDRAWAL']:,.2f}\n"
+                                          f"Прочие движения: ${df_sum.iloc[0]['DK_MISC_TRANS']:,.2f}\n"
+                                          f"*Прибыль: ${df_sum.iloc[0]['PROFIT']:,.2f}*\n"),
+                           'message003': (f"Баланс: ${df_sum.iloc[0]['BALANCE']:,.2f}\n"
+                                          f"Собственных средств: ${df_sum.iloc[0]['OWN_FUNDS']:,.2f}"),
+                           'message004': (f"Средний баланс на начало торгового дня: ${df_sum.iloc[0]['BALANCE_IN_DAY_AVG']:,.2f}\n"
+                                          f"Средняя прибыль в календарный день: ${df_sum.iloc[0]['PROFIT_PER_CAL_DAY']:,.2f}\n"
+                                          f"Средняя прибыль в торговый день: ${df_sum.iloc[0]['PROFIT_PER_DAY']:,.2f}\n"
+                                          f"Доходность в календарный день: {df_sum.iloc[0]['PROFIT_PER_CAL_DAY'] / df_sum.iloc[0]['BALANCE_IN_DAY_AVG']*100:,.1f}%\n"
+                                          f"Доходность в месяц: {df_sum.iloc[0]['PROFIT_PER_CAL_DAY'] / df_sum.iloc[0]['BALANCE_IN_DAY_AVG']*30*100:,.1f}%\n"
+                                          f"Доходность в год: {df_sum.iloc[0]['PROFIT_PER_CAL_DAY'] / df_sum.iloc[0]['BALANCE_IN_DAY_AVG']*365*100:,.1f}%"),
+                           'message005': (f"ROE: {df_sum.iloc[0]['ROE']*100:,.1f}%\n"
+                                          f"ROE календарных дней: {df_sum.iloc[0]['ROE_DAYS']:,.0f}\n"
+                                          f"ROI: {df_sum.iloc[0]['ROI']*100:,.1f}%\n"
+                                          f"ROI календарных дней: {df_sum.iloc[0]['ROI_DAYS']:,.0f}"),
+                           'message006': (f"Ордеров: {df_sum.iloc[0]['ORDER_ID']:,.0f}\n"
+                                          f"Прибыльных: {df_sum.iloc[0]['HAS_ORDER_PROFIT']:,.0f}\n"
+                                          f"Win Rate: {df_sum.iloc[0]['WIN_RATE']*100:,.1f}%\n"
+                                          f"Прибыль ордера: AVG=${df_sum.iloc[0]['AVG_ORDER_PROFIT']:,.2f} | MAX=${df_sum.iloc[0]['MAX_ORDER_PROFIT']:,.2f}\n"
+                                          f"Убыток ордера: MAX=${df_sum.iloc[0]['MAX_ORDER_LOSS']:,.2f}"),
+                           'message007': (f"Cеток однонаправленных: {df_sum.iloc[0]['GRID_CNT']:,.0f}\n"
+                                          f"Лот на $1000 депозита: MIN={df_sum.iloc[0]['MIN_LOT_1000']:,.4f} | AVG={df_sum.iloc[0]['AVG_LOT_1000']:,.4f} | MAX={df_sum.iloc[0]['MAX_LOT_1000']:,.4f} | LAST={df_sum.iloc[0]['LAST_LOT_1000']:,.4f}\n"
+                                          f"Ордеров в сетке: AVG={df_sum.iloc[0]['AVG_GRID_ORDER_CNT']:,.1f} | MAX={df_sum.iloc[0]['MAX_GRID_ORDER_CNT']:,.0f}\n"
+                                          f"Длительность сетки: MIN={df_sum.iloc[0]['MIN_GRID_DURATION']} | AVG={df_sum.iloc[0]['AVG_GRID_DURATION']} | MAX={df_sum.iloc[0]['MAX_GRID_DURATION']}\n"
+                                          f"Прибыль сетки: AVG=${df_sum.iloc[0]['AVG_GRID_PROFIT']:,.2f} | MAX=${df_sum.iloc[0]['MAX_GRID_PROFIT']:,.2f}\n"
+                                          f"Просадка сетки: AVG=-${df_sum.iloc[0]['AVG_GRID_DRAWDOWN']:,.2f} | MAX=-${df_sum.iloc[0]['MAX_GRID_DRAWDOWN']:,.2f}\n"
+                                          f"Просадка сетки от депозита: AVG={df_sum.iloc[0]['AVG_GRID_DRAWDOWN_RATIO']*100:,.1f}% | MAX={df_sum.iloc[0]['MAX_GRID_DRAWDOWN_RATIO']*100:,.1f}%"),
+                           }
+
+    return {
+        'MESSAGES': list(summary_answer_dict.values()),
+        'CHARTS': [_get_chart_png(an.get_summary_chart(df_grids)),
+                   _get_chart_png(an.get_worst_equity_20_chart(df_grids=df_grids))],
+    }
+
+
+class ReportPool:
+    '''
+        Runs report functions in process pool, so analysis and charts don't block event loop of the bot.
+        Every user has at most max_concurrency_per_user reports in work, 
+        so one user asking many reports doesn't take all workers from the others.
+
+            report_pool = ReportPool()
+            report = await report_pool.run(user_id, build_summary_report, data, 'month')
+    '''
+
+    def __init__(self, max_workers: int = config.REPORT_MAX_WORKERS, max_concurrency_per_user: int = config.REPORT_MAX_CONCURRENCY_PER_USER):
+        self.max_concurrency_per_user = max_concurrency_per_user
+        self._executor = ProcessPoolExecutor(max_workers=max_workers, initializer=_init_report_worker,
+                                             mp_context=multiprocessing.get_context(config.REPORT_MP_START_METHOD))
+        self._user_semaphores = {}  # user id -> (asyncio.Semaphore, count of its reports waiting or in work)
+
+    async def run(self, user_id, func, *args, **kwargs):
+        """Calls func(*args, **kwargs) in worker process, when user has a free slot, and returns its result"""
+        semaphore, cnt = self._user_semaphores.get(user_id, (asyncio.Semaphore(self.max_concurrency_per_user), 0))
+        self._user_semaphores[user_id] = (semaphore, cnt + 1)
+        try:
+            async with semaphore:
+                return await asyncio.get_running_loop().run_in_executor(self._executor, functools.partial(func, *args, **kwargs))
+        finally:
+            semaphore, cnt = self._user_semaphores[user_id]
+            if cnt == 1:
+                del self._user_semaphores[user_id]
+            else:
+                self._user_semaphores[user_id] = (semaphore, cnt - 1)
+
+    def close(self) -> None:
+        self._executor.shutdown(wait=True)